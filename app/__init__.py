@@ -15,7 +15,7 @@ login_manager = LoginManager()
 db = SQLAlchemy()
 migrate = Migrate()
 jwt = JWTManager()
-cache = Cache(config={'CACHE_TYPE': 'SimpleCache'})
+cache = Cache()
 
 def create_app(config_class=Config):
     app = Flask(__name__,
@@ -27,6 +27,7 @@ def create_app(config_class=Config):
     # Initialize extensions
     app.config.setdefault('WTF_CSRF_CHECK_DEFAULT', False)
     csrf._exempt_views.add('api.')
+    app.config.setdefault('CACHE_TYPE', 'SimpleCache')
     db.init_app(app)
     jwt.init_app(app)
     cache.init_app(app)
@@ -34,12 +35,38 @@ def create_app(config_class=Config):
     login_manager.init_app(app)
     login_manager.login_view = 'frontend_auth.login'
     migrate.init_app(app, db)
+
+    from app.utils.admin_access import admin_roles
+    from app.utils.availability import availability
+    from app.utils.catalog_cache import catalog_cache
+    from app.utils.data_versions import data_versions
+    from app.utils.etags import user_versions
+    from app.utils.idempotency import idempotency_keys
+    from app.utils.metrics import metrics
+    from app.utils.passwords import passwords
+    from app.utils.payment_queue import payment_queue
+    from app.utils.query_stats import query_stats
+    from app.utils.search_index import search_index
+    from app.utils.stats import rollups
+    from app.utils.user_cache import user_cache
+    admin_roles.init_app(app)
+    availability.init_app(app)
+    catalog_cache.init_app(app)
+    data_versions.init_app(app)
+    idempotency_keys.init_app(app)
+    metrics.init_app(app)
+    passwords.init_app(app)
+    payment_queue.init_app(app)
+    query_stats.init_app(app)
+    rollups.init_app(app)
+    search_index.init_app(app)
+    user_cache.init_app(app)
+    user_versions.init_app(app)
             
     # Add user loader
-    from app.models.user import User
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return user_cache.load(user_id)
     
     # Register blueprints
     from app.routes.api.auth import bp as auth_bp
@@ -3,10 +3,14 @@ from .user import User
 from .car import Car
 from .reservation import Reservation
 from .payment import Payment
+from .payment_job import PaymentJob
 from .insurance import Insurance
 from .damage import DamageReport
 from .user import Admin, Client
 from .favorite import Favorite
 from .refund import Refund
+from .stats import StatsRollup, CarReservationCount
+from .idempotency import IdempotencyKey
+from .data_version import DataVersion
 
-__all__ = ['User', 'Admin', 'Client', 'Car', 'Reservation', 'Payment', 'Insurance', 'DamageReport', 'db', 'Favorite', 'Refund']
\ No newline at end of file
+__all__ = ['User', 'Admin', 'Client', 'Car', 'Reservation', 'Payment', 'PaymentJob', 'Insurance', 'DamageReport', 'db', 'Favorite', 'Refund', 'StatsRollup', 'CarReservationCount', 'IdempotencyKey', 'DataVersion']
\ No newline at end of file
@@ -3,6 +3,7 @@ from datetime import datetime
 
 from app.models.favorite import Favorite
 from app.models.reservation import Reservation
+from app.utils.availability import availability
 
 class Car(db.Model):
     __tablename__ = 'cars'
@@ -23,6 +24,8 @@ class Car(db.Model):
 
     VALID_TYPES = ['sedan', 'suv', '4x4', 'luxury']
     VALID_LOCATIONS = ['city', 'mountains', 'desert', 'snow']
+    # (label, lower bound inclusive, upper bound exclusive) of the price facet
+    PRICE_BUCKETS = [('0-50', 0, 50), ('50-100', 50, 100), ('100-200', 100, 200), ('200+', 200, None)]
 
     def __init__(self, **kwargs):
         if kwargs.get('vehicle_type') not in self.VALID_TYPES:
@@ -34,14 +37,44 @@ class Car(db.Model):
     
     def is_available(self, start_date, end_date):
         """Check if car is available for given dates"""
-        overlapping = Reservation.query.filter(
-            Reservation.car_id == self.id,
+        return self.status == 'available' and availability.is_free(self.id, start_date, end_date)
+    
+    @classmethod
+    def lock(cls, car_id):
+        """Lock the car's row until the end of the transaction so bookings of
+        the same car run one at a time. The no-op UPDATE takes a row lock on
+        PostgreSQL and MySQL and the database write lock on SQLite, waiting up
+        to the busy timeout. Returns False when the car does not exist."""
+        table = cls.__table__
+        result = db.session.execute(
+            table.update().where(table.c.id == car_id).values(id=table.c.id)
+        )
+        return result.rowcount == 1
+
+    @classmethod
+    def lock_many(cls, car_ids):
+        """Lock the rows of several cars with one statement, like lock().
+        Returns how many of the cars exist."""
+        car_ids = sorted(set(car_ids))
+        if not car_ids:
+            return 0
+        table = cls.__table__
+        result = db.session.execute(
+            table.update().where(table.c.id.in_(car_ids)).values(id=table.c.id)
+        )
+        return result.rowcount
+
+    @classmethod
+    def available_between(cls, start_date, end_date):
+        """Filter criterion matching cars with no non-cancelled reservation
+        overlapping the given dates, as a single NOT EXISTS subquery"""
+        return ~db.session.query(Reservation.id).filter(
+            Reservation.car_id == cls.id,
             Reservation.end_date >= start_date,
             Reservation.start_date <= end_date,
             Reservation.status != 'cancelled'
-        ).first()
-        return not overlapping and self.status == 'available'
-    
+        ).exists()
+
     def update_status_based_on_reservations(self):
         """Update car status based on active reservations"""
         active_reservation = Reservation.query.filter(
@@ -52,7 +85,7 @@ class Car(db.Model):
         
         self.status = 'reserved' if active_reservation else 'available'
 
-    def to_dict(self, user_id=None):
+    def to_dict(self, user_id=None, favorited_ids=None):
         """Convert car object to dictionary"""
         data = {
             'id': self.id,
@@ -65,10 +98,18 @@ class Car(db.Model):
             'location': self.location
         }
         if user_id:
-            data['is_favorited'] = Favorite.query.filter_by(
-                user_id=user_id, car_id=self.id
-            ).first() is not None
+            if favorited_ids is None:
+                favorited_ids = Favorite.car_ids_for(user_id)
+            data['is_favorited'] = self.id in favorited_ids
         return data
+
+    @classmethod
+    def annotate_favorites(cls, cars_data, user_id=None):
+        """Add is_favorited to already serialized cars (e.g. from the catalog cache)"""
+        if not user_id:
+            return cars_data
+        favorited_ids = Favorite.car_ids_for(user_id)
+        return [dict(data, is_favorited=data['id'] in favorited_ids) for data in cars_data]
     
     @classmethod
     def get_by_terrain(cls, location):
@@ -81,6 +122,14 @@ class Car(db.Model):
         else:  # city
             return cls.query.filter_by(vehicle_type='sedan')
         
+    @classmethod
+    def price_bucket(cls, price):
+        """Label of the price facet bucket a daily price falls into"""
+        for label, low, high in cls.PRICE_BUCKETS:
+            if price >= low and (high is None or price < high):
+                return label
+        return cls.PRICE_BUCKETS[0][0]
+
     @classmethod
     def infer_category(cls, vehicle_type):
         """Infer category based on vehicle type"""
@@ -6,7 +6,8 @@ class DamageReport(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     description = db.Column(db.Text, nullable=False)
-    repair_cost = db.Column(db.Float, nullable=False)
+    # active_history keeps the old cost available to the stats rollups
+    repair_cost = db.column_property(db.Column(db.Float, nullable=False), active_history=True)
     status = db.Column(db.String(20), default='reported')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     reservation_id = db.Column(db.Integer, db.ForeignKey('reservations.id'))
@@ -14,5 +15,10 @@ class DamageReport(db.Model):
     # Relationship
     reservation = db.relationship('Reservation', back_populates='damage_reports')
 
+    # Admin listing is paginated on (created_at, id)
+    __table_args__ = (
+        db.Index('ix_damage_reports_created_at_id', 'created_at', 'id'),
+    )
+
     def __repr__(self):
         return f'<DamageReport {self.id} for Reservation {self.reservation_id}>'
\ No newline at end of file
@@ -0,0 +1,11 @@
+from app import db
+
+class DataVersion(db.Model):
+    """Counter bumped by every transaction that changes a cached data set"""
+    __tablename__ = 'data_versions'
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DataVersion {self.name}: {self.version}>'
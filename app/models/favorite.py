@@ -1,4 +1,4 @@
-from app import db
+from app import cache, db
 from datetime import datetime
 
 class Favorite(db.Model):
@@ -13,6 +13,20 @@ class Favorite(db.Model):
     user = db.relationship('User', backref='favorites')
     car = db.relationship('Car', backref='favorited_by')
 
+    @classmethod
+    def car_ids_for(cls, user_id):
+        """Set of car ids favorited by a user, cached until their favorites
+        data version changes"""
+        from app.utils.data_versions import data_versions
+        from app.utils.etags import user_versions
+        version, = data_versions.get(user_versions.favorites_name(user_id))
+        key = f'favorites:{int(user_id)}:{version}'
+        car_ids = cache.get(key)
+        if car_ids is None:
+            car_ids = {car_id for (car_id,) in db.session.query(cls.car_id).filter_by(user_id=user_id)}
+            cache.set(key, car_ids)
+        return car_ids
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -0,0 +1,22 @@
+from app import db
+from datetime import datetime
+
+class IdempotencyKey(db.Model):
+    """Outcome of a write request sent with an Idempotency-Key header"""
+    __tablename__ = 'idempotency_keys'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # sha256 of the endpoint, user and key; the key itself is not kept
+    key_hash = db.Column(db.String(64), nullable=False, unique=True)
+    # sha256 of the method, path and body of the first request
+    fingerprint = db.Column(db.String(64), nullable=False)
+    # None while the first request is still running
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    response_headers = db.Column(db.Text)  # JSON object
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key_hash[:12]}: {self.status_code}>'
@@ -5,8 +5,10 @@ class Payment(db.Model):
     __tablename__ = 'payments'
     
     id = db.Column(db.Integer, primary_key=True)
-    amount = db.Column(db.Float, nullable=False)
-    status = db.Column(db.String(20), default='pending')
+    # active_history keeps the old amount available to the stats rollups
+    amount = db.column_property(db.Column(db.Float, nullable=False), active_history=True)
+    # Only settled payments count as revenue, so the rollups need the old status too
+    status = db.column_property(db.Column(db.String(20), default='pending'), active_history=True)
     method = db.Column(db.String(50))
     transaction_id = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -18,6 +20,7 @@ class Payment(db.Model):
 
     VALID_METHODS = ['credit_card', 'debit_card', 'bank_transfer']
     VALID_STATUSES = ['pending', 'completed', 'failed', 'refunded']
+    REVENUE_STATUSES = ['completed', 'refunded']
 
     def __init__(self, **kwargs):
         if kwargs.get('method') not in self.VALID_METHODS:
@@ -0,0 +1,26 @@
+from app import db
+from datetime import datetime
+
+class PaymentJob(db.Model):
+    """Queued work of settling a pending payment with the processor"""
+    __tablename__ = 'payment_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    payment_id = db.Column(db.Integer, db.ForeignKey('payments.id'), nullable=False, unique=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    # Sent with every attempt so the processor charges at most once
+    idempotency_key = db.Column(db.String(64), nullable=False, unique=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # A worker that dies mid-attempt loses the job when its lease expires
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    payment = db.relationship('Payment', backref=db.backref('job', uselist=False))
+
+    VALID_STATUSES = ['queued', 'processing', 'succeeded', 'failed']
+
+    def __repr__(self):
+        return f'<PaymentJob {self.id} for Payment {self.payment_id}: {self.status}>'
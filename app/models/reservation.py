@@ -14,7 +14,10 @@ class Reservation(db.Model):
     
     # Foreign keys
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
-    car_id = db.Column(db.Integer, db.ForeignKey('cars.id'), index=True)
+    # active_history keeps the previous car available to the stats rollups
+    car_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('cars.id'), index=True), active_history=True
+    )
 
     # Relationships
     user = db.relationship('User', back_populates='reservations')
@@ -22,6 +25,12 @@ class Reservation(db.Model):
     payment = db.relationship('Payment', back_populates='reservation', uselist=False)
     damage_reports = db.relationship('DamageReport', back_populates='reservation')
 
+    # Cover the overlap lookups done per car and the admin keyset pagination
+    __table_args__ = (
+        db.Index('ix_reservations_car_dates', 'car_id', 'start_date', 'end_date'),
+        db.Index('ix_reservations_start_date_id', 'start_date', 'id'),
+    )
+
     VALID_STATUSES = ['pending', 'confirmed', 'cancelled', 'completed']
     VALID_RENTAL_TYPES = ['daily', 'monthly', 'yearly']
     
@@ -30,14 +39,43 @@ class Reservation(db.Model):
             raise ValueError(f"Invalid status. Must be one of {self.VALID_STATUSES}")
         super().__init__(**kwargs)
 
+    @classmethod
+    def overlapping(cls, car_id, start_date, end_date):
+        """Query the non-cancelled reservations of a car overlapping the given dates"""
+        return cls.query.filter(
+            cls.car_id == car_id,
+            cls.end_date >= start_date,
+            cls.start_date <= end_date,
+            cls.status != 'cancelled'
+        )
+
+    @classmethod
+    def lock(cls, reservation_id):
+        """Lock the reservation's row until the end of the transaction, the
+        way Car.lock() does for cars"""
+        table = cls.__table__
+        result = db.session.execute(
+            table.update().where(table.c.id == reservation_id).values(id=table.c.id)
+        )
+        return result.rowcount == 1
+
+    @classmethod
+    def overlapping_any(cls, windows):
+        """Query the non-cancelled reservations overlapping any of several
+        (car_id, start_date, end_date) windows, in one statement"""
+        return cls.query.filter(
+            cls.status != 'cancelled',
+            db.or_(*[db.and_(
+                cls.car_id == car_id,
+                cls.end_date >= start_date,
+                cls.start_date <= end_date
+            ) for car_id, start_date, end_date in windows])
+        )
+
     @classmethod
     def calculate_price(cls, car, start_date, end_date, rental_type='daily'):
-        days = (end_date - start_date).days
-        if rental_type == 'monthly':
-            return (car.price_per_day * 30) * 0.9  # 10% discount
-        elif rental_type == 'yearly':
-            return (car.price_per_day * 365) * 0.8  # 20% discount
-        return days * car.price_per_day
+        from app.utils.pricing import quote
+        return quote(car.price_per_day, start_date, end_date, rental_type)
 
     def __repr__(self):
         return f'<Reservation {self.id} for Car {self.car_id} by User {self.user_id}>'
\ No newline at end of file
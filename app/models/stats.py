@@ -0,0 +1,29 @@
+from app import db
+from datetime import datetime
+
+class StatsRollup(db.Model):
+    """Running totals behind /api/admin/stats, spread over STATS_SHARDS rows
+    (slots) that are summed on read"""
+    __tablename__ = 'stats_rollup'
+
+    # Slot holding the totals of the last rebuild
+    ROW_ID = 1
+
+    id = db.Column(db.Integer, primary_key=True)
+    reservations_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    damage_costs = db.Column(db.Float, nullable=False, default=0.0)
+    rebuilt_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StatsRollup {self.reservations_count} reservations>'
+
+class CarReservationCount(db.Model):
+    """Number of reservations per car, used for the popular cars ranking"""
+    __tablename__ = 'car_reservation_counts'
+
+    car_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+    def __repr__(self):
+        return f'<CarReservationCount {self.car_id}: {self.count}>'
@@ -1,14 +1,14 @@
 from datetime import datetime
 from flask_login import UserMixin
 from app import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
 
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
     
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(256), nullable=False)  # scrypt hashes exceed 128
     api_token = db.Column(db.String(256))
     role = db.Column(db.String(20), nullable=False)
     phone = db.Column(db.String(20))
@@ -45,10 +45,12 @@ class User(db.Model, UserMixin):
         return False
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        from app.utils.passwords import passwords
+        self.password_hash = passwords.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        from app.utils.passwords import passwords
+        return passwords.verify(self.password_hash, password)
     
     def generate_api_token(self):
         self.api_token = generate_password_hash(f"{self.id}{datetime.utcnow()}")
@@ -1,15 +1,24 @@
+import csv
+import io
 from datetime import datetime
-from flask import Blueprint, jsonify, request
-from flask import make_response
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload, with_polymorphic
 from app.models import DamageReport, Insurance, Reservation, User, Car, db
-from app.models.payment import Payment
-from app.models.user import Admin, Client
-from app.utils import validate_admin_access
+from app.utils.catalog_cache import catalog_cache
+from app.utils.query_stats import query_stats
+from app.utils.stats import rollups
+from app.utils import (
+    decode_cursor, encode_cursor, get_page_args, keyset_after,
+    validate_admin_access, validate_date
+)
 
 bp = Blueprint('admin', __name__)
 
+EXPORT_COLUMNS = ['ID', 'User Email', 'Car Make', 'Car Model', 'Start Date', 'End Date', 'Total Price', 'Status']
+EXPORT_BATCH_SIZE = 1000  # rows fetched per round trip
+EXPORT_CHUNK_BYTES = 64 * 1024  # bytes buffered before a chunk is sent
+
 def validate_car_data(data):
     """Validate car creation/update data"""
     required_fields = ['make', 'model', 'year', 'price_per_day']
@@ -72,17 +81,69 @@ def add_car():
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+def paginated(query, columns, key, serialize, descending=True):
+    """Serve a listing one keyset page at a time: {"items": [...],
+    "next_cursor": ...}, the next page being requested with ?cursor=.
+
+    columns is the unique sort order of the query, key maps a row to its
+    values in that order."""
+    limit, cursor, error = get_page_args(current_app.config['ADMIN_PAGE_SIZE'])
+    if error:
+        return jsonify({"error": error}), 400
+
+    if cursor:
+        values = decode_cursor(cursor, *[column.type.python_type for column in columns])
+        if values is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+        query = query.filter(keyset_after(columns, values, descending))
+
+    rows = query.limit(limit + 1).all()
+    next_cursor = encode_cursor(*key(rows[limit - 1])) if len(rows) > limit else None
+    return jsonify({
+        "items": [serialize(row) for row in rows[:limit]],
+        "next_cursor": next_cursor
+    })
+
 @bp.route('/users', methods=['GET'])
 @jwt_required()
 def get_users():
     if not validate_admin_access(get_jwt_identity()):
         return jsonify({"error": "Admin access required"}), 403
     try:
-        users = User.query.all()
-        return jsonify([user.to_dict() for user in users])
+        # Admin and Client columns come from the same outer-joined query
+        users = with_polymorphic(User, '*')
+        return paginated(
+            db.session.query(users).order_by(users.id),
+            [users.id],
+            lambda user: (user.id,),
+            lambda user: user.to_dict(),
+            descending=False
+        )
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def serialize_reservation(r):
+    return {
+        'id': r.id,
+        'user': {
+            'id': r.user.id,
+            'email': r.user.email
+        },
+        'car': {
+            'id': r.car.id,
+            'make': r.car.make,
+            'model': r.car.model
+        },
+        'dates': {
+            'start': r.start_date.isoformat(),
+            'end': r.end_date.isoformat()
+        },
+        'status': r.status,
+        'total_price': float(r.total_price),
+        'payment_status': r.payment.status if r.payment else None,
+        'has_damage': len(r.damage_reports) > 0
+    }
+
 @bp.route('/reservations', methods=['GET'])
 @jwt_required()
 def get_all_reservations():
@@ -91,35 +152,21 @@ def get_all_reservations():
         return jsonify({"error": "Admin access required"}), 403
     
     try:
-        reservations = Reservation.query.options(
+        query = Reservation.query.options(
             joinedload(Reservation.user),
             joinedload(Reservation.car),
             joinedload(Reservation.payment),
-            joinedload(Reservation.damage_reports)
+            selectinload(Reservation.damage_reports)
         ).order_by(
-            Reservation.start_date.desc()
-        ).all()
-        
-        return jsonify([{
-            'id': r.id,
-            'user': {
-                'id': r.user.id,
-                'email': r.user.email
-            },
-            'car': {
-                'id': r.car.id,
-                'make': r.car.make,
-                'model': r.car.model
-            },
-            'dates': {
-                'start': r.start_date.isoformat(),
-                'end': r.end_date.isoformat()
-            },
-            'status': r.status,
-            'total_price': float(r.total_price),
-            'payment_status': r.payment.status if r.payment else None,
-            'has_damage': len(r.damage_reports) > 0
-        } for r in reservations])
+            Reservation.start_date.desc(),
+            Reservation.id.desc()
+        )
+        return paginated(
+            query,
+            [Reservation.start_date, Reservation.id],
+            lambda r: (r.start_date, r.id),
+            serialize_reservation
+        )
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -178,6 +225,21 @@ def add_insurance(car_id):
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+def serialize_damage_report(report):
+    return {
+        'id': report.id,
+        'reservation': {
+            'id': report.reservation.id,
+            'user': report.reservation.user.email,
+            'car': f"{report.reservation.car.make} {report.reservation.car.model}"
+        },
+        'description': report.description,
+        'repair_cost': float(report.repair_cost),
+        'status': report.status,
+        'reported_at': report.created_at.isoformat(),
+        'last_updated': report.updated_at.isoformat() if hasattr(report, 'updated_at') else None
+    }
+
 @bp.route('/damage-reports', methods=['GET'])
 @jwt_required()
 def get_damage_reports():
@@ -186,26 +248,19 @@ def get_damage_reports():
         return jsonify({"error": "Admin access required"}), 403
     
     try:
-        reports = DamageReport.query.options(
+        query = DamageReport.query.options(
             joinedload(DamageReport.reservation).joinedload(Reservation.car),
             joinedload(DamageReport.reservation).joinedload(Reservation.user)
         ).order_by(
-            DamageReport.created_at.desc()
-        ).all()
-        
-        return jsonify([{
-            'id': report.id,
-            'reservation': {
-                'id': report.reservation.id,
-                'user': report.reservation.user.email,
-                'car': f"{report.reservation.car.make} {report.reservation.car.model}"
-            },
-            'description': report.description,
-            'repair_cost': float(report.repair_cost),
-            'status': report.status,
-            'reported_at': report.created_at.isoformat(),
-            'last_updated': report.updated_at.isoformat() if hasattr(report, 'updated_at') else None
-        } for report in reports])
+            DamageReport.created_at.desc(),
+            DamageReport.id.desc()
+        )
+        return paginated(
+            query,
+            [DamageReport.created_at, DamageReport.id],
+            lambda report: (report.created_at, report.id),
+            serialize_damage_report
+        )
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -257,55 +312,93 @@ def update_damage_report(report_id):
 @bp.route('/stats', methods=['GET'])
 @jwt_required()
 def get_stats():
+    """Fleet statistics served from the incrementally maintained rollups.
+
+    Pass verify=true to also diff the rollups against a full recompute."""
     if not validate_admin_access(get_jwt_identity()):
         return jsonify({"error": "Admin access required"}), 403
-    
-    # Get top 3 popular cars
-    popular = db.session.query(
-        Reservation.car_id,
-        Car.make,
-        Car.model,
-        db.func.count(Reservation.id).label('count')
-    ).join(Car).group_by(Reservation.car_id, Car.make, Car.model)\
-    .order_by(db.func.count(Reservation.id).desc())\
-    .limit(3).all()
 
-    return jsonify({
-        'reservations_count': Reservation.query.count(),
-        'revenue': float(db.session.query(db.func.sum(Payment.amount)).scalar() or 0),
-        'damage_costs': float(db.session.query(db.func.sum(DamageReport.repair_cost)).scalar() or 0),
-        'popular_cars': [
-            {
-                'car_id': car_id,
-                'make': make,
-                'model': model,
-                'reservation_count': count
-            } for car_id, make, model, count in popular
+    stats = rollups.read()
+    if stats is None:
+        rollups.rebuild()
+        stats = rollups.read()
+
+    if request.args.get('verify', '').lower() in ('1', 'true', 'yes'):
+        stats['verification'] = [
+            {'name': name, 'rollup': actual, 'recomputed': expected}
+            for name, actual, expected in rollups.verify()
         ]
-    })
+    return jsonify(stats)
+
+@bp.route('/cache-stats', methods=['GET'])
+@jwt_required()
+def get_cache_stats():
+    """Hit/miss counters of the catalog cache in this process"""
+    if not validate_admin_access(get_jwt_identity()):
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify(catalog_cache.stats())
+
+@bp.route('/query-stats', methods=['GET'])
+@jwt_required()
+def get_query_stats():
+    """Per-endpoint SQL query counts and database time in this process"""
+    if not validate_admin_access(get_jwt_identity()):
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify(query_stats.stats())
 
 @bp.route('/reservations/export', methods=['GET'])
 @jwt_required()
 def export_reservations():
+    """Stream reservations as CSV, optionally filtered by dates and status"""
     if not validate_admin_access(get_jwt_identity()):
         return jsonify({"error": "Admin access required"}), 403
-    
-    reservations = Reservation.query.options(
-        joinedload(Reservation.user),
-        joinedload(Reservation.car)
-    ).all()
-    
-    csv_data = "ID,User Email,Car Make,Car Model,Start Date,End Date,Total Price,Status\n"
-    for r in reservations:
-        csv_data += (
-            f"{r.id},{r.user.email},{r.car.make},{r.car.model},"
-            f"{r.start_date},{r.end_date},{r.total_price},{r.status}\n"
-        )
-    
-    response = make_response(csv_data)
-    response.headers['Content-Disposition'] = 'attachment; filename=reservations.csv'
-    response.headers['Content-Type'] = 'text/csv'
-    return response
+
+    query = db.session.query(
+        Reservation.id,
+        User.email,
+        Car.make,
+        Car.model,
+        Reservation.start_date,
+        Reservation.end_date,
+        Reservation.total_price,
+        Reservation.status
+    ).outerjoin(User, Reservation.user_id == User.id)\
+    .outerjoin(Car, Reservation.car_id == Car.id)\
+    .order_by(Reservation.id)
+
+    if request.args.get('start_date'):
+        start_date = validate_date(request.args['start_date'])
+        if not start_date:
+            return jsonify({"error": "Invalid start_date. Use YYYY-MM-DD"}), 400
+        query = query.filter(Reservation.start_date >= start_date)
+    if request.args.get('end_date'):
+        end_date = validate_date(request.args['end_date'])
+        if not end_date:
+            return jsonify({"error": "Invalid end_date. Use YYYY-MM-DD"}), 400
+        query = query.filter(Reservation.end_date <= end_date)
+    status = request.args.get('status')
+    if status:
+        if status not in Reservation.VALID_STATUSES:
+            return jsonify({"error": f"Invalid status. Must be one of {Reservation.VALID_STATUSES}"}), 400
+        query = query.filter(Reservation.status == status)
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(EXPORT_COLUMNS)
+        for row in query.yield_per(EXPORT_BATCH_SIZE):
+            writer.writerow(row)
+            if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': 'attachment; filename=reservations.csv'}
+    )
 
 @bp.route('/reservations/<int:reservation_id>', methods=['PUT'])
 @jwt_required()
@@ -1,8 +1,9 @@
 from flask import Blueprint, request, jsonify
-from werkzeug.security import check_password_hash
 from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required
-from app.models.user import Admin, Client, User
-from app import db
+from app.models.user import User
+from app.services import ServiceError
+from app.services.auth import authenticate, register_user
+from app.utils.admin_access import token_claims
 
 bp = Blueprint('auth', __name__)
 
@@ -16,18 +17,13 @@ def login():
     if 'email' not in data or 'password' not in data:
         return jsonify({"error": "Email and password are required"}), 400
     
-    # Check both User table and specific type table
-    user = User.query.filter_by(email=data['email']).first()
-    
-    if not user:
-        return jsonify({"error": "Invalid credentials"}), 401
-    
-    # Verify password against stored hash
-    if not user.check_password(data['password']):
-        return jsonify({"error": "Invalid credentials"}), 401
+    try:
+        user = authenticate(data['email'], data['password'])
+    except ServiceError as e:
+        return jsonify(e.payload), e.status_code
     
     # Include both role and type in response for consistency
-    access_token = create_access_token(identity=user.id)
+    access_token = create_access_token(identity=user.id, additional_claims=token_claims(user))
     return jsonify({
         "access_token": access_token,
         "user_id": user.id,
@@ -49,50 +45,17 @@ def register():
     if not data:
         return jsonify({"error": "No JSON data provided"}), 400
 
-    required_fields = ['email', 'password', 'type']  # Changed from 'role' to 'type'
-    if not all(field in data for field in required_fields):
-        return jsonify({"error": f"Missing required fields: {required_fields}"}), 400
-    
-    # Check for existing email across all user types
-    if User.query.filter_by(email=data['email']).first():
-        return jsonify({"error": "Email already registered"}), 409
-    
     try:
-        if data['type'] == 'admin':
-            if not data.get('perms'):
-                return jsonify({"error": "Perms are required for admins"}), 400
-            
-            # Verify admin creation is allowed (e.g., only by other admins)
-            new_user = Admin(
-                email=data['email'],
-                perms=data.get('perms', 'standard'),
-                role='admin'  # Explicitly set role
-            )
-        else:
-            if not data.get('driving_license'):
-                return jsonify({"error": "Driving license is required for clients"}), 400
-                
-            new_user = Client(
-                email=data['email'],
-                phone=data.get('phone'),
-                driving_license=data['driving_license'],
-                role='client'  # Explicitly set role
-            )
-        
-        new_user.set_password(data['password'])
-        db.session.add(new_user)
-        db.session.commit()
+        new_user = register_user(data)
+    except ServiceError as e:
+        return jsonify(e.payload), e.status_code
         
-        return jsonify({
-            "message": "User created successfully",
-            "user_id": new_user.id,
-            "type": new_user.type,
-            "role": new_user.role
-        }), 201
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({"error": str(e)}), 500
+    return jsonify({
+        "message": "User created successfully",
+        "user_id": new_user.id,
+        "type": new_user.type,
+        "role": new_user.role
+    }), 201
 
 @bp.route('/me', methods=['GET'])
 @jwt_required()
@@ -1,17 +1,63 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy import or_
+from collections import Counter
 from datetime import datetime
 from app.models import Car, DamageReport, Reservation, db
+from app.services import ServiceError
+from app.services.reservations import reserve, reserve_many
+from app.utils import validate_date
+from app.utils.catalog_cache import catalog_cache
+from app.utils.etags import conditional, make_etag
+from app.utils.idempotency import idempotent
+from app.utils.pricing import RENTAL_TYPES, quote_matrix
+from app.utils.search_index import search_index
 
 bp = Blueprint('cars', __name__)
 
+MAX_QUOTE_RANGES = 50
+
+def parse_availability_window():
+    """Read the optional start_date/end_date filter from the query string.
+
+    Returns (start_date, end_date, error) where both dates are None when the
+    filter is not requested."""
+    start = request.args.get('start_date')
+    end = request.args.get('end_date')
+    if not start and not end:
+        return None, None, None
+    if not start or not end:
+        return None, None, "Both start_date and end_date are required"
+    start_date, end_date = validate_date(start), validate_date(end)
+    if not start_date or not end_date:
+        return None, None, "Invalid date format. Use YYYY-MM-DD"
+    if start_date >= end_date:
+        return None, None, "End date must be after start date"
+    return start_date, end_date, None
+
+def cars_etag():
+    # Date-filtered listings depend on reservations, which the catalog version ignores
+    if request.args.get('start_date') or request.args.get('end_date'):
+        return None
+    return make_etag('cars', catalog_cache.version())
+
+def car_details_etag(car_id):
+    return make_etag('car', catalog_cache.version(), car_id)
+
 @bp.route('/', methods=['GET'])
+@conditional(cars_etag)
 def get_cars():
-    """Get all available cars with basic info"""
-    try:
-        cars = Car.query.filter_by(status='available').all()
-        return jsonify([{
+    """Get all available cars with basic info, optionally only those free
+    between start_date and end_date"""
+    start_date, end_date, error = parse_availability_window()
+    if error:
+        return jsonify({"error": error}), 400
+
+    def load():
+        query = Car.query.filter_by(status='available')
+        if start_date:
+            query = query.filter(Car.available_between(start_date, end_date))
+        return [{
             'id': car.id,
             'make': car.make,
             'model': car.model,
@@ -19,16 +65,25 @@ def get_cars():
             'price_per_day': float(car.price_per_day),
             'vehicle_type': car.vehicle_type,
             'location': car.location
-        } for car in cars])
+        } for car in query.all()]
+
+    try:
+        # Date-filtered listings depend on reservations and are not cached
+        if start_date:
+            return jsonify(load())
+        return jsonify(catalog_cache.get_or_set('cars', {}, load))
     except Exception as e:
         return jsonify({"error": "Failed to retrieve cars", "details": str(e)}), 500
 
 @bp.route('/<int:car_id>', methods=['GET'])
+@conditional(car_details_etag)
 def get_car_details(car_id):
     """Get detailed information about a specific car"""
-    try:
-        car = Car.query.get_or_404(car_id)
-        return jsonify({
+    def load():
+        car = Car.query.get(car_id)
+        if not car:
+            return None
+        return {
             'id': car.id,
             'make': car.make,
             'model': car.model,
@@ -42,12 +97,76 @@ def get_car_details(car_id):
                 'type': ins.type,
                 'expiry_date': ins.expiry_date.isoformat()
             } for ins in car.insurances] if car.insurances else None
-        })
+        }
+
+    try:
+        data = catalog_cache.get_or_set('car', {'id': car_id}, load)
+        if data is None:
+            return jsonify({"error": "Car not found"}), 404
+        return jsonify(data)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@bp.route('/quotes', methods=['GET'])
+def get_quotes():
+    """Price every available car (or the given car_id values) for each
+    range=START,END and rental_type. Availability is not checked.
+
+    prices[i][j] of a car is its price for range i and rental type j."""
+    ranges = []
+    for value in request.args.getlist('range'):
+        start, _, end = value.partition(',')
+        start_date, end_date = validate_date(start), validate_date(end)
+        if not start_date or not end_date:
+            return jsonify({"error": "Invalid range, use range=YYYY-MM-DD,YYYY-MM-DD", "range": value}), 400
+        if start_date >= end_date:
+            return jsonify({"error": "End date must be after start date", "range": value}), 400
+        ranges.append((start_date, end_date))
+    if not ranges:
+        return jsonify({"error": "At least one range is required"}), 400
+    if len(ranges) > MAX_QUOTE_RANGES:
+        return jsonify({"error": f"At most {MAX_QUOTE_RANGES} ranges per request"}), 400
+
+    rental_types = request.args.getlist('rental_type') or list(RENTAL_TYPES)
+    invalid = [t for t in rental_types if t not in RENTAL_TYPES]
+    if invalid:
+        return jsonify({"error": "Invalid rental type", "invalid": invalid, "valid": list(RENTAL_TYPES)}), 400
+
+    def load():
+        return [[car_id, float(price)] for car_id, price in db.session.query(
+            Car.id, Car.price_per_day
+        ).filter(Car.status == 'available').order_by(Car.id)]
+
+    try:
+        rates = catalog_cache.get_or_set('car_rates', {}, load)
+        car_ids = request.args.getlist('car_id', type=int)
+        if car_ids:
+            wanted = set(car_ids)
+            rates = [rate for rate in rates if rate[0] in wanted]
+        prices = quote_matrix([price for _, price in rates],
+                              [(end - start).days for start, end in ranges],
+                              rental_types).round(2).tolist()
+    except Exception as e:
+        return jsonify({"error": "Failed to compute quotes", "details": str(e)}), 500
+
+    return jsonify({
+        "currency": "USD",
+        "ranges": [{
+            "start_date": start.isoformat(),
+            "end_date": end.isoformat(),
+            "days": (end - start).days
+        } for start, end in ranges],
+        "rental_types": rental_types,
+        "quotes": [{
+            "car_id": car_id,
+            "price_per_day": price,
+            "prices": car_prices
+        } for (car_id, price), car_prices in zip(rates, prices)]
+    })
+
 @bp.route('/reserve', methods=['POST'])
 @jwt_required()
+@idempotent
 def reserve_car():
     data = request.get_json()
     if not data:
@@ -62,147 +181,168 @@ def reserve_car():
         }), 400
     
     try:
-        user_id = get_jwt_identity()
         start_date = datetime.strptime(data['start_date'], '%Y-%m-%d').date()
         end_date = datetime.strptime(data['end_date'], '%Y-%m-%d').date()
-        
-        # Validate date range
-        if start_date >= end_date:
-            return jsonify({
-                "error": "Invalid date range",
-                "message": "End date must be after start date",
-                "start_date": data['start_date'],
-                "end_date": data['end_date']
-            }), 400
-            
-        if start_date < datetime.now().date():
-            return jsonify({
-                "error": "Invalid start date",
-                "message": "Start date cannot be in the past",
-                "start_date": data['start_date'],
-                "current_date": datetime.now().date().isoformat()
-            }), 400
-
-        car = Car.query.get(data['car_id'])
-        if not car:
-            return jsonify({
-                "error": "Car not found",
-                "car_id": data['car_id']
-            }), 404
-        
-        if not car.is_available(start_date, end_date):
-            # Get conflicting reservations for better error reporting
-            conflicts = Reservation.query.filter(
-                Reservation.car_id == car.id,
-                Reservation.end_date >= start_date,
-                Reservation.start_date <= end_date,
-                Reservation.status != 'cancelled'
-            ).all()
-            
-            return jsonify({
-                "error": "Car not available",
-                "message": "The car is already booked for the selected dates",
-                "conflicting_reservations": [
-                    {
-                        "id": r.id,
-                        "start_date": r.start_date.isoformat(),
-                        "end_date": r.end_date.isoformat(),
-                        "status": r.status
-                    } for r in conflicts
-                ]
-            }), 400
-
-        # Calculate price
-        rental_type = data.get('rental_type', 'daily')
-        if rental_type not in ['daily', 'monthly', 'yearly']:
-            return jsonify({"error": "Invalid rental type"}), 400
-        
-        days = (end_date - start_date).days
-        
-        if rental_type == 'monthly':
-            total_price = float(car.price_per_day) * 30 * 0.9  # 10% monthly discount
-        elif rental_type == 'yearly':
-            total_price = float(car.price_per_day) * 365 * 0.8  # 20% yearly discount
-        else:
-            total_price = float(car.price_per_day) * days
-
-        # Create reservation
-        reservation = Reservation(
-            user_id=user_id,
-            car_id=car.id,
-            start_date=start_date,
-            end_date=end_date,
-            total_price=total_price,
-            rental_type=rental_type,
-            status='pending'
+    except ValueError as e:
+        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+
+    try:
+        reservation = reserve(
+            get_jwt_identity(),
+            data['car_id'],
+            start_date,
+            end_date,
+            data.get('rental_type', 'daily')
         )
+    except ServiceError as e:
+        return jsonify(e.payload), e.status_code
 
-        db.session.add(reservation)
-        db.session.commit()
+    return jsonify({
+        "message": "Reservation created",
+        "reservation_id": reservation.id,
+        "total_price": reservation.total_price,
+        "currency": "USD"
+    }), 201
 
-        return jsonify({
-            "message": "Reservation created",
-            "reservation_id": reservation.id,
-            "total_price": total_price,
-            "currency": "USD"
-        }), 201
-        
-    except ValueError as e:
-        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({"error": str(e)}), 500
+@bp.route('/reserve/bulk', methods=['POST'])
+@jwt_required()
+@idempotent
+def reserve_cars_bulk():
+    """Book several cars at once.
+
+    Body: {"reservations": [{"car_id", "start_date", "end_date", "rental_type"}],
+    "mode": "all_or_nothing" (default) or "best_effort"}. Responds 201 when
+    every item was booked, 207 when only some were and 400 when none was,
+    with one result per item."""
+    data = request.get_json()
+    if not isinstance(data, dict) or not isinstance(data.get('reservations'), list):
+        return jsonify({"error": "Provide a list of reservations"}), 400
+
+    mode = data.get('mode', 'all_or_nothing')
+    try:
+        results = reserve_many(get_jwt_identity(), data['reservations'], mode)
+    except ServiceError as e:
+        return jsonify(e.payload), e.status_code
+
+    created = sum(r['status'] == 'created' for r in results)
+    if created == len(results):
+        status_code = 201
+    elif created:
+        status_code = 207
+    else:
+        status_code = 400
+    return jsonify({
+        "mode": mode,
+        "created": created,
+        "failed": sum(r['status'] == 'failed' for r in results),
+        "results": results,
+        "currency": "USD"
+    }), status_code
+
+def facet_counts(cars):
+    """Counts per vehicle type, location, category and price bucket,
+    computed in one pass over the matching cars"""
+    counts = {
+        'vehicle_type': Counter(),
+        'location': Counter(),
+        'category': Counter(),
+        'price': Counter()
+    }
+    for car in cars:
+        counts['vehicle_type'][car.vehicle_type] += 1
+        counts['location'][car.location] += 1
+        counts['category'][car.category] += 1
+        counts['price'][Car.price_bucket(car.price_per_day)] += 1
+    return {name: dict(counter) for name, counter in counts.items()}
 
 @bp.route('/search', methods=['GET'])
 def search_cars():
-    """Search for available cars with filters"""
+    """Search for available cars with filters.
+
+    With facets=true the response is {"cars": [...], "facets": {...}} where
+    facets counts the matching cars per vehicle type, location, category
+    and price bucket."""
+    start_date, end_date, error = parse_availability_window()
+    if error:
+        return jsonify({"error": error}), 400
+
     try:
         # Get and validate filters
         make = request.args.get('make')
+        model = request.args.get('model')
         min_price = request.args.get('min_price', type=float)
         max_price = request.args.get('max_price', type=float)
         vehicle_type = request.args.get('type')
         location = request.args.get('location')
         category = request.args.get('category')
+        facets = request.args.get('facets', '').lower() in ('1', 'true', 'yes')
 
-        query = Car.query.filter_by(status='available')
-        
-        if vehicle_type and vehicle_type in Car.VALID_TYPES:
-            query = query.filter_by(vehicle_type=vehicle_type)
-        if location and location in Car.VALID_LOCATIONS:
-            query = query.filter_by(location=location)
-        if make:
-            query = query.filter(Car.make.ilike(f'%{make}%'))
-        if min_price is not None and min_price >= 0:
-            query = query.filter(Car.price_per_day >= min_price)
-        if max_price is not None and max_price > 0:
-            query = query.filter(Car.price_per_day <= max_price)
-        if category in ['small', 'medium', 'large']:
-            query = query.filter_by(category=category)
-
-        cars = query.all()
-        return jsonify([{
-            'id': car.id,
-            'make': car.make,
-            'model': car.model,
-            'price_per_day': float(car.price_per_day),
-            'vehicle_type': car.vehicle_type,
-            'location': car.location
-        } for car in cars])
+        def load():
+            query = Car.query.filter_by(status='available')
+            
+            if vehicle_type and vehicle_type in Car.VALID_TYPES:
+                query = query.filter_by(vehicle_type=vehicle_type)
+            if location and location in Car.VALID_LOCATIONS:
+                query = query.filter_by(location=location)
+            if make:
+                query = search_index.filter(query, 'make', make)
+            if model:
+                query = search_index.filter(query, 'model', model)
+            if min_price is not None and min_price >= 0:
+                query = query.filter(Car.price_per_day >= min_price)
+            if max_price is not None and max_price > 0:
+                query = query.filter(Car.price_per_day <= max_price)
+            if category in ['small', 'medium', 'large']:
+                query = query.filter_by(category=category)
+            if start_date:
+                query = query.filter(Car.available_between(start_date, end_date))
+
+            cars = query.all()
+            results = [{
+                'id': car.id,
+                'make': car.make,
+                'model': car.model,
+                'price_per_day': float(car.price_per_day),
+                'vehicle_type': car.vehicle_type,
+                'location': car.location
+            } for car in cars]
+            if facets:
+                return {'cars': results, 'facets': facet_counts(cars)}
+            return results
+
+        # Date-filtered searches depend on reservations and are not cached
+        if start_date:
+            return jsonify(load())
+        return jsonify(catalog_cache.get_or_set('search', {
+            'facets': facets,
+            'make': make,
+            'model': model,
+            'min_price': min_price,
+            'max_price': max_price,
+            'type': vehicle_type,
+            'location': location,
+            'category': category
+        }, load))
         
     except Exception as e:
         return jsonify({"error": "Search failed", "details": str(e)}), 500
     
 @bp.route('/recommended')
+@jwt_required(optional=True)
 def get_recommended_vehicles():
     terrain = request.args.get('terrain')  # desert/mountains/city
-    if terrain == "desert":
-        cars = Car.query.filter_by(vehicle_type='4x4').all()
-    elif terrain == "mountains":
-        cars = Car.query.filter(or_(Car.vehicle_type=='4x4', Car.vehicle_type=='suv')).all()
-    else:  # city
-        cars = Car.query.filter_by(vehicle_type='sedan').all()
-    return jsonify([car.to_dict() for car in cars])
+
+    def load():
+        if terrain == "desert":
+            cars = Car.query.filter_by(vehicle_type='4x4').all()
+        elif terrain == "mountains":
+            cars = Car.query.filter(or_(Car.vehicle_type=='4x4', Car.vehicle_type=='suv')).all()
+        else:  # city
+            cars = Car.query.filter_by(vehicle_type='sedan').all()
+        return [car.to_dict() for car in cars]
+
+    cars = catalog_cache.get_or_set('recommended_vehicles', {'terrain': terrain}, load)
+    return jsonify(Car.annotate_favorites(cars, get_jwt_identity()))
 
 @bp.route('/reservations/<int:reservation_id>/damage', methods=['POST'])
 @jwt_required()
@@ -252,10 +392,15 @@ def report_damage(reservation_id):
         return jsonify({"error": str(e)}), 500
     
 @bp.route('/recommended', methods=['GET'])
+@jwt_required(optional=True)
 def get_recommended():
     terrain = request.args.get('terrain', 'city')
     if terrain not in Car.VALID_LOCATIONS:
         return jsonify({"error": "Invalid terrain type"}), 400
     
-    cars = Car.get_by_terrain(terrain).filter_by(status='available').all()
-    return jsonify([car.to_dict() for car in cars])
+    def load():
+        cars = Car.get_by_terrain(terrain).filter_by(status='available').all()
+        return [car.to_dict() for car in cars]
+
+    cars = catalog_cache.get_or_set('recommended', {'terrain': terrain}, load)
+    return jsonify(Car.annotate_favorites(cars, get_jwt_identity()))
@@ -1,47 +1,27 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models import db, Payment, Reservation, Car
-from datetime import datetime
-from sqlalchemy.orm import joinedload
+from app.models import Payment, Reservation
+from app.services import ServiceError
+from app.services.payments import payment_status, request_payment
+from app.services.reservations import list_user_reservations
+from app.utils.catalog_cache import VERSION_NAME as CATALOG_VERSION
+from app.utils.data_versions import data_versions
+from app.utils.etags import conditional, make_etag, user_versions
+from app.utils.idempotency import idempotent
 
 bp = Blueprint('payments', __name__)
 
+def user_reservations_etag():
+    # Listings embed car details, so catalog changes invalidate them as well
+    user_id = get_jwt_identity()
+    return make_etag('reservations', user_id, *data_versions.get(user_versions.name(user_id), CATALOG_VERSION))
+
 @bp.route('/reservations', methods=['GET'])
 @jwt_required()
+@conditional(user_reservations_etag)
 def user_reservations():
     """Get all reservations for the current user with payment status"""
-    user_id = get_jwt_identity()
-    
-    reservations = Reservation.query.options(
-        joinedload(Reservation.car),
-        joinedload(Reservation.payment)
-    ).filter_by(
-        user_id=user_id
-    ).order_by(
-        Reservation.start_date.desc()
-    ).all()
-    
-    return jsonify([{
-        'id': r.id,
-        'car': {
-            'id': r.car.id,
-            'make': r.car.make,
-            'model': r.car.model,
-            'year': r.car.year
-        },
-        'dates': {
-            'start': r.start_date.isoformat(),
-            'end': r.end_date.isoformat()
-        },
-        'total_price': r.total_price,
-        'status': r.status,
-        'payment': {
-            'status': r.payment.status if r.payment else None,
-            'amount': r.payment.amount if r.payment else None,
-            'date': r.payment.payment_date.isoformat() if r.payment and r.payment.payment_date else None
-        } if r.payment else None,
-        'damage_charge': r.damage_charge
-    } for r in reservations])
+    return jsonify(list_user_reservations(get_jwt_identity()))
 
 @bp.route('/history', methods=['GET'])
 @jwt_required()
@@ -72,7 +52,10 @@ def payment_history():
 
 @bp.route('/process', methods=['POST'])
 @jwt_required()
+@idempotent
 def process_payment():
+    """Queue the payment of a reservation. Responds 202 with the pending
+    payment; poll its status_url for the outcome."""
     data = request.get_json()
     
     if not data:
@@ -84,67 +67,31 @@ def process_payment():
             "required_fields": ["reservation_id", "method (optional)"]
         }), 400
     
-    user_id = get_jwt_identity()
-    
-    # Get reservation with all related data
-    reservation = Reservation.query.options(
-        joinedload(Reservation.car),
-        joinedload(Reservation.payment)
-    ).filter_by(
-        id=data['reservation_id'],
-        user_id=user_id
-    ).first()
-    
-    if not reservation:
-        return jsonify({
-            "error": "Reservation not found",
-            "message": "Either the reservation doesn't exist or doesn't belong to you",
-            "reservation_id": data['reservation_id'],
-            "user_id": user_id
-        }), 404
-    
-    if reservation.status == 'cancelled':
-        return jsonify({
-            "error": "Reservation cancelled",
-            "message": "Cannot process payment for cancelled reservation",
-            "reservation_status": reservation.status
-        }), 400
-    
-    if reservation.payment and reservation.payment.status == 'completed':
-        return jsonify({
-            "error": "Payment already completed",
-            "message": "This reservation has already been paid for",
-            "payment_id": reservation.payment.id,
-            "payment_date": reservation.payment.payment_date.isoformat()
-        }), 400
-    
     try:
-        payment = Payment(
-            amount=reservation.total_price,
-            status='completed',
-            method=data.get('method', 'credit_card'),
-            payment_date=datetime.utcnow(),
-            transaction_id=f"txn_{datetime.utcnow().timestamp()}_{user_id}",
-            reservation_id=reservation.id
+        payment, queued = request_payment(
+            get_jwt_identity(),
+            data['reservation_id'],
+            data.get('method', 'credit_card')
         )
-        
-        reservation.status = 'confirmed'
-        db.session.add(payment)
-        db.session.commit()
-        
-        return jsonify({
-            "message": "Payment processed successfully",
-            "payment_id": payment.id,
-            "amount": float(payment.amount),
-            "reservation_status": reservation.status,
-            "car_details": {
-                "make": reservation.car.make,
-                "model": reservation.car.model
-            }
-        }), 201
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({
-            "error": "Payment processing failed",
-            "details": str(e)
-        }), 500
\ No newline at end of file
+    except ServiceError as e:
+        return jsonify(e.payload), e.status_code
+
+    status_url = url_for('payments.get_payment_status', payment_id=payment.id)
+    return jsonify({
+        "message": "Payment queued" if queued else "Payment already queued",
+        "payment_id": payment.id,
+        "amount": float(payment.amount),
+        "status": payment.status,
+        "status_url": status_url
+    }), 202, {"Location": status_url}
+
+@bp.route('/<int:payment_id>', methods=['GET'])
+@jwt_required()
+def get_payment_status(payment_id):
+    """Status of a payment; ?wait=N holds the request up to N seconds
+    (at most 30) until a pending payment is settled"""
+    wait = request.args.get('wait', 0, type=float)
+    try:
+        return jsonify(payment_status(get_jwt_identity(), payment_id, wait))
+    except ServiceError as e:
+        return jsonify(e.payload), e.status_code
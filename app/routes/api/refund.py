@@ -2,11 +2,13 @@ from datetime import datetime
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.models import Refund, Reservation, db
+from app.utils.idempotency import idempotent
 
 bp = Blueprint('refunds', __name__)
 
 @bp.route('/', methods=['POST'])
 @jwt_required()
+@idempotent
 def request_refund():
     data = request.get_json()
     if not data or 'reservation_id' not in data:
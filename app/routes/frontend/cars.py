@@ -1,21 +1,24 @@
-from flask import Blueprint, current_app, flash, g, redirect, render_template, request, url_for
-from flask_login import login_required
-import requests
+from flask import Blueprint, flash, redirect, render_template, request, url_for
+from flask_login import current_user, login_required
 from app.forms import ReservationForm
-import os
 from app.models import Car
-from app import db
+from app.services import ServiceError
+from app.services.reservations import reserve as reserve_car
+from app.utils.search_index import search_index
 
 bp = Blueprint('frontend_cars', __name__, url_prefix='/cars')
 
 @bp.route('/')
 def list():
     make = request.args.get('make')
+    model = request.args.get('model')
     vehicle_type = request.args.get('type')
     
     query = Car.query.filter_by(status='available')
     if make:
-        query = query.filter(Car.make.ilike(f'%{make}%'))
+        query = search_index.filter(query, 'make', make)
+    if model:
+        query = search_index.filter(query, 'model', model)
     if vehicle_type:
         query = query.filter_by(vehicle_type=vehicle_type)
     
@@ -32,18 +35,10 @@ def detail(car_id):
 def reserve(car_id):
     form = ReservationForm()
     if form.validate_on_submit():
-        reservation_data = {
-            'car_id': car_id,
-            'start_date': form.start_date.data.isoformat(),
-            'end_date': form.end_date.data.isoformat()
-        }
-        response = requests.post(
-            f"{current_app.config['API_BASE_URL']}/reservations",
-            json=reservation_data,
-            headers={'Authorization': f'Bearer {g.user.api_token}'}
-        )
-        if response.status_code == 201:
+        try:
+            reserve_car(current_user.id, car_id, form.start_date.data, form.end_date.data)
             flash('Reservation successful!', 'success')
             return redirect(url_for('frontend_cars.detail', car_id=car_id))
-        flash(response.json().get('error', 'Reservation failed'), 'danger')
+        except ServiceError as e:
+            flash(e.message or 'Reservation failed', 'danger')
     return render_template('cars/detail.html', car=Car.query.get(car_id), form=form)
\ No newline at end of file
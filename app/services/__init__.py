@@ -0,0 +1,18 @@
+"""Business logic shared by the API and frontend blueprints.
+
+Service functions take plain Python values and return plain values or model
+instances. Failures raise ServiceError carrying the JSON payload and status
+code the API responds with; frontend views flash ``payload['error']``.
+"""
+
+class ServiceError(Exception):
+    def __init__(self, payload, status_code=400):
+        if isinstance(payload, str):
+            payload = {"error": payload}
+        super().__init__(payload.get("error"))
+        self.payload = payload
+        self.status_code = status_code
+
+    @property
+    def message(self):
+        return self.payload.get("error")
@@ -0,0 +1,59 @@
+from app import db
+from app.models.user import Admin, Client, User
+from app.services import ServiceError
+from app.utils.passwords import passwords
+
+def authenticate(email, password):
+    """Return the user matching the credentials"""
+    # Check both User table and specific type table
+    user = User.query.filter_by(email=email).first()
+
+    # Verify password against stored hash
+    if not user or not user.check_password(password):
+        raise ServiceError("Invalid credentials", 401)
+
+    # Move the stored hash to the configured scheme while the password is known
+    if passwords.needs_rehash(user.password_hash):
+        user.set_password(password)
+        db.session.commit()
+    return user
+
+def register_user(data):
+    """Create an admin or client account from registration data"""
+    required_fields = ['email', 'password', 'type']  # Changed from 'role' to 'type'
+    if not all(field in data for field in required_fields):
+        raise ServiceError(f"Missing required fields: {required_fields}")
+
+    # Check for existing email across all user types
+    if User.query.filter_by(email=data['email']).first():
+        raise ServiceError("Email already registered", 409)
+
+    if data['type'] == 'admin':
+        if not data.get('perms'):
+            raise ServiceError("Perms are required for admins")
+
+        # Verify admin creation is allowed (e.g., only by other admins)
+        new_user = Admin(
+            email=data['email'],
+            perms=data.get('perms', 'standard'),
+            role='admin'  # Explicitly set role
+        )
+    else:
+        if not data.get('driving_license'):
+            raise ServiceError("Driving license is required for clients")
+
+        new_user = Client(
+            email=data['email'],
+            phone=data.get('phone'),
+            driving_license=data['driving_license'],
+            role='client'  # Explicitly set role
+        )
+
+    try:
+        new_user.set_password(data['password'])
+        db.session.add(new_user)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise ServiceError(str(e), 500)
+    return new_user
@@ -0,0 +1,104 @@
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Payment, Reservation
+from app.services import ServiceError
+from app.utils.payment_queue import payment_queue
+
+# Longest long-poll a status request may ask for, in seconds
+MAX_STATUS_WAIT = 30
+
+def request_payment(user_id, reservation_id, method='credit_card'):
+    """Queue the payment of a reservation and return (payment, queued).
+
+    The payment stays pending until a worker settles it. Asking again while
+    it is pending returns the same payment with queued False, so clients can
+    safely retry; a failed payment is queued again as a new charge."""
+    if method not in Payment.VALID_METHODS:
+        raise ServiceError({
+            "error": "Invalid payment method",
+            "valid_methods": Payment.VALID_METHODS
+        })
+
+    # Concurrent requests for the same reservation queue one payment
+    Reservation.lock(reservation_id)
+    reservation = Reservation.query.options(
+        joinedload(Reservation.payment)
+    ).filter_by(
+        id=reservation_id,
+        user_id=user_id
+    ).first()
+
+    if not reservation:
+        db.session.rollback()
+        raise ServiceError({
+            "error": "Reservation not found",
+            "message": "Either the reservation doesn't exist or doesn't belong to you",
+            "reservation_id": reservation_id,
+            "user_id": user_id
+        }, 404)
+
+    if reservation.status == 'cancelled':
+        db.session.rollback()
+        raise ServiceError({
+            "error": "Reservation cancelled",
+            "message": "Cannot process payment for cancelled reservation",
+            "reservation_status": reservation.status
+        })
+
+    payment = reservation.payment
+    if payment and payment.status == 'pending':
+        db.session.rollback()
+        return payment, False
+
+    if payment and payment.status != 'failed':
+        db.session.rollback()
+        raise ServiceError({
+            "error": "Payment already completed",
+            "message": "This reservation has already been paid for",
+            "payment_id": payment.id,
+            "payment_date": payment.payment_date.isoformat()
+        })
+
+    if payment is None:
+        payment = Payment(
+            amount=reservation.total_price,
+            status='pending',
+            method=method,
+            reservation_id=reservation.id
+        )
+        db.session.add(payment)
+    else:
+        payment.status = 'pending'
+        payment.method = method
+        payment.amount = reservation.total_price
+    payment_queue.enqueue(payment)
+    db.session.commit()
+    payment_queue.notify()
+    return payment, True
+
+def payment_status(user_id, payment_id, wait=0):
+    """Status of one of the user's payments, waiting up to wait seconds for
+    a pending one to settle"""
+    payment = Payment.query.join(Reservation).filter(
+        Payment.id == payment_id,
+        Reservation.user_id == user_id
+    ).first()
+    if not payment:
+        raise ServiceError({"error": "Payment not found", "payment_id": payment_id}, 404)
+
+    if wait > 0 and payment.status == 'pending':
+        payment = payment_queue.wait(payment.id, min(wait, MAX_STATUS_WAIT))
+
+    job = payment.job
+    return {
+        "payment_id": payment.id,
+        "status": payment.status,
+        "amount": float(payment.amount),
+        "method": payment.method,
+        "transaction_id": payment.transaction_id,
+        "date": payment.payment_date.isoformat() if payment.status == 'completed' else None,
+        "reservation_id": payment.reservation_id,
+        "reservation_status": payment.reservation.status if payment.reservation else None,
+        "attempts": job.attempts if job else None,
+        "error": job.last_error if job and payment.status == 'failed' else None
+    }
@@ -0,0 +1,305 @@
+import random
+import time
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Car, Reservation
+from app.services import ServiceError
+from app.utils import validate_date
+from app.utils.availability import availability
+from app.utils.pricing import RENTAL_TYPES, quote
+
+BULK_MODES = ('all_or_nothing', 'best_effort')
+MAX_BULK_RESERVATIONS = 100
+
+def list_user_reservations(user_id):
+    """All reservations of a user with car and payment details"""
+    reservations = Reservation.query.options(
+        joinedload(Reservation.car),
+        joinedload(Reservation.payment)
+    ).filter_by(
+        user_id=user_id
+    ).order_by(
+        Reservation.start_date.desc()
+    ).all()
+
+    return [{
+        'id': r.id,
+        'car': {
+            'id': r.car.id,
+            'make': r.car.make,
+            'model': r.car.model,
+            'year': r.car.year
+        },
+        'dates': {
+            'start': r.start_date.isoformat(),
+            'end': r.end_date.isoformat()
+        },
+        'total_price': r.total_price,
+        'status': r.status,
+        'payment': {
+            'status': r.payment.status if r.payment else None,
+            'amount': r.payment.amount if r.payment else None,
+            'date': r.payment.payment_date.isoformat() if r.payment and r.payment.payment_date else None
+        } if r.payment else None,
+        'damage_charge': r.damage_charge
+    } for r in reservations]
+
+def reserve(user_id, car_id, start_date, end_date, rental_type='daily'):
+    """Book a car for a user, returning the pending reservation"""
+    _check_dates(start_date, end_date)
+
+    car = Car.query.get(car_id)
+    if not car:
+        raise ServiceError({
+            "error": "Car not found",
+            "car_id": car_id
+        }, 404)
+
+    # Cheap early rejection; the check that counts runs under the car lock
+    if not car.is_available(start_date, end_date):
+        raise _not_available(availability.conflicts(car.id, start_date, end_date))
+
+    # Calculate price
+    if rental_type not in RENTAL_TYPES:
+        raise ServiceError("Invalid rental type")
+
+    total_price = quote(car.price_per_day, start_date, end_date, rental_type)
+
+    car_id = car.id
+    return _retrying(lambda: _book(user_id, car_id, start_date, end_date, total_price, rental_type))
+
+def reserve_many(user_id, items, mode='all_or_nothing'):
+    """Book several cars for a user in one transaction.
+
+    items are dicts with car_id, start_date and end_date (YYYY-MM-DD) and an
+    optional rental_type. Availability of every item is checked with one
+    query while holding the locks of all the cars involved; items must not
+    overlap each other either. In all_or_nothing mode a single failing item
+    books nothing, in best_effort mode the other items are still booked.
+
+    Returns one result per item, in order, whose status is "created",
+    "failed" (with the error payload and status_code) or "aborted" (valid,
+    but not booked because another item failed)."""
+    if mode not in BULK_MODES:
+        raise ServiceError({"error": "Invalid mode", "valid": list(BULK_MODES)})
+    if not items:
+        raise ServiceError("No reservations given")
+    if len(items) > MAX_BULK_RESERVATIONS:
+        raise ServiceError(f"At most {MAX_BULK_RESERVATIONS} reservations per request")
+
+    failures = {}
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index, *_parse_item(item)))
+        except ServiceError as e:
+            failures[index] = e
+
+    # Price against the cars loaded in one query; status is re-checked
+    # against the locked rows by _book_many
+    cars = {car.id: car for car in Car.query.filter(Car.id.in_({p[1] for p in parsed}))} if parsed else {}
+    priced = []
+    for index, car_id, start_date, end_date, rental_type in parsed:
+        car = cars.get(car_id)
+        if car is None:
+            failures[index] = ServiceError({"error": "Car not found", "car_id": car_id}, 404)
+        else:
+            priced.append((index, car_id, start_date, end_date, rental_type,
+                           quote(car.price_per_day, start_date, end_date, rental_type)))
+
+    all_or_nothing = mode == 'all_or_nothing'
+    outcomes = {}
+    if priced and failures and all_or_nothing:
+        # Nothing will be booked; still report the other unavailable items
+        outcomes = _check_many(user_id, priced)
+    elif priced:
+        outcomes = _retrying(lambda: _book_many(user_id, priced, all_or_nothing))
+    failures.update((index, o) for index, o in outcomes.items() if isinstance(o, ServiceError))
+    aborted = bool(failures) and all_or_nothing
+    priced_by_index = {p[0]: p for p in priced}
+
+    results = []
+    for index in range(len(items)):
+        if index in failures:
+            error = failures[index]
+            results.append({"index": index, "status": "failed", "status_code": error.status_code, **error.payload})
+            continue
+        _, car_id, _, _, _, total_price = priced_by_index[index]
+        result = {
+            "index": index,
+            "status": "aborted" if aborted else "created",
+            "car_id": car_id,
+            "total_price": total_price
+        }
+        if not aborted:
+            result["reservation_id"] = outcomes[index]
+        results.append(result)
+    return results
+
+def _retrying(book):
+    """Run a booking transaction, retrying it with backoff when waiting for
+    a car lock times out"""
+    retries = current_app.config.get('BOOKING_RETRIES', 3)
+    for attempt in range(retries + 1):
+        try:
+            return book()
+        except OperationalError as e:
+            db.session.rollback()
+            if not _is_lock_timeout(e):
+                raise ServiceError(str(e), 500)
+            if attempt == retries:
+                raise ServiceError({
+                    "error": "Booking busy",
+                    "message": "Too many concurrent bookings, please retry"
+                }, 503)
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+        except ServiceError:
+            raise
+        except Exception as e:
+            db.session.rollback()
+            raise ServiceError(str(e), 500)
+
+def _book(user_id, car_id, start_date, end_date, total_price, rental_type):
+    """Insert the reservation unless it overlaps another one, checking and
+    inserting in one transaction that holds the car's lock"""
+    if not Car.lock(car_id):
+        db.session.rollback()
+        raise ServiceError({"error": "Car not found", "car_id": car_id}, 404)
+
+    conflicts = Reservation.overlapping(car_id, start_date, end_date).all()
+    if conflicts:
+        db.session.rollback()
+        raise _not_available([(r.id, r.start_date, r.end_date, r.status) for r in conflicts])
+
+    reservation = Reservation(
+        user_id=user_id,
+        car_id=car_id,
+        start_date=start_date,
+        end_date=end_date,
+        total_price=total_price,
+        rental_type=rental_type,
+        status='pending'
+    )
+    db.session.add(reservation)
+    db.session.commit()
+    return reservation
+
+def _book_many(user_id, requests, all_or_nothing):
+    """Insert the requested reservations that overlap neither existing
+    reservations nor each other, in one transaction holding the locks of all
+    their cars. Returns {index: reservation id or ServiceError}; nothing is
+    inserted (and the ids are None) when all_or_nothing and any request
+    failed."""
+    Car.lock_many(car_id for _, car_id, *_ in requests)
+    outcomes = _check_many(user_id, requests)
+    reservations = {i: o for i, o in outcomes.items() if isinstance(o, Reservation)}
+    if not reservations or (all_or_nothing and len(reservations) < len(outcomes)):
+        db.session.rollback()
+        return {i: o if isinstance(o, ServiceError) else None for i, o in outcomes.items()}
+    db.session.add_all(reservations.values())
+    db.session.flush()
+    # Read the ids before commit() expires the instances
+    outcomes.update((i, reservation.id) for i, reservation in reservations.items())
+    db.session.commit()
+    return outcomes
+
+def _check_many(user_id, requests):
+    """Check the requests against the cars' status and existing reservations
+    with two queries, and against each other. Returns {index: unsaved
+    Reservation or ServiceError}."""
+    statuses = dict(db.session.query(Car.id, Car.status).filter(
+        Car.id.in_({car_id for _, car_id, *_ in requests})
+    ))
+    existing = {}
+    for r in Reservation.overlapping_any([(car_id, start, end) for _, car_id, start, end, *_ in requests]):
+        existing.setdefault(r.car_id, []).append((r.id, r.start_date, r.end_date, r.status))
+
+    outcomes = {}
+    booked = {}  # car_id -> [(start, end, index)] accepted from this batch
+    for index, car_id, start_date, end_date, rental_type, total_price in requests:
+        if car_id not in statuses:
+            outcomes[index] = ServiceError({"error": "Car not found", "car_id": car_id}, 404)
+            continue
+        conflicts = [c for c in existing.get(car_id, []) if c[2] >= start_date and c[1] <= end_date]
+        if statuses[car_id] != 'available' or conflicts:
+            outcomes[index] = _not_available(conflicts)
+            continue
+        clashes = [i for start, end, i in booked.get(car_id, []) if end >= start_date and start <= end_date]
+        if clashes:
+            outcomes[index] = ServiceError({
+                "error": "Car not available",
+                "message": "The dates overlap another reservation of the same car in this request",
+                "conflicting_items": clashes
+            })
+            continue
+        booked.setdefault(car_id, []).append((start_date, end_date, index))
+        outcomes[index] = Reservation(
+            user_id=user_id,
+            car_id=car_id,
+            start_date=start_date,
+            end_date=end_date,
+            total_price=total_price,
+            rental_type=rental_type,
+            status='pending'
+        )
+    return outcomes
+
+def _check_dates(start_date, end_date):
+    if start_date >= end_date:
+        raise ServiceError({
+            "error": "Invalid date range",
+            "message": "End date must be after start date",
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat()
+        })
+
+    if start_date < datetime.now().date():
+        raise ServiceError({
+            "error": "Invalid start date",
+            "message": "Start date cannot be in the past",
+            "start_date": start_date.isoformat(),
+            "current_date": datetime.now().date().isoformat()
+        })
+
+def _parse_item(item):
+    """(car_id, start_date, end_date, rental_type) of one bulk item"""
+    if not isinstance(item, dict):
+        raise ServiceError("Each reservation must be an object")
+    required_fields = ['car_id', 'start_date', 'end_date']
+    missing = [f for f in required_fields if f not in item]
+    if missing:
+        raise ServiceError({"error": "Missing required fields", "missing": missing, "required": required_fields})
+    car_id = item['car_id']
+    if not isinstance(car_id, int) or isinstance(car_id, bool):
+        raise ServiceError({"error": "Invalid car_id", "car_id": car_id})
+    start_date, end_date = validate_date(str(item['start_date'])), validate_date(str(item['end_date']))
+    if not start_date or not end_date:
+        raise ServiceError("Invalid date format. Use YYYY-MM-DD")
+    _check_dates(start_date, end_date)
+    rental_type = item.get('rental_type', 'daily')
+    if rental_type not in RENTAL_TYPES:
+        raise ServiceError("Invalid rental type")
+    return car_id, start_date, end_date, rental_type
+
+def _not_available(conflicts):
+    return ServiceError({
+        "error": "Car not available",
+        "message": "The car is already booked for the selected dates",
+        "conflicting_reservations": [
+            {
+                "id": rid,
+                "start_date": start.isoformat(),
+                "end_date": end.isoformat(),
+                "status": status
+            } for rid, start, end, status in conflicts
+        ]
+    })
+
+def _is_lock_timeout(error):
+    """SQLite busy timeouts and PostgreSQL deadlock/serialization failures"""
+    if 'database is locked' in str(error.orig):
+        return True
+    return getattr(error.orig, 'pgcode', None) in ('40001', '40P01')
@@ -1,6 +1,9 @@
-from app.models.user import User, Admin
-from flask import jsonify
-from datetime import datetime
+import base64
+import json
+from flask import jsonify, request
+from flask_jwt_extended import get_jwt
+from datetime import date, datetime
+from sqlalchemy import and_, or_
 
 def error_response(message, status_code, details=None):
     return jsonify({
@@ -19,7 +22,55 @@ def validate_date(date_str, format='%Y-%m-%d'):
         return None
 
 def validate_admin_access(user_id):
-    user = User.query.get(user_id)
-    if not user or user.role != 'admin' or user.type != 'admin':
+    """Check admin access for the current JWT, using its role/type claims
+    and a short-lived cache instead of loading the user"""
+    from app.utils.admin_access import admin_roles
+    if user_id is None:
         return False
-    return True
\ No newline at end of file
+    return admin_roles.is_admin(user_id, get_jwt())
+
+def encode_cursor(*values):
+    """Encode the sort key of the last row of a page as an opaque cursor"""
+    raw = json.dumps([v.isoformat() if isinstance(v, (date, datetime)) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, *types):
+    """Decode a cursor made by encode_cursor back into values of the given
+    Python types. Returns None for malformed cursors."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(types):
+            return None
+        return tuple(
+            type_.fromisoformat(value) if issubclass(type_, date) else type_(value)
+            for type_, value in zip(types, values)
+        )
+    except (ValueError, TypeError):
+        return None
+
+def keyset_after(columns, values, descending=True):
+    """Criterion selecting the rows that come strictly after the given key
+    when ordering by the columns"""
+    criteria = []
+    for i, column in enumerate(columns):
+        equal = [c == v for c, v in zip(columns[:i], values[:i])]
+        after = column < values[i] if descending else column > values[i]
+        criteria.append(and_(*equal, after))
+    return or_(*criteria)
+
+def get_page_args(default_limit=100, max_limit=1000):
+    """Read the limit/cursor query parameters of a paginated listing.
+
+    Returns (limit, cursor, error); limit is default_limit when the client
+    gives none, so a listing is never returned unbounded."""
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit')
+    if limit is None:
+        return default_limit, cursor, None
+    try:
+        limit = int(limit)
+    except ValueError:
+        return None, None, "limit must be an integer"
+    if limit < 1 or limit > max_limit:
+        return None, None, f"limit must be between 1 and {max_limit}"
+    return limit, cursor, None
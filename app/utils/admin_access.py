@@ -0,0 +1,76 @@
+"""Admin authorization from JWT claims.
+
+Access tokens carry the user's ``role`` and ``type`` as claims, so admin
+endpoints can reject non-admins without touching the database. A token only
+proves what the user was when it was issued, so admin claims are confirmed
+against the ``users`` table at most once per ``ADMIN_ROLE_CACHE_TTL`` seconds
+and the answer is kept in the app ``cache``. Committing a change to a user's
+role or type, deleting the user, or calling ``revoke`` replaces the cached
+answer immediately; changes made behind the application's back are picked up
+when the entry expires.
+"""
+from app import cache
+from app.utils.session_events import on_commit
+
+
+def token_claims(user):
+    """Additional claims to embed in an access token for the user"""
+    return {'role': user.role, 'type': user.type}
+
+
+class AdminRoles:
+    def init_app(self, app):
+        app.config.setdefault('ADMIN_ROLE_CACHE_TTL', 60)
+        on_commit('admin_roles_changed', self._collect_changes, self._apply_changes)
+
+    @staticmethod
+    def _key(user_id):
+        return f'admin_role:{int(user_id)}'
+
+    def is_admin(self, user_id, claims=None):
+        """Check that the user is an admin, trusting the token claims for
+        non-admins and a recent database check for admins"""
+        if claims and 'role' in claims and 'type' in claims:
+            if claims['role'] != 'admin' or claims['type'] != 'admin':
+                return False
+        allowed = cache.get(self._key(user_id))
+        if allowed is None:
+            allowed = self._check(user_id)
+            cache.set(self._key(user_id), allowed, timeout=self._ttl())
+        return allowed
+
+    @staticmethod
+    def _ttl():
+        from flask import current_app
+        return current_app.config['ADMIN_ROLE_CACHE_TTL']
+
+    @staticmethod
+    def _check(user_id):
+        from app import db
+        from app.models.user import User
+        row = db.session.query(User.role, User.type).filter(User.id == user_id).first()
+        return row is not None and row.role == 'admin' and row.type == 'admin'
+
+    def revoke(self, user_id):
+        """Deny admin access to the user until the next database check"""
+        cache.set(self._key(user_id), False, timeout=self._ttl())
+
+    def forget(self, user_id):
+        """Drop the cached answer so the next request checks the database"""
+        cache.delete(self._key(user_id))
+
+    # Session event handlers
+
+    @staticmethod
+    def _collect_changes(session, changed):
+        from app.models.user import User
+        for obj in (*session.dirty, *session.deleted):
+            if isinstance(obj, User):
+                changed.add(obj.id)
+
+    def _apply_changes(self, session, changed):
+        for user_id in changed:
+            self.forget(user_id)
+
+
+admin_roles = AdminRoles()
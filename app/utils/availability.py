@@ -0,0 +1,196 @@
+"""In-memory interval index answering car availability checks.
+
+Every non-cancelled reservation is kept per car in a list sorted by start
+date. Because the longest reservation span of each car is tracked as well,
+an overlap lookup only needs to scan the slice of the list whose start dates
+fall in ``[start - max_span, end]``.
+
+The index is loaded lazily from the ``reservations`` table the first time an
+application asks a question, and afterwards follows the writes committed by
+this process through SQLAlchemy session events. Writes performed by other
+processes are not seen, so an answer from the index is never final: conflicts
+it reports are confirmed with the ``Reservation.overlapping`` query, which
+also corrects the index, and a car it reports free is checked again by the
+booking itself under the car lock.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+
+from app.utils.session_events import on_commit
+
+
+class _IndexState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.by_car = {}   # car_id -> sorted list of (start, end, id, status)
+        self.starts = {}   # car_id -> sorted list of start dates (parallel)
+        self.max_span = {}  # car_id -> longest (end - start) seen for the car
+        self.by_id = {}    # reservation_id -> (car_id, start, end, status)
+
+    def clear(self):
+        self.by_car.clear()
+        self.starts.clear()
+        self.max_span.clear()
+        self.by_id.clear()
+
+    def insert(self, rid, car_id, start, end, status):
+        entry = (start, end, rid, status)
+        entries = self.by_car.setdefault(car_id, [])
+        starts = self.starts.setdefault(car_id, [])
+        pos = bisect_right(entries, entry)
+        entries.insert(pos, entry)
+        starts.insert(pos, start)
+        span = end - start
+        if span > self.max_span.get(car_id, timedelta(0)):
+            self.max_span[car_id] = span
+        self.by_id[rid] = (car_id, start, end, status)
+
+    def remove(self, rid):
+        old = self.by_id.pop(rid, None)
+        if old is None:
+            return
+        car_id, start, end, status = old
+        entries = self.by_car[car_id]
+        pos = bisect_left(entries, (start, end, rid, status))
+        del entries[pos]
+        del self.starts[car_id][pos]
+
+    def upsert(self, rid, row):
+        self.remove(rid)
+        if row is None:
+            return
+        car_id, start, end, status = row
+        if car_id is None or status is None or status == 'cancelled':
+            return
+        self.insert(rid, car_id, start, end, status)
+
+    def overlapping(self, car_id, start, end):
+        entries = self.by_car.get(car_id)
+        if not entries:
+            return []
+        starts = self.starts[car_id]
+        lo = bisect_left(starts, start - self.max_span[car_id])
+        hi = bisect_right(starts, end)
+        return [e for e in entries[lo:hi] if e[1] >= start]
+
+
+class AvailabilityIndex:
+    """Per-application interval index over non-cancelled reservations."""
+
+    def init_app(self, app):
+        app.config.setdefault('AVAILABILITY_INDEX', True)
+        app.extensions['availability_index'] = _IndexState()
+        on_commit('availability_pending', self._collect_changes, self._apply_changes, dict)
+
+    def _state(self, app=None):
+        from flask import current_app
+        app = app or current_app._get_current_object()
+        if not app.config.get('AVAILABILITY_INDEX'):
+            return None
+        return app.extensions.get('availability_index')
+
+    def _load(self, state):
+        from app import db
+        from app.models.reservation import Reservation
+        rows = db.session.query(
+            Reservation.id, Reservation.car_id, Reservation.start_date,
+            Reservation.end_date, Reservation.status
+        ).filter(Reservation.status != 'cancelled')
+        state.clear()
+        for rid, car_id, start, end, status in rows:
+            state.upsert(rid, (car_id, start, end, status))
+        state.loaded = True
+
+    def reload(self):
+        """Drop the index and rebuild it from the database"""
+        state = self._state()
+        if state is None:
+            return
+        with state.lock:
+            self._load(state)
+
+    def conflicts(self, car_id, start_date, end_date):
+        """Return ``(id, start_date, end_date, status)`` tuples of the
+        non-cancelled reservations of a car overlapping the given dates"""
+        state = self._state()
+        if state is None:
+            from app.models.reservation import Reservation
+            return [
+                (r.id, r.start_date, r.end_date, r.status)
+                for r in Reservation.overlapping(car_id, start_date, end_date)
+            ]
+        with state.lock:
+            if not state.loaded:
+                self._load(state)
+            hits = [rid for _, _, rid, _ in state.overlapping(car_id, start_date, end_date)]
+        if not hits:
+            return []
+        # Another process may have cancelled or moved them: ask the database
+        from app.models.reservation import Reservation
+        rows = [
+            (r.id, r.start_date, r.end_date, r.status)
+            for r in Reservation.overlapping(car_id, start_date, end_date)
+        ]
+        with state.lock:
+            for rid in hits:
+                state.remove(rid)
+            for rid, start, end, status in rows:
+                state.upsert(rid, (car_id, start, end, status))
+        return rows
+
+    def is_free(self, car_id, start_date, end_date):
+        """Check that no non-cancelled reservation overlaps the given dates"""
+        return not self.conflicts(car_id, start_date, end_date)
+
+    def verify(self):
+        """Compare the index with the database, returning the reservation ids
+        whose indexed interval differs from the stored one"""
+        from app import db
+        from app.models.reservation import Reservation
+        state = self._state()
+        if state is None:
+            return []
+        expected = {
+            rid: (car_id, start, end, status)
+            for rid, car_id, start, end, status in db.session.query(
+                Reservation.id, Reservation.car_id, Reservation.start_date,
+                Reservation.end_date, Reservation.status
+            ).filter(Reservation.status != 'cancelled', Reservation.car_id.isnot(None))
+        }
+        with state.lock:
+            if not state.loaded:
+                self._load(state)
+            actual = dict(state.by_id)
+        return sorted(
+            rid for rid in expected.keys() | actual.keys()
+            if expected.get(rid) != actual.get(rid)
+        )
+
+    # Session event handlers
+
+    @staticmethod
+    def _collect_changes(session, pending):
+        from app.models.reservation import Reservation
+        for obj in session.new | session.dirty:
+            if isinstance(obj, Reservation):
+                pending[obj.id] = (obj.car_id, obj.start_date, obj.end_date, obj.status)
+        for obj in session.deleted:
+            if isinstance(obj, Reservation):
+                pending[obj.id] = None
+
+    def _apply_changes(self, session, pending):
+        app = getattr(session, 'app', None)
+        state = self._state(app) if app is not None else None
+        if state is None:
+            return
+        with state.lock:
+            # Not loaded yet: the first lookup reads these rows from the database
+            if not state.loaded:
+                return
+            for rid, row in pending.items():
+                state.upsert(rid, row)
+
+
+availability = AvailabilityIndex()
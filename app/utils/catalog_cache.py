@@ -0,0 +1,96 @@
+"""Versioned cache for the read-only car catalog endpoints.
+
+Entries live in the app ``cache`` under keys made of the current catalog
+version, the endpoint name and its normalized query parameters. A transaction
+that changes a ``Car`` or ``Insurance`` row increments the version, so entries
+cached before the write are never served again and simply age out.
+
+The version is the ``catalog`` row of ``data_versions``, bumped inside the
+writing transaction, so writes made by any process invalidate the entries of
+all of them. Run several processes with a shared ``CACHE_TYPE`` (e.g.
+``RedisCache``) to share the entries as well.
+"""
+import hashlib
+import threading
+
+from app import cache
+from app.utils.data_versions import data_versions
+
+VERSION_NAME = 'catalog'
+
+
+class CatalogCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def init_app(self, app):
+        app.config.setdefault('CATALOG_CACHE_TIMEOUT', 300)
+        data_versions.watch('catalog_version', self._changed_versions)
+
+    def version(self):
+        return data_versions.get(VERSION_NAME)[0]
+
+    def bump(self):
+        """Invalidate every cached catalog response, e.g. after writes that
+        bypass the session"""
+        from app import db
+        data_versions.bump(db.session, [VERSION_NAME])
+        db.session.commit()
+
+    def key(self, name, params):
+        normalized = '&'.join(f'{k}={params[k]}' for k in sorted(params) if params[k] not in (None, ''))
+        digest = hashlib.sha1(normalized.encode()).hexdigest()
+        return f'catalog:{self.version()}:{name}:{digest}'
+
+    def get_or_set(self, name, params, producer):
+        """Return the cached value for the endpoint and parameters, calling
+        producer() on a miss. None results are not cached."""
+        from flask import current_app
+        key = self.key(name, params)
+        value = cache.get(key)
+        with self._lock:
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        if value is None:
+            value = producer()
+            if value is not None:
+                cache.set(key, value, timeout=current_app.config['CATALOG_CACHE_TIMEOUT'])
+        return value
+
+    def counters(self):
+        """(hits, misses) of this process"""
+        with self._lock:
+            return self._hits, self._misses
+
+    def stats(self):
+        hits, misses = self.counters()
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / total if total else 0.0,
+            'version': self.version()
+        }
+
+    # Session event handlers
+
+    @staticmethod
+    def _changed_versions(session):
+        from app.models import Car, Insurance
+        # Collection changes (e.g. a reservation appended to car.reservations)
+        # do not alter what the catalog shows
+        if any(
+            isinstance(obj, (Car, Insurance)) for obj in (*session.new, *session.deleted)
+        ) or any(
+            isinstance(obj, (Car, Insurance)) and session.is_modified(obj, include_collections=False)
+            for obj in session.dirty
+        ):
+            return [VERSION_NAME]
+        return []
+
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,84 @@
+"""Version counters of cached data sets, kept in the database.
+
+A marker kept in a process-local cache only changes in the process that made
+the write. Instead, every flush that changes a watched data set increments
+its row in the ``data_versions`` table inside the same transaction, so all
+processes see the new version exactly when the change itself commits, and a
+rolled back change never bumps it.
+
+Reading is one query per request: versions are memoized in ``g`` until the
+request ends or bumps one of them.
+"""
+from flask import g, has_app_context
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app.utils.session_events import on_flush
+
+
+def _insert_missing(conn, table, names):
+    """Create the rows of names that do not exist yet, at version 0, leaving
+    the others alone"""
+    rows = [{'name': name, 'version': 0} for name in names]
+    if conn.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif conn.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        for row in rows:
+            try:
+                with conn.begin_nested():
+                    conn.execute(table.insert().values(**row))
+            except IntegrityError:  # created concurrently
+                pass
+        return
+    conn.execute(insert(table).on_conflict_do_nothing(), rows)
+
+
+class DataVersions:
+    def init_app(self, app):
+        @app.teardown_request
+        def forget_versions(exc):
+            g.pop('_data_versions', None)
+
+    def watch(self, key, changed):
+        """Bump the versions named by changed(session) in every flush"""
+        on_flush(key, lambda session: self.bump(session, changed(session)))
+
+    def get(self, *names):
+        """Current versions of the named data sets, 0 for a set never bumped"""
+        from app import db
+        from app.models import DataVersion
+        memo = g.setdefault('_data_versions', {}) if has_app_context() else {}
+        missing = [name for name in names if name not in memo]
+        if missing:
+            memo.update(dict.fromkeys(missing, 0))
+            memo.update(db.session.execute(
+                select(DataVersion.name, DataVersion.version).where(DataVersion.name.in_(missing))
+            ).all())
+        return tuple(memo[name] for name in names)
+
+    def bump(self, session, names):
+        """Increment the named versions in the session's transaction"""
+        from app.models import DataVersion
+        names = sorted(set(names))
+        if not names:
+            return
+        if has_app_context():
+            g.pop('_data_versions', None)
+        conn = session.connection()
+        table = DataVersion.__table__
+
+        def increment(names):
+            return conn.execute(table.update().where(table.c.name.in_(names)).values(
+                version=table.c.version + 1
+            )).rowcount
+
+        if increment(names) < len(names):
+            # Some rows are new: create them and bump again. Counting twice is
+            # harmless, a version only has to change.
+            _insert_missing(conn, table, names)
+            increment(names)
+
+
+data_versions = DataVersions()
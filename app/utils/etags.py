@@ -0,0 +1,96 @@
+"""Strong ETags and conditional GET for read-only endpoints.
+
+ETags are derived from version counters in the ``data_versions`` table rather
+than from the response body, so a matching ``If-None-Match`` is answered with
+304 after a single lookup, before the view runs its queries or serialization.
+Catalog endpoints use the catalog version; per-user listings use a version
+that is incremented by every transaction touching one of the user's
+reservations or payments. The counters change in the writing transaction, so
+an ETag stays valid across worker processes only as long as the data does.
+"""
+import hashlib
+from functools import wraps
+
+from flask import make_response, request
+
+from app.utils.data_versions import data_versions
+
+
+def make_etag(*parts):
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def conditional(etag_func):
+    """Answer If-None-Match from etag_func(*view_args) before running the view.
+
+    etag_func may return None to opt a request out of conditional handling."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = etag_func(*args, **kwargs)
+            if etag is None:
+                return view(*args, **kwargs)
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+
+class UserDataVersions:
+    """Version markers for data listed per user (reservations and payments,
+    favorites on their own)"""
+
+    def init_app(self, app):
+        data_versions.watch('user_data_version', self._changed_versions)
+        data_versions.watch('favorites_version', self._changed_favorites)
+
+    @staticmethod
+    def name(user_id):
+        """Name of the user's row in data_versions"""
+        return f'user_data:{int(user_id)}'
+
+    @staticmethod
+    def favorites_name(user_id):
+        """Name of the row of the user's favorites in data_versions"""
+        return f'favorites:{int(user_id)}'
+
+    def version(self, user_id):
+        return data_versions.get(self.name(user_id))[0]
+
+    # Session event handlers
+
+    def _changed_versions(self, session):
+        from app.models import Payment, Reservation
+        user_ids = set()
+        reservation_ids = set()
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            if isinstance(obj, Reservation):
+                user_ids.add(obj.user_id)
+            elif isinstance(obj, Payment):
+                reservation_ids.add(obj.reservation_id)
+        reservation_ids.discard(None)
+        if reservation_ids:
+            table = Reservation.__table__
+            user_ids.update(user_id for (user_id,) in session.connection().execute(
+                table.select().with_only_columns(table.c.user_id)
+                .where(table.c.id.in_(reservation_ids))
+            ))
+        user_ids.discard(None)
+        return [self.name(user_id) for user_id in user_ids]
+
+    def _changed_favorites(self, session):
+        from app.models import Favorite
+        user_ids = {
+            obj.user_id for obj in (*session.new, *session.dirty, *session.deleted)
+            if isinstance(obj, Favorite) and obj.user_id is not None
+        }
+        return [self.favorites_name(user_id) for user_id in user_ids]
+
+
+user_versions = UserDataVersions()
@@ -0,0 +1,220 @@
+"""Idempotency-Key support for write endpoints.
+
+A client that may retry a POST sends a unique ``Idempotency-Key`` header. The
+first request with a key reserves it in the ``idempotency_keys`` table and,
+once its view has answered, stores the response status, body and Location
+header there. A later request with the same key, from the same user to the
+same endpoint, gets the stored response replayed with ``Idempotent-Replayed:
+true`` and the view does not run again. A duplicate arriving while the first
+request is still running waits for its outcome instead of running the view
+in parallel, and gets 409 if it is not ready within ``IDEMPOTENCY_WAIT``
+seconds.
+
+Only hashes of the key and of the request (method, path and body) are kept.
+Reusing a key for a different request is answered with 422. Responses with a
+5xx status are not stored, so such a request can be retried with its key.
+
+Keys expire after ``IDEMPOTENCY_TTL`` seconds and expired rows are purged at
+most every ``IDEMPOTENCY_PURGE_INTERVAL`` seconds by each process. A key whose
+request died mid-way stays reserved for ``IDEMPOTENCY_LOCK_TIMEOUT`` seconds,
+after which a retry runs the view again.
+"""
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import jsonify, make_response, request
+from sqlalchemy.exc import IntegrityError
+
+MAX_KEY_LENGTH = 255
+REPLAYED_HEADERS = ('Content-Type', 'Location')
+
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _identity():
+    from flask_jwt_extended import get_jwt_identity
+    try:
+        return get_jwt_identity()
+    except RuntimeError:  # view not protected by jwt_required
+        return None
+
+
+def idempotent(view):
+    """Honour the Idempotency-Key header of requests to a write view.
+
+    Goes below jwt_required() so keys are scoped to the user."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return view(*args, **kwargs)
+        return idempotency_keys.handle(key, lambda: view(*args, **kwargs))
+    return wrapper
+
+
+class _KeysState:
+    def __init__(self):
+        self.settled = threading.Condition()
+        self.generation = 0  # bumped under `settled` whenever a key settles
+        self.last_purge = 0.0
+
+
+class IdempotencyKeys:
+    def init_app(self, app):
+        app.config.setdefault('IDEMPOTENCY_TTL', 24 * 3600)
+        app.config.setdefault('IDEMPOTENCY_WAIT', 10)
+        app.config.setdefault('IDEMPOTENCY_LOCK_TIMEOUT', 60)
+        app.config.setdefault('IDEMPOTENCY_PURGE_INTERVAL', 300)
+        app.config.setdefault('IDEMPOTENCY_POLL_INTERVAL', 0.1)
+        app.extensions['idempotency_keys'] = _KeysState()
+
+    def _state(self):
+        from flask import current_app
+        return current_app.extensions['idempotency_keys']
+
+    def handle(self, key, run):
+        """Run the view through run() once per key, replaying its response
+        to duplicates"""
+        from flask import current_app
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return jsonify({"error": f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"}), 400
+        key_hash = _digest(request.endpoint, _identity(), key)
+        fingerprint = _digest(request.method, request.path, request.get_data())
+        state = self._state()
+        deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT']
+
+        while True:
+            with state.settled:
+                generation = state.generation
+            record = self._reserve(key_hash, fingerprint)
+            if record is None:
+                break
+            if record.fingerprint != fingerprint:
+                return jsonify({
+                    "error": "Idempotency-Key reused",
+                    "message": "This key was already used for a different request"
+                }), 422
+            if record.status_code is not None:
+                return self._replay(record)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return jsonify({
+                    "error": "Request in progress",
+                    "message": "A request with this Idempotency-Key is still being processed"
+                }), 409, {'Retry-After': '1'}
+            # Woken at once by requests of this process, polls for the others
+            with state.settled:
+                if state.generation == generation:
+                    state.settled.wait(min(remaining, current_app.config['IDEMPOTENCY_POLL_INTERVAL']))
+
+        try:
+            response = make_response(run())
+        except Exception:
+            self._finish(key_hash, None)
+            raise
+        self._finish(key_hash, response if response.status_code < 500 else None)
+        return response
+
+    def _reserve(self, key_hash, fingerprint):
+        """Reserve the key for this request and return None, or return the
+        row of the request that holds it"""
+        from flask import current_app
+        from app import db
+        from app.models import IdempotencyKey
+        config = current_app.config
+        table = IdempotencyKey.__table__
+        now = datetime.utcnow()
+        values = dict(
+            fingerprint=fingerprint,
+            status_code=None,
+            response_body=None,
+            response_headers=None,
+            created_at=now,
+            locked_until=now + timedelta(seconds=config['IDEMPOTENCY_LOCK_TIMEOUT']),
+            expires_at=now + timedelta(seconds=config['IDEMPOTENCY_TTL'])
+        )
+        self._maybe_purge(now)
+        try:
+            db.session.execute(table.insert().values(key_hash=key_hash, **values))
+            db.session.commit()
+            return None
+        except IntegrityError:
+            db.session.rollback()
+
+        record = db.session.execute(table.select().where(table.c.key_hash == key_hash)).first()
+        if record is None:
+            return self._reserve(key_hash, fingerprint)
+        abandoned = record.status_code is None and record.locked_until < now
+        if record.expires_at >= now and not abandoned:
+            return record
+        # Expired or abandoned: take the key over unless another request just did
+        result = db.session.execute(table.update().where(
+            table.c.key_hash == key_hash,
+            table.c.expires_at == record.expires_at,
+            table.c.locked_until == record.locked_until if record.locked_until else table.c.locked_until.is_(None)
+        ).values(**values))
+        db.session.commit()
+        if result.rowcount == 1:
+            return None
+        return self._reserve(key_hash, fingerprint)
+
+    def _finish(self, key_hash, response):
+        """Store the response for replay, or free the key when there is none"""
+        from app import db
+        from app.models import IdempotencyKey
+        table = IdempotencyKey.__table__
+        # Whatever the view left uncommitted is not part of its response
+        db.session.rollback()
+        if response is None:
+            db.session.execute(table.delete().where(table.c.key_hash == key_hash))
+        else:
+            db.session.execute(table.update().where(table.c.key_hash == key_hash).values(
+                status_code=response.status_code,
+                response_body=response.get_data(as_text=True),
+                response_headers=json.dumps({
+                    name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers
+                }),
+                locked_until=None
+            ))
+        db.session.commit()
+        state = self._state()
+        with state.settled:
+            state.generation += 1
+            state.settled.notify_all()
+
+    @staticmethod
+    def _replay(record):
+        response = make_response(record.response_body, record.status_code)
+        response.headers.update(json.loads(record.response_headers or '{}'))
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+    def _maybe_purge(self, now):
+        from flask import current_app
+        state = self._state()
+        if time.monotonic() - state.last_purge < current_app.config['IDEMPOTENCY_PURGE_INTERVAL']:
+            return
+        state.last_purge = time.monotonic()
+        self.purge(now)
+
+    def purge(self, now=None):
+        """Delete expired keys and return how many there were"""
+        from app import db
+        from app.models import IdempotencyKey
+        table = IdempotencyKey.__table__
+        result = db.session.execute(table.delete().where(table.c.expires_at < (now or datetime.utcnow())))
+        db.session.commit()
+        return result.rowcount
+
+
+idempotency_keys = IdempotencyKeys()
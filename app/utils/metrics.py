@@ -0,0 +1,301 @@
+"""Prometheus text-format metrics served at ``/metrics``.
+
+Collected per process:
+
+* ``http_requests_total`` by blueprint, endpoint, method and status,
+* ``http_request_duration_seconds`` latency histograms by endpoint and method,
+* ``http_requests_in_flight``,
+* database pool connects, checkouts and currently checked-out connections,
+* catalog cache hits, misses and hit ratio.
+
+Recording never takes a lock: every thread updates its own counters and a
+scrape sums them. Counters of finished threads are folded into a retired total
+so threaded servers do not accumulate one store per request thread.
+
+With several worker processes, set ``METRICS_DIR`` to a directory shared by
+them. Each process then writes a snapshot of its counters there at most every
+``METRICS_FLUSH_INTERVAL`` seconds and when it exits, and a scrape of any
+process sums all snapshots. Counters of exited processes are kept so totals
+stay monotonic; their gauges are dropped.
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, request
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _empty():
+    return {'requests': {}, 'latency': {}, 'in_flight': 0, 'pool': {}, 'cache': {}}
+
+
+def _merge(total, snapshot):
+    for key, count in snapshot['requests'].items():
+        total['requests'][key] = total['requests'].get(key, 0) + count
+    for key, values in snapshot['latency'].items():
+        current = total['latency'].setdefault(key, [0] * len(values))
+        for i, value in enumerate(values):
+            current[i] += value
+    total['in_flight'] += snapshot['in_flight']
+    for section in ('pool', 'cache'):
+        for key, count in snapshot.get(section, {}).items():
+            total[section][key] = total[section].get(key, 0) + count
+    return total
+
+
+class _ThreadStore:
+    def __init__(self, thread):
+        self.thread = thread
+        self.requests = {}  # 'endpoint|method|status' -> count
+        self.latency = {}   # 'endpoint|method' -> [count per bucket..., +Inf count, sum]
+        self.in_flight = 0
+        self.pool = {}      # pool event -> count
+
+    def snapshot(self):
+        return {
+            'requests': self.requests.copy(),
+            'latency': {key: list(values) for key, values in self.latency.copy().items()},
+            'in_flight': self.in_flight,
+            'pool': self.pool.copy(),
+            'cache': {}
+        }
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class Metrics:
+    _listeners_installed = False
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()  # guards the store registry, not recording
+        self._stores = []
+        self._retired = _empty()
+        self._last_flush = 0.0
+        self._metrics_dir = None
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_DIR', None)
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', 5)
+        # Run first so requests rejected by other before_request hooks count too
+        app.before_request_funcs.setdefault(None, []).insert(0, self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+        if app.config['METRICS_DIR']:
+            os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+            if self._metrics_dir is None:
+                atexit.register(self._write_snapshot)
+            self._metrics_dir = app.config['METRICS_DIR']
+        self._install_listeners()
+
+    def _store(self):
+        store = getattr(self._local, 'store', None)
+        if store is None:
+            store = _ThreadStore(threading.current_thread())
+            self._local.store = store
+            with self._lock:
+                self._stores.append(store)
+        return store
+
+    # Request hooks
+
+    def _start(self):
+        g._metrics_start = time.perf_counter()
+        self._store().in_flight += 1
+
+    def _finish(self, response):
+        self._observe(response.status_code)
+        return response
+
+    def _teardown(self, exc):
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return
+        # after_request does not run when the view raised
+        if not g.pop('_metrics_observed', False):
+            self._observe(500, start)
+        self._store().in_flight -= 1
+        self._maybe_flush()
+
+    def _observe(self, status, start=None):
+        start = start or g.get('_metrics_start')
+        if start is None:
+            return
+        g._metrics_observed = True
+        duration = time.perf_counter() - start
+        endpoint = request.endpoint or 'unmatched'
+        store = self._store()
+        key = f'{endpoint}|{request.method}|{status}'
+        store.requests[key] = store.requests.get(key, 0) + 1
+        histogram = store.latency.get(f'{endpoint}|{request.method}')
+        if histogram is None:
+            histogram = store.latency[f'{endpoint}|{request.method}'] = [0] * (len(BUCKETS) + 2)
+        histogram[bisect_left(BUCKETS, duration)] += 1
+        histogram[-1] += duration
+
+    # Pool events
+
+    def _install_listeners(self):
+        if Metrics._listeners_installed:
+            return
+        for name in ('connect', 'checkout', 'checkin'):
+            event.listen(Pool, name, self._pool_listener(name))
+        Metrics._listeners_installed = True
+
+    def _pool_listener(self, name):
+        def listener(*args):
+            pool = self._store().pool
+            pool[name] = pool.get(name, 0) + 1
+        return listener
+
+    # Aggregation
+
+    def snapshot(self):
+        """Counters of this process summed over its threads"""
+        from app.utils.catalog_cache import catalog_cache
+        with self._lock:
+            alive = []
+            for store in self._stores:
+                if store.thread.is_alive():
+                    alive.append(store)
+                else:
+                    _merge(self._retired, store.snapshot())
+            self._stores = alive
+            total = _merge(_empty(), self._retired)
+        for store in alive:
+            _merge(total, store.snapshot())
+        hits, misses = catalog_cache.counters()
+        total['cache'] = {'hits': hits, 'misses': misses}
+        return total
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self._metrics_dir, f'metrics-{pid}.json')
+
+    def _write_snapshot(self, snapshot=None):
+        if not self._metrics_dir:
+            return
+        if snapshot is None:
+            snapshot = self.snapshot()
+        path = self._snapshot_path(os.getpid())
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, path)
+
+    def _maybe_flush(self):
+        from flask import current_app
+        if not self._metrics_dir:
+            return
+        now = time.monotonic()
+        if now - self._last_flush < current_app.config['METRICS_FLUSH_INTERVAL']:
+            return
+        self._last_flush = now
+        self._write_snapshot()
+
+    @staticmethod
+    def _pid_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def collect(self):
+        """Counters summed over this process and, with METRICS_DIR, the
+        latest snapshots of the other processes"""
+        total = self.snapshot()
+        if not self._metrics_dir:
+            return total
+        self._write_snapshot(total)
+        total = _merge(_empty(), total)
+        for path in glob.glob(os.path.join(self._metrics_dir, 'metrics-*.json')):
+            pid = int(os.path.basename(path)[len('metrics-'):-len('.json')])
+            if pid == os.getpid():
+                continue
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not self._pid_alive(pid):
+                snapshot['in_flight'] = 0
+                snapshot['pool']['checkin'] = snapshot['pool'].get('checkout', 0)
+            _merge(total, snapshot)
+        return total
+
+    # Exposition
+
+    def render(self, total):
+        lines = [
+            '# HELP http_requests_total Requests handled, by endpoint, method and status.',
+            '# TYPE http_requests_total counter'
+        ]
+        for key, count in sorted(total['requests'].items()):
+            endpoint, method, status = key.split('|')
+            lines.append('http_requests_total' + _labels(
+                blueprint=endpoint.rpartition('.')[0], endpoint=endpoint, method=method, status=status
+            ) + f' {count}')
+
+        lines += [
+            '# HELP http_request_duration_seconds Request latency, by endpoint and method.',
+            '# TYPE http_request_duration_seconds histogram'
+        ]
+        for key, values in sorted(total['latency'].items()):
+            endpoint, method = key.split('|')
+            labels = dict(blueprint=endpoint.rpartition('.')[0], endpoint=endpoint, method=method)
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, '+Inf'), values[:-1]):
+                cumulative += count
+                lines.append('http_request_duration_seconds_bucket' + _labels(**labels, le=bound) + f' {cumulative}')
+            lines.append('http_request_duration_seconds_sum' + _labels(**labels) + f' {values[-1]}')
+            lines.append('http_request_duration_seconds_count' + _labels(**labels) + f' {cumulative}')
+
+        pool, cache = total['pool'], total['cache']
+        lookups = cache.get('hits', 0) + cache.get('misses', 0)
+        lines += [
+            '# HELP http_requests_in_flight Requests being handled.',
+            '# TYPE http_requests_in_flight gauge',
+            f"http_requests_in_flight {total['in_flight']}",
+            '# HELP db_pool_connects_total New database connections opened.',
+            '# TYPE db_pool_connects_total counter',
+            f"db_pool_connects_total {pool.get('connect', 0)}",
+            '# HELP db_pool_checkouts_total Connections checked out of the pool.',
+            '# TYPE db_pool_checkouts_total counter',
+            f"db_pool_checkouts_total {pool.get('checkout', 0)}",
+            '# HELP db_pool_checked_out Connections currently checked out.',
+            '# TYPE db_pool_checked_out gauge',
+            f"db_pool_checked_out {pool.get('checkout', 0) - pool.get('checkin', 0)}",
+            '# HELP catalog_cache_hits_total Catalog cache hits.',
+            '# TYPE catalog_cache_hits_total counter',
+            f"catalog_cache_hits_total {cache.get('hits', 0)}",
+            '# HELP catalog_cache_misses_total Catalog cache misses.',
+            '# TYPE catalog_cache_misses_total counter',
+            f"catalog_cache_misses_total {cache.get('misses', 0)}",
+            '# HELP catalog_cache_hit_ratio Share of catalog cache lookups that hit.',
+            '# TYPE catalog_cache_hit_ratio gauge',
+            f"catalog_cache_hit_ratio {cache.get('hits', 0) / lookups if lookups else 0.0}",
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def view(self):
+        return Response(self.render(self.collect()), mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
@@ -0,0 +1,59 @@
+"""Password hashing with a configurable scheme.
+
+``PASSWORD_HASH_METHOD`` takes any werkzeug method string, e.g.
+``pbkdf2:sha256:600000`` or ``scrypt:32768:8:1``. Hashes stored with other
+parameters keep verifying; ``needs_rehash`` tells the login code to replace
+them with the configured scheme once the plain password is known.
+
+With ``PASSWORD_HASH_WORKERS`` above zero, hashing and verification run in a
+bounded thread pool. hashlib releases the GIL while it works, so this caps how
+many CPU cores logins can occupy at once on threaded servers instead of
+letting a burst of logins starve every other request.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+def normalize_method(method):
+    """Method string with werkzeug's defaults filled in, as stored in hashes"""
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        return 'scrypt:32768:8:1'
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    return method
+
+
+class PasswordHasher:
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}')
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 0)
+        workers = app.config['PASSWORD_HASH_WORKERS']
+        app.extensions['password_hasher'] = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='password-hash'
+        ) if workers else None
+
+    @staticmethod
+    def _run(fn, *args):
+        executor = current_app.extensions.get('password_hasher')
+        if executor is None:
+            return fn(*args)
+        return executor.submit(fn, *args).result()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Check whether a stored hash uses other parameters than configured"""
+        stored = pwhash.split('$', 1)[0]
+        return stored != normalize_method(current_app.config['PASSWORD_HASH_METHOD'])
+
+
+passwords = PasswordHasher()
@@ -0,0 +1,285 @@
+"""Asynchronous payment settlement.
+
+``POST /api/payments/process`` only records a pending ``Payment`` and its
+``PaymentJob``; workers settle the job with the payment processor outside of
+any request. Jobs live in the ``payment_jobs`` table, so any process can work
+on them:
+
+* every app process starts ``PAYMENT_WORKER_THREADS`` worker threads the
+  first time it queues a payment (0 starts none),
+* ``flask payments-worker`` runs a dedicated worker process.
+
+A worker claims a due job with a conditional UPDATE and leases it for
+``PAYMENT_LEASE`` seconds, so a job whose worker died is picked up again once
+the lease runs out. The processor is called with no transaction open, and
+every attempt of a job sends the same idempotency key so a retried charge is
+never billed twice. Other errors than ``PaymentDeclined`` are retried with
+exponential backoff, up to ``PAYMENT_MAX_ATTEMPTS`` attempts.
+
+``PAYMENT_PROCESSOR`` is any object with a ``charge(amount, method,
+idempotency_key)`` method returning the transaction id. Without one, the
+in-process ``FakeProcessor`` approves every charge after
+``PAYMENT_FAKE_LATENCY`` seconds.
+"""
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+
+class PaymentDeclined(Exception):
+    """The processor refused the charge; retrying will not help"""
+
+
+class FakeProcessor:
+    """Stand-in payment processor for development, tests and benchmarks.
+
+    Approves charges after ``latency`` seconds, except that the methods in
+    ``decline_methods`` are declined and the first ``fail_times`` attempts of
+    every idempotency key fail as if the processor were unreachable."""
+
+    def __init__(self, latency=0.0, decline_methods=(), fail_times=0):
+        self.latency = latency
+        self.decline_methods = set(decline_methods)
+        self.fail_times = fail_times
+        self._lock = threading.Lock()
+        self._charges = {}   # idempotency key -> transaction id
+        self._attempts = {}  # idempotency key -> attempts seen
+
+    def charge(self, amount, method, idempotency_key):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if idempotency_key in self._charges:
+                return self._charges[idempotency_key]
+            attempts = self._attempts[idempotency_key] = self._attempts.get(idempotency_key, 0) + 1
+            if attempts <= self.fail_times:
+                raise ConnectionError("Payment processor unreachable")
+            if method in self.decline_methods:
+                raise PaymentDeclined(f"{method} declined")
+            transaction_id = self._charges[idempotency_key] = f"fake_{uuid.uuid4().hex}"
+            return transaction_id
+
+    def charges(self):
+        """{idempotency key: transaction id} of the approved charges"""
+        with self._lock:
+            return dict(self._charges)
+
+
+class _QueueState:
+    def __init__(self, processor):
+        self.processor = processor
+        self.lock = threading.Lock()
+        self.threads = []
+        self.stopping = threading.Event()
+        self.wake = threading.Event()
+        self.settled = threading.Condition()
+        self.generation = 0  # bumped under `settled` by every settlement
+
+
+class PaymentQueue:
+    def init_app(self, app):
+        app.config.setdefault('PAYMENT_WORKER_THREADS', 2)
+        app.config.setdefault('PAYMENT_PROCESSOR', None)
+        app.config.setdefault('PAYMENT_FAKE_LATENCY', 0.0)
+        app.config.setdefault('PAYMENT_MAX_ATTEMPTS', 5)
+        app.config.setdefault('PAYMENT_RETRY_DELAY', 1.0)
+        app.config.setdefault('PAYMENT_LEASE', 60)
+        app.config.setdefault('PAYMENT_POLL_INTERVAL', 1.0)
+        processor = app.config['PAYMENT_PROCESSOR'] or FakeProcessor(app.config['PAYMENT_FAKE_LATENCY'])
+        app.extensions['payment_queue'] = _QueueState(processor)
+
+    def _state(self, app=None):
+        from flask import current_app
+        app = app or current_app._get_current_object()
+        return app.extensions['payment_queue']
+
+    def processor(self, app=None):
+        return self._state(app).processor
+
+    # Producing
+
+    def enqueue(self, payment):
+        """Queue a pending payment for settlement, as a fresh charge when it
+        was queued before. The caller commits and then calls notify()."""
+        from app import db
+        from app.models import PaymentJob
+        job = payment.job
+        if job is None:
+            job = PaymentJob(payment=payment)
+            db.session.add(job)
+        job.status = 'queued'
+        job.idempotency_key = uuid.uuid4().hex
+        job.attempts = 0
+        job.run_after = datetime.utcnow()
+        job.locked_until = None
+        job.last_error = None
+        job.finished_at = None
+        return job
+
+    def notify(self):
+        """Wake the worker threads of this process, starting them if needed"""
+        from flask import current_app
+        app = current_app._get_current_object()
+        state = self._state(app)
+        with state.lock:
+            # Threads do not survive a fork, so count the live ones
+            state.threads = [t for t in state.threads if t.is_alive()]
+            while not state.stopping.is_set() and len(state.threads) < app.config['PAYMENT_WORKER_THREADS']:
+                thread = threading.Thread(target=self.work, args=(app,), name='payment-worker', daemon=True)
+                thread.start()
+                state.threads.append(thread)
+        state.wake.set()
+
+    def stop(self, app=None, timeout=5):
+        """Stop this process's worker threads, waiting for their current job"""
+        state = self._state(app)
+        state.stopping.set()
+        state.wake.set()
+        with state.lock:
+            threads, state.threads = state.threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+    # Consuming
+
+    def work(self, app):
+        """Settle jobs as they become due until stop() is called"""
+        from app import db
+        state = self._state(app)
+        while not state.stopping.is_set():
+            state.wake.clear()
+            # A context per pass, so the queries it records (with
+            # SQLALCHEMY_RECORD_QUERIES) are released after each one
+            with app.app_context():
+                try:
+                    settled = self.run_pending()
+                except Exception:
+                    app.logger.exception("Payment worker failed")
+                    db.session.rollback()
+                    settled = 0
+                finally:
+                    db.session.remove()
+            if not settled:
+                state.wake.wait(app.config['PAYMENT_POLL_INTERVAL'])
+
+    def run_pending(self, limit=None):
+        """Settle due jobs one at a time until none is left (or limit jobs
+        were handled) and return how many were handled"""
+        count = 0
+        while limit is None or count < limit:
+            claimed = self._claim()
+            if claimed is None:
+                break
+            self._settle(*claimed)
+            count += 1
+        return count
+
+    def _due(self, now):
+        from app import db
+        from app.models import PaymentJob
+        return db.or_(
+            db.and_(PaymentJob.status == 'queued', PaymentJob.run_after <= now),
+            db.and_(PaymentJob.status == 'processing', PaymentJob.locked_until < now)
+        )
+
+    def _claim(self):
+        """(job id, attempt) of a due job now leased to this worker, or None"""
+        from flask import current_app
+        from app import db
+        from app.models import PaymentJob
+        now = datetime.utcnow()
+        candidates = [job_id for job_id, in db.session.query(PaymentJob.id).filter(
+            self._due(now)
+        ).order_by(PaymentJob.run_after).limit(10)]
+        table = PaymentJob.__table__
+        for job_id in candidates:
+            # Only one worker's UPDATE still finds the job due
+            result = db.session.execute(table.update().where(
+                table.c.id == job_id, self._due(now)
+            ).values(
+                status='processing',
+                attempts=table.c.attempts + 1,
+                locked_until=now + timedelta(seconds=current_app.config['PAYMENT_LEASE'])
+            ))
+            db.session.commit()
+            if result.rowcount == 1:
+                attempt = db.session.query(PaymentJob.attempts).filter_by(id=job_id).scalar()
+                return job_id, attempt
+        db.session.rollback()
+        return None
+
+    def _settle(self, job_id, attempt):
+        from flask import current_app
+        from app import db
+        from app.models import PaymentJob
+        config = current_app.config
+        state = self._state()
+        job = db.session.get(PaymentJob, job_id)
+        amount, method, key = job.payment.amount, job.payment.method, job.idempotency_key
+        # No transaction stays open while the processor works
+        db.session.commit()
+
+        transaction_id = error = None
+        retry_at = None
+        try:
+            transaction_id = state.processor.charge(amount, method, key)
+        except PaymentDeclined as e:
+            error = str(e) or "Payment declined"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if attempt < config['PAYMENT_MAX_ATTEMPTS']:
+                retry_at = datetime.utcnow() + timedelta(
+                    seconds=config['PAYMENT_RETRY_DELAY'] * 2 ** (attempt - 1)
+                )
+
+        job = db.session.get(PaymentJob, job_id)
+        # Lost the lease to another worker meanwhile: its result wins
+        if job.status != 'processing' or job.attempts != attempt:
+            db.session.rollback()
+            return
+        job.locked_until = None
+        job.last_error = error[:255] if error else None
+        if retry_at:
+            job.status = 'queued'
+            job.run_after = retry_at
+        else:
+            payment = job.payment
+            job.status = 'failed' if error else 'succeeded'
+            job.finished_at = datetime.utcnow()
+            payment.status = 'failed' if error else 'completed'
+            if transaction_id:
+                payment.transaction_id = transaction_id
+                payment.payment_date = job.finished_at
+                if payment.reservation.status != 'cancelled':
+                    payment.reservation.status = 'confirmed'
+        db.session.commit()
+        with state.settled:
+            state.generation += 1
+            state.settled.notify_all()
+
+    # Waiting
+
+    def wait(self, payment_id, timeout):
+        """Wait up to timeout seconds for a payment to leave the pending
+        status and return it. Settlements by this process wake the waiter at
+        once, those of other processes are seen at the next poll."""
+        from flask import current_app
+        from app import db
+        from app.models import Payment
+        state = self._state()
+        deadline = time.monotonic() + timeout
+        while True:
+            with state.settled:
+                generation = state.generation
+            db.session.expire_all()
+            payment = db.session.get(Payment, payment_id)
+            remaining = deadline - time.monotonic()
+            if payment is None or payment.status != 'pending' or remaining <= 0:
+                return payment
+            with state.settled:
+                if state.generation == generation:
+                    state.settled.wait(min(remaining, current_app.config['PAYMENT_POLL_INTERVAL']))
+
+
+payment_queue = PaymentQueue()
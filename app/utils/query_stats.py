@@ -0,0 +1,105 @@
+"""Per-request SQL query instrumentation.
+
+Reads the queries Flask-SQLAlchemy records when ``SQLALCHEMY_RECORD_QUERIES``
+is on and, for every request:
+
+* adds ``X-Query-Count`` and ``X-DB-Time`` (milliseconds) response headers
+  when ``QUERY_STATS_HEADERS`` is set,
+* logs each query slower than ``SLOW_QUERY_THRESHOLD`` seconds together with
+  the endpoint, its parameters and the calling code,
+* adds the request to per-endpoint counters served by ``/api/admin/query-stats``.
+
+Counters are kept per process. Streamed responses are measured when the view
+returns, so queries run while the body is generated are not included.
+"""
+import threading
+
+from flask import g, request
+from flask_sqlalchemy import get_debug_queries
+
+
+class _EndpointStats:
+    __slots__ = ('requests', 'queries', 'max_queries', 'db_time', 'max_db_time')
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.db_time = 0.0
+        self.max_db_time = 0.0
+
+    def add(self, queries, db_time):
+        self.requests += 1
+        self.queries += queries
+        self.max_queries = max(self.max_queries, queries)
+        self.db_time += db_time
+        self.max_db_time = max(self.max_db_time, db_time)
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'queries': self.queries,
+            'avg_queries': self.queries / self.requests,
+            'max_queries': self.max_queries,
+            'db_time_ms': round(self.db_time * 1000, 3),
+            'avg_db_time_ms': round(self.db_time * 1000 / self.requests, 3),
+            'max_db_time_ms': round(self.max_db_time * 1000, 3)
+        }
+
+
+class QueryStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def init_app(self, app):
+        app.config.setdefault('QUERY_STATS_HEADERS', False)
+        app.config.setdefault('SLOW_QUERY_THRESHOLD', 0.5)
+        if not app.config.get('SQLALCHEMY_RECORD_QUERIES'):
+            return
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    @staticmethod
+    def _start():
+        # The recorded list belongs to the app context, which can outlive the
+        # request (e.g. the test client reusing a pushed context)
+        g._query_stats_offset = len(get_debug_queries())
+
+    def _finish(self, response):
+        from flask import current_app
+        offset = g.pop('_query_stats_offset', None)
+        if offset is None:
+            return response
+        queries = get_debug_queries()[offset:]
+        db_time = sum(query.duration for query in queries)
+        endpoint = request.endpoint or 'unmatched'
+
+        threshold = current_app.config['SLOW_QUERY_THRESHOLD']
+        for query in queries:
+            if query.duration >= threshold:
+                current_app.logger.warning(
+                    "Slow query (%.1f ms) on %s %s view_args=%r args=%r: %s parameters=%r context=%s",
+                    query.duration * 1000, request.method, endpoint, request.view_args,
+                    request.args.to_dict(), query.statement, query.parameters, query.context
+                )
+
+        with self._lock:
+            self._endpoints.setdefault(endpoint, _EndpointStats()).add(len(queries), db_time)
+
+        if current_app.config['QUERY_STATS_HEADERS']:
+            response.headers['X-Query-Count'] = str(len(queries))
+            response.headers['X-DB-Time'] = f'{db_time * 1000:.3f}'
+        return response
+
+    def stats(self):
+        """Per-endpoint query counts and database time in this process"""
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in sorted(self._endpoints.items())}
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+query_stats = QueryStats()
@@ -0,0 +1,115 @@
+"""In-memory trigram index over car make and model.
+
+``Car.make.ilike('%x%')`` cannot use the column index, so every search scans
+the ``cars`` table. This index maps each lowercase trigram of a make or model
+to the set of car ids containing it. A substring query intersects the sets of
+its own trigrams and then checks the candidates against the stored strings, so
+it returns exactly the cars whose value contains the text.
+
+Queries shorter than three characters, or matching so many cars that an
+``IN`` list would be slower than the scan, fall back to ``ILIKE``.
+
+The index loads lazily and remembers the catalog version of ``data_versions``
+it was built from. Every car insert, update or delete bumps that version, in
+whichever process commits it, and the next search rebuilds the index.
+"""
+import threading
+
+from sqlalchemy import false
+
+from app.utils.catalog_cache import catalog_cache
+
+FIELDS = ('make', 'model')
+MIN_QUERY_LENGTH = 3
+# Above this many candidates the ids are not worth sending to the database
+MAX_IN_IDS = 2000
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class _FieldIndex:
+    def __init__(self):
+        self.grams = {}   # trigram -> set of car ids
+        self.values = {}  # car id -> lowercase value
+
+    def add(self, car_id, value):
+        value = (value or '').lower()
+        self.values[car_id] = value
+        for gram in trigrams(value):
+            self.grams.setdefault(gram, set()).add(car_id)
+
+    def search(self, text):
+        sets = []
+        for gram in trigrams(text):
+            ids = self.grams.get(gram)
+            if not ids:
+                return set()
+            sets.append(ids)
+        sets.sort(key=len)
+        candidates = set(sets[0]).intersection(*sets[1:])
+        return {car_id for car_id in candidates if text in self.values[car_id]}
+
+
+class _IndexState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None  # catalog version the index was built from
+        self.fields = {field: _FieldIndex() for field in FIELDS}
+
+
+class CarSearchIndex:
+    def init_app(self, app):
+        app.config.setdefault('CAR_SEARCH_INDEX', True)
+        app.extensions['car_search_index'] = _IndexState()
+
+    def _state(self, app=None):
+        from flask import current_app
+        app = app or current_app._get_current_object()
+        if not app.config.get('CAR_SEARCH_INDEX'):
+            return None
+        return app.extensions.get('car_search_index')
+
+    def _load(self, state, version):
+        from app import db
+        from app.models import Car
+        state.fields = {field: _FieldIndex() for field in FIELDS}
+        for car_id, make, model in db.session.query(Car.id, Car.make, Car.model):
+            state.fields['make'].add(car_id, make)
+            state.fields['model'].add(car_id, model)
+        state.version = version
+
+    def reload(self):
+        """Drop the index and rebuild it from the database"""
+        state = self._state()
+        if state is None:
+            return
+        with state.lock:
+            self._load(state, catalog_cache.version())
+
+    def match_ids(self, field, text):
+        """Ids of the cars whose field contains text (case-insensitive), or
+        None when the index cannot answer the query"""
+        text = (text or '').lower()
+        state = self._state()
+        if state is None or len(text) < MIN_QUERY_LENGTH:
+            return None
+        version = catalog_cache.version()
+        with state.lock:
+            if state.version != version:
+                self._load(state, version)
+            return state.fields[field].search(text)
+
+    def filter(self, query, field, text):
+        """Restrict a Car query to cars whose field contains text"""
+        from app.models import Car
+        ids = self.match_ids(field, text)
+        if ids is None or len(ids) > MAX_IN_IDS:
+            return query.filter(getattr(Car, field).ilike(f'%{text}%'))
+        if not ids:
+            return query.filter(false())
+        return query.filter(Car.id.in_(ids))
+
+
+search_index = CarSearchIndex()
@@ -0,0 +1,188 @@
+"""Bulk synthetic data for performance work (``flask seed``).
+
+Rows are generated in Python and written with Core ``executemany`` inserts in
+chunks, bypassing the ORM unit of work, so millions of rows load in minutes.
+Ids are assigned up front from the current maximum of each table, which lets
+later tables reference earlier ones without reading them back and lets several
+seed runs add to the same database.
+
+Reservations never overlap on a car: every car gets a timeline of stays
+separated by gaps, starting a year before ``today``. Stays in the past are
+completed, current ones confirmed and future ones pending or confirmed, with a
+share cancelled. Confirmed and completed stays are paid; some cancelled ones
+were paid and refunded.
+
+All users share one password (``DEFAULT_PASSWORD``) hashed once, since hashing
+is by far the slowest part of creating a user.
+"""
+import random
+from datetime import date, datetime, timedelta
+
+from app.utils.passwords import passwords
+
+DEFAULT_PASSWORD = 'password123'
+MAKES = {
+    'Toyota': ['Camry', 'Corolla', 'RAV4', 'Land Cruiser', 'Hilux'],
+    'Ford': ['Focus', 'Explorer', 'Bronco', 'Ranger', 'Mustang'],
+    'Honda': ['Civic', 'Accord', 'CR-V', 'Pilot'],
+    'Jeep': ['Wrangler', 'Cherokee', 'Gladiator'],
+    'BMW': ['3 Series', '5 Series', 'X5', 'X7'],
+    'Mercedes-Benz': ['C-Class', 'E-Class', 'GLE', 'G-Class'],
+    'Tesla': ['Model 3', 'Model S', 'Model Y'],
+    'Land Rover': ['Defender', 'Discovery', 'Range Rover'],
+}
+PRICES = {'sedan': (35, 80), 'suv': (60, 120), '4x4': (80, 160), 'luxury': (150, 400)}
+LOCATION_TYPES = {'city': 'sedan', 'mountains': 'suv', 'desert': '4x4', 'snow': '4x4'}
+INSURERS = [('Allianz', 'comprehensive'), ('AXA', 'basic'), ('Generali', 'offroad'), ('Zurich', 'premium')]
+DAMAGES = ['Scratch on rear bumper', 'Cracked windshield', 'Dent on driver door', 'Worn tyres']
+
+
+def _next_id(conn, table):
+    return (conn.execute(table.select().with_only_columns(table.c.id).order_by(table.c.id.desc()).limit(1))
+            .scalar() or 0) + 1
+
+
+def _insert(conn, table, rows, chunk_size):
+    """executemany() rows into a table chunk by chunk, returning the count"""
+    count = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            conn.execute(table.insert(), chunk)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        conn.execute(table.insert(), chunk)
+        count += len(chunk)
+    return count
+
+
+def seed_database(users=1000, cars=500, reservations=20000, favorites_per_user=3,
+                  damage_rate=0.05, cancel_rate=0.08, seed=42, chunk_size=10000, today=None):
+    """Insert synthetic rows and return the number inserted per table"""
+    from app import db
+    from app.models import Car, DamageReport, Favorite, Insurance, Payment, Refund, Reservation, User
+    from app.models.user import Client
+    from app.utils.availability import availability
+    from app.utils.catalog_cache import catalog_cache
+    from app.utils.search_index import search_index
+    from app.utils.stats import rollups
+
+    rng = random.Random(seed)
+    today = today or date.today()
+    now = datetime.combine(today, datetime.min.time())
+    conn = db.session.connection()
+    counts = {}
+
+    # Users: base rows plus their joined-table client rows
+    first_user = _next_id(conn, User.__table__)
+    user_ids = range(first_user, first_user + users)
+    password_hash = passwords.hash(DEFAULT_PASSWORD)
+    counts['users'] = _insert(conn, User.__table__, ({
+        'id': user_id, 'email': f'user{user_id}@seed.example.com', 'password_hash': password_hash,
+        'role': 'client', 'type': 'client', 'language': 'en',
+        'phone': f'+1555{user_id:07d}', 'first_name': f'User{user_id}', 'last_name': 'Seed',
+        'created_at': now - timedelta(days=rng.randint(0, 730))
+    } for user_id in user_ids), chunk_size)
+    _insert(conn, Client.__table__, (
+        {'id': user_id, 'driving_license': f'DL{user_id:09d}'} for user_id in user_ids
+    ), chunk_size)
+
+    # Cars and one insurance policy each
+    first_car = _next_id(conn, Car.__table__)
+    car_ids = range(first_car, first_car + cars)
+    car_prices = {}
+
+    def car_rows():
+        for car_id in car_ids:
+            location = rng.choice(list(LOCATION_TYPES))
+            vehicle_type = 'luxury' if rng.random() < 0.1 else LOCATION_TYPES[location]
+            make = rng.choice(list(MAKES))
+            car_prices[car_id] = float(rng.randint(*PRICES[vehicle_type]))
+            yield {
+                'id': car_id, 'make': make, 'model': rng.choice(MAKES[make]),
+                'year': rng.randint(2016, today.year), 'price_per_day': car_prices[car_id],
+                'status': 'maintenance' if rng.random() < 0.02 else 'available',
+                'vehicle_type': vehicle_type, 'location': location,
+                'category': Car.infer_category(vehicle_type)
+            }
+    counts['cars'] = _insert(conn, Car.__table__, car_rows(), chunk_size)
+    counts['insurances'] = _insert(conn, Insurance.__table__, ({
+        'provider': provider, 'type': kind,
+        'expiry_date': today + timedelta(days=rng.randint(30, 730)),
+        'coverage_amount': float(rng.choice([25000, 50000, 75000, 100000])), 'car_id': car_id
+    } for car_id in car_ids for provider, kind in [rng.choice(INSURERS)]), chunk_size)
+
+    # Reservations laid out per car without overlaps; paid ones collected
+    # for the payment, damage and refund rows
+    first_reservation = _next_id(conn, Reservation.__table__)
+    paid, cancelled_paid, damaged = [], [], []
+
+    def reservation_rows():
+        reservation_id = first_reservation
+        per_car, extra = divmod(reservations, max(cars, 1))
+        for index, car_id in enumerate(car_ids):
+            start = today - timedelta(days=365 - rng.randint(0, 10))
+            for _ in range(per_car + (index < extra)):
+                days = rng.randint(1, 14)
+                end = start + timedelta(days=days)
+                if rng.random() < cancel_rate:
+                    status = 'cancelled'
+                elif end < today:
+                    status = 'completed'
+                elif start <= today:
+                    status = 'confirmed'
+                else:
+                    status = rng.choice(['pending', 'confirmed'])
+                price = car_prices[car_id] * days
+                if status in ('confirmed', 'completed'):
+                    paid.append((reservation_id, price, start))
+                    if status == 'completed' and rng.random() < damage_rate:
+                        damaged.append((reservation_id, end))
+                elif status == 'cancelled' and rng.random() < 0.5:
+                    cancelled_paid.append((reservation_id, price, start))
+                yield {
+                    'id': reservation_id, 'start_date': start, 'end_date': end,
+                    'total_price': price, 'status': status, 'rental_type': 'daily',
+                    'damage_charge': 0.0, 'user_id': rng.choice(user_ids), 'car_id': car_id
+                }
+                reservation_id += 1
+                start = end + timedelta(days=rng.randint(1, 10))
+    counts['reservations'] = _insert(conn, Reservation.__table__, reservation_rows(), chunk_size)
+
+    def payment_rows():
+        for status, rows in (('completed', paid), ('refunded', cancelled_paid)):
+            for reservation_id, price, start in rows:
+                paid_at = datetime.combine(start, datetime.min.time()) - timedelta(days=rng.randint(1, 30))
+                yield {
+                    'amount': price, 'status': status, 'method': rng.choice(Payment.VALID_METHODS),
+                    'transaction_id': f'seed_{seed}_{reservation_id}', 'created_at': paid_at,
+                    'payment_date': paid_at, 'reservation_id': reservation_id
+                }
+    counts['payments'] = _insert(conn, Payment.__table__, payment_rows(), chunk_size)
+    counts['refunds'] = _insert(conn, Refund.__table__, ({
+        'reservation_id': reservation_id, 'amount': price,
+        'status': 'approved', 'reason': 'Trip cancelled',
+        'created_at': datetime.combine(start, datetime.min.time()) - timedelta(days=1),
+        'processed_at': datetime.combine(start, datetime.min.time())
+    } for reservation_id, price, start in cancelled_paid), chunk_size)
+    counts['damage_reports'] = _insert(conn, DamageReport.__table__, ({
+        'description': rng.choice(DAMAGES), 'repair_cost': float(rng.randint(50, 2500)),
+        'status': rng.choice(['reported', 'inspected', 'repaired']),
+        'created_at': datetime.combine(end, datetime.min.time()), 'reservation_id': reservation_id
+    } for reservation_id, end in damaged), chunk_size)
+
+    def favorite_rows():
+        for user_id in user_ids:
+            for car_id in rng.sample(car_ids, min(favorites_per_user, len(car_ids))):
+                yield {'user_id': user_id, 'car_id': car_id, 'created_at': now}
+    counts['favorites'] = _insert(conn, Favorite.__table__, favorite_rows(), chunk_size)
+    db.session.commit()
+
+    # Core inserts bypass the session events that maintain these
+    rollups.rebuild()
+    availability.reload()
+    search_index.reload()
+    catalog_cache.bump()
+    return counts
@@ -0,0 +1,62 @@
+"""Acting on committed writes through the shared SQLAlchemy session.
+
+Several caches and indexes follow what the application writes: while a
+transaction flushes they note what it changed, once it commits they act on
+it (drop a cache entry, update an index), and when it rolls back they forget
+it. ``on_commit`` wires those three session events for one such consumer.
+``on_flush`` is for writes that must happen inside the flushing transaction
+so they commit or roll back together with the changes.
+"""
+from sqlalchemy import event
+
+_registered = {}  # key -> [(event name, listener)]
+
+
+def _listen(key, listeners):
+    from app import db
+    for name, listener in listeners:
+        event.listen(db.session, name, listener)
+    _registered[key] = listeners
+
+
+def on_commit(key, collect, apply, factory=set):
+    """Call collect(session, pending) after every flush and apply(session,
+    pending) after the transaction commits with a non-empty pending.
+
+    pending is created by factory() for each transaction and kept in
+    ``session.info[key]``; a rollback discards it. Registering a key again is
+    a no-op, so init_app can run for several apps."""
+    if key in _registered:
+        return
+
+    def after_flush(session, flush_context):
+        collect(session, session.info.setdefault(key, factory()))
+
+    def after_commit(session):
+        pending = session.info.pop(key, None)
+        if pending:
+            apply(session, pending)
+
+    def after_rollback(session):
+        session.info.pop(key, None)
+
+    _listen(key, [
+        ('after_flush', after_flush),
+        ('after_commit', after_commit),
+        ('after_rollback', after_rollback)
+    ])
+
+
+def on_flush(key, handler):
+    """Call handler(session) after every flush, inside its transaction.
+    Registering a key again is a no-op."""
+    if key in _registered:
+        return
+    _listen(key, [('after_flush', lambda session, flush_context: handler(session))])
+
+
+def remove(key):
+    """Unregister the listeners registered under key"""
+    from app import db
+    for name, listener in _registered.pop(key, ()):
+        event.remove(db.session, name, listener)
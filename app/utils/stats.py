@@ -0,0 +1,299 @@
+"""Incrementally maintained admin statistics.
+
+Reservation count, revenue (completed and refunded payments), damage costs
+and per-car reservation counts are stored in the ``stats_rollup`` and
+``car_reservation_counts`` tables. Every flush that inserts, updates or
+deletes a ``Reservation``, ``Payment``, ``DamageReport`` or ``Car`` applies
+the matching deltas to those tables inside the same transaction, so the
+rollups commit or roll back together with the rows they summarize and stay
+correct across worker processes.
+
+The totals are spread over ``STATS_SHARDS`` rows of ``stats_rollup``, summed
+on read. A transaction adds its deltas to the slot picked by hashing its
+process and thread, so concurrent bookings and payments rarely wait on the
+same row lock, and all flushes of one transaction use the same slot. Per-car
+counts are already one row per car.
+
+``flask rebuild-stats`` recomputes everything from scratch and
+``flask rebuild-stats --verify`` reports drift without writing.
+"""
+import os
+import threading
+import zlib
+from collections import Counter
+
+from sqlalchemy import bindparam, event, func, select
+from sqlalchemy.orm import attributes
+
+# Floating point sums accumulated row by row differ slightly from SUM()
+MONEY_TOLERANCE = 0.01
+
+
+def _history_delta(obj, attr):
+    """(old, new) values of an attribute changed in the current flush"""
+    history = attributes.get_history(obj, attr)
+    old = history.deleted[0] if history.deleted else None
+    new = history.added[0] if history.added else getattr(obj, attr)
+    return old, new
+
+
+def _revenue(status, amount):
+    """Contribution of a payment to the revenue: pending and failed ones
+    have not brought any money in"""
+    from app.models import Payment
+    return (amount or 0) if status in Payment.REVENUE_STATUSES else 0
+
+
+def _slot(shards):
+    """Rollup slot (1..shards) of the transactions of the current thread"""
+    return zlib.crc32(f'{os.getpid()}:{threading.get_ident()}'.encode()) % shards + 1
+
+
+class StatsRollups:
+    _listeners_installed = False
+
+    def init_app(self, app):
+        app.config.setdefault('STATS_SHARDS', 16)
+        self._install_listeners()
+
+    # Reading and rebuilding
+
+    def totals(self):
+        """Totals summed over the rollup slots, or None before the first build"""
+        from app import db
+        from app.models import StatsRollup
+        slots, reservations_count, revenue, damage_costs = db.session.query(
+            func.count(StatsRollup.id),
+            func.sum(StatsRollup.reservations_count),
+            func.sum(StatsRollup.revenue),
+            func.sum(StatsRollup.damage_costs)
+        ).one()
+        if not slots:
+            return None
+        return {
+            'reservations_count': int(reservations_count or 0),
+            'revenue': float(revenue or 0),
+            'damage_costs': float(damage_costs or 0)
+        }
+
+    def read(self):
+        """Current stats from the rollup tables, or None before the first build"""
+        from app import db
+        from app.models import Car, CarReservationCount
+        totals = self.totals()
+        if totals is None:
+            return None
+        popular = db.session.query(
+            CarReservationCount.car_id,
+            Car.make,
+            Car.model,
+            CarReservationCount.count
+        ).join(Car, Car.id == CarReservationCount.car_id)\
+        .filter(CarReservationCount.count > 0)\
+        .order_by(CarReservationCount.count.desc())\
+        .limit(3).all()
+        return {
+            **totals,
+            'popular_cars': [
+                {
+                    'car_id': car_id,
+                    'make': make,
+                    'model': model,
+                    'reservation_count': count
+                } for car_id, make, model, count in popular
+            ]
+        }
+
+    def recompute(self):
+        """Totals and per-car counts computed from the source tables"""
+        from app import db
+        from app.models import DamageReport, Payment, Reservation
+        return {
+            'reservations_count': Reservation.query.count(),
+            'revenue': float(db.session.query(db.func.sum(Payment.amount)).filter(
+                Payment.status.in_(Payment.REVENUE_STATUSES)
+            ).scalar() or 0),
+            'damage_costs': float(db.session.query(db.func.sum(DamageReport.repair_cost)).scalar() or 0),
+            'car_counts': dict(
+                db.session.query(Reservation.car_id, db.func.count(Reservation.id))
+                .filter(Reservation.car_id.isnot(None))
+                .group_by(Reservation.car_id).all()
+            )
+        }
+
+    def rebuild(self):
+        """Replace the rollups with a full recompute"""
+        from flask import current_app
+        from app import db
+        from app.models import CarReservationCount, StatsRollup
+        totals = self.recompute()
+        conn = db.session.connection()
+        conn.execute(CarReservationCount.__table__.delete())
+        conn.execute(StatsRollup.__table__.delete())
+        # The totals go to the first slot, the others start at zero
+        conn.execute(StatsRollup.__table__.insert(), [{
+            'id': StatsRollup.ROW_ID,
+            'reservations_count': totals['reservations_count'],
+            'revenue': totals['revenue'],
+            'damage_costs': totals['damage_costs']
+        }] + [
+            {'id': slot, 'reservations_count': 0, 'revenue': 0.0, 'damage_costs': 0.0}
+            for slot in range(StatsRollup.ROW_ID + 1, current_app.config['STATS_SHARDS'] + 1)
+        ])
+        if totals['car_counts']:
+            conn.execute(CarReservationCount.__table__.insert(), [
+                {'car_id': car_id, 'count': count}
+                for car_id, count in totals['car_counts'].items()
+            ])
+        db.session.commit()
+        return totals
+
+    def verify(self):
+        """Differences between the rollups and a full recompute, as a list of
+        (name, rollup value, recomputed value)"""
+        from app import db
+        from app.models import CarReservationCount
+        expected = self.recompute()
+        totals = self.totals()
+        if totals is None:
+            return [('stats_rollup', None, 'missing')]
+
+        diffs = []
+        if totals['reservations_count'] != expected['reservations_count']:
+            diffs.append(('reservations_count', totals['reservations_count'], expected['reservations_count']))
+        for name in ('revenue', 'damage_costs'):
+            if abs(totals[name] - expected[name]) > MONEY_TOLERANCE:
+                diffs.append((name, totals[name], expected[name]))
+
+        actual = {
+            car_id: count for car_id, count in
+            db.session.query(CarReservationCount.car_id, CarReservationCount.count)
+            if count
+        }
+        for car_id in sorted(actual.keys() | expected['car_counts'].keys()):
+            if actual.get(car_id, 0) != expected['car_counts'].get(car_id, 0):
+                diffs.append((f'car:{car_id}', actual.get(car_id, 0), expected['car_counts'].get(car_id, 0)))
+        return diffs
+
+    # Session event handlers
+
+    def _install_listeners(self):
+        if StatsRollups._listeners_installed:
+            return
+        from app import db
+        event.listen(db.session, 'before_flush', self._collect_changes)
+        event.listen(db.session, 'after_flush', self._apply_deltas)
+        StatsRollups._listeners_installed = True
+
+    @staticmethod
+    def _collect_changes(session, flush_context, instances):
+        """Record the deltas of updated and deleted rows while their previous
+        values can still be loaded; inserts are counted after the flush once
+        their keys are assigned"""
+        from app.models import Car, DamageReport, Payment, Reservation
+        totals = Counter()
+        car_counts = Counter()
+        deleted_cars = []
+
+        for obj in session.dirty:
+            if isinstance(obj, Reservation):
+                old, new = _history_delta(obj, 'car_id')
+                if old != new and old is not None:
+                    car_counts[old] -= 1
+                    if new is not None:
+                        car_counts[new] += 1
+            elif isinstance(obj, Payment):
+                old_amount, new_amount = _history_delta(obj, 'amount')
+                old_status, new_status = _history_delta(obj, 'status')
+                if old_amount is None:
+                    old_amount = new_amount
+                if old_status is None:
+                    old_status = new_status
+                totals['revenue'] += _revenue(new_status, new_amount) - _revenue(old_status, old_amount)
+            elif isinstance(obj, DamageReport):
+                old, new = _history_delta(obj, 'repair_cost')
+                if old is not None:
+                    totals['damage_costs'] += (new or 0) - old
+
+        for obj in session.deleted:
+            if isinstance(obj, Reservation):
+                totals['reservations_count'] -= 1
+                car_id = attributes.get_history(obj, 'car_id').deleted or [obj.car_id]
+                if car_id[0] is not None:
+                    car_counts[car_id[0]] -= 1
+            elif isinstance(obj, Payment):
+                totals['revenue'] -= _revenue(
+                    (attributes.get_history(obj, 'status').deleted or [obj.status])[0],
+                    (attributes.get_history(obj, 'amount').deleted or [obj.amount])[0]
+                )
+            elif isinstance(obj, DamageReport):
+                totals['damage_costs'] -= obj.repair_cost or 0
+            elif isinstance(obj, Car):
+                deleted_cars.append(obj.id)
+
+        session.info['stats_pending'] = (totals, car_counts, deleted_cars)
+
+    def _apply_deltas(self, session, flush_context):
+        from flask import current_app
+        from app.models import Car, CarReservationCount, DamageReport, Payment, Reservation, StatsRollup
+        totals, car_counts, deleted_cars = session.info.pop(
+            'stats_pending', (Counter(), Counter(), [])
+        )
+        new_cars = []
+        for obj in session.new:
+            if isinstance(obj, Reservation):
+                totals['reservations_count'] += 1
+                if obj.car_id is not None:
+                    car_counts[obj.car_id] += 1
+            elif isinstance(obj, Payment):
+                totals['revenue'] += _revenue(obj.status, obj.amount)
+            elif isinstance(obj, DamageReport):
+                totals['damage_costs'] += obj.repair_cost or 0
+            elif isinstance(obj, Car):
+                new_cars.append(obj.id)
+
+        if not (any(totals.values()) or any(car_counts.values()) or new_cars or deleted_cars):
+            return
+
+        conn = session.connection()
+        rollup = StatsRollup.__table__
+        counts = CarReservationCount.__table__
+
+        def add_to(slot):
+            return conn.execute(rollup.update().where(rollup.c.id == slot).values(
+                reservations_count=rollup.c.reservations_count + totals['reservations_count'],
+                revenue=rollup.c.revenue + totals['revenue'],
+                damage_costs=rollup.c.damage_costs + totals['damage_costs']
+            )).rowcount
+
+        if any(totals.values()):
+            # A slot beyond those of the last rebuild (STATS_SHARDS was raised)
+            # falls back to the first one
+            slot = _slot(current_app.config['STATS_SHARDS'])
+            if not add_to(slot) and (slot == StatsRollup.ROW_ID or not add_to(StatsRollup.ROW_ID)):
+                # Nothing built yet: the first read does a full rebuild instead
+                return
+        elif not conn.execute(select(rollup.c.id).limit(1)).first():
+            return
+
+        for car_id in new_cars:
+            conn.execute(counts.insert().values(car_id=car_id, count=car_counts.pop(car_id, 0)))
+        # One executemany for all cars; rows missing from the table are
+        # looked up only when fewer rows than cars were updated
+        deltas = [{'car': car_id, 'delta': delta} for car_id, delta in car_counts.items() if delta]
+        if deltas:
+            result = conn.execute(counts.update().where(counts.c.car_id == bindparam('car')).values(
+                count=counts.c.count + bindparam('delta')
+            ), deltas)
+            if result.rowcount < len(deltas):
+                existing = set(conn.execute(select(counts.c.car_id).where(
+                    counts.c.car_id.in_([d['car'] for d in deltas])
+                )).scalars())
+                missing = [{'car_id': d['car'], 'count': d['delta']} for d in deltas if d['car'] not in existing]
+                if missing:
+                    conn.execute(counts.insert(), missing)
+        if deleted_cars:
+            conn.execute(counts.delete().where(counts.c.car_id.in_(deleted_cars)))
+
+
+rollups = StatsRollups()
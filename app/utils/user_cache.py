@@ -0,0 +1,71 @@
+"""Cached user loading for Flask-Login.
+
+Users are loaded with their ``Admin``/``Client`` columns in the same query
+through ``with_polymorphic``. Loaded users are kept for the current request in
+``g`` and, detached, in the app ``cache`` for ``USER_CACHE_TTL`` seconds; a
+cache hit is merged back into the session without a query. Committing any
+change to a user (profile fields, password) or deleting it drops the cached
+copy.
+"""
+from flask import g, has_app_context
+from sqlalchemy.orm import with_polymorphic
+
+from app import cache
+from app.utils.session_events import on_commit
+
+
+class UserCache:
+    def init_app(self, app):
+        app.config.setdefault('USER_CACHE_TTL', 30)
+        on_commit('users_changed', self._collect_changes, self._apply_changes)
+
+    @staticmethod
+    def _key(user_id):
+        return f'user:{int(user_id)}'
+
+    def load(self, user_id):
+        """Return the user with the given id, or None"""
+        from flask import current_app
+        from app import db
+        user_id = int(user_id)
+        loaded = g.setdefault('_loaded_users', {})
+        if user_id in loaded:
+            return loaded[user_id]
+
+        user = cache.get(self._key(user_id))
+        if user is not None:
+            user = db.session.merge(user, load=False)
+        else:
+            user = self._query(user_id)
+            if user is not None:
+                cache.set(self._key(user_id), user, timeout=current_app.config['USER_CACHE_TTL'])
+        loaded[user_id] = user
+        return user
+
+    @staticmethod
+    def _query(user_id):
+        from app import db
+        from app.models.user import Admin, Client, User
+        users = with_polymorphic(User, [Admin, Client])
+        return db.session.query(users).filter(users.id == user_id).first()
+
+    def invalidate(self, user_id):
+        cache.delete(self._key(user_id))
+        if has_app_context():
+            g.get('_loaded_users', {}).pop(int(user_id), None)
+
+    # Session event handlers
+
+    @staticmethod
+    def _collect_changes(session, changed):
+        from app.models.user import User
+        for obj in (*session.dirty, *session.deleted):
+            if isinstance(obj, User):
+                changed.add(obj.id)
+
+    def _apply_changes(self, session, changed):
+        for user_id in changed:
+            self.invalidate(user_id)
+
+
+user_cache = UserCache()
@@ -0,0 +1,79 @@
+"""Compare the per-car availability loop with the single NOT EXISTS query.
+
+    python -m benchmarks.availability_search --cars 10000 --reservations 1000000
+"""
+import argparse
+import os
+import random
+from datetime import date, timedelta
+
+from app.models import Car, Reservation, User, db
+from benchmarks.common import create_bench_app, insert_chunked, timed
+
+
+def seed(cars, reservations, seed_value):
+    rng = random.Random(seed_value)
+    db.session.execute(User.__table__.insert(), [{
+        'email': 'bench@example.com', 'password_hash': 'x',
+        'role': 'client', 'type': 'client'
+    }])
+    insert_chunked(Car.__table__, ({
+        'make': 'Make%d' % (i % 50), 'model': 'Model%d' % i, 'year': 2020,
+        'price_per_day': 50 + i % 100, 'status': 'available',
+        'vehicle_type': 'sedan', 'location': 'city', 'category': 'medium'
+    } for i in range(cars)))
+
+    per_car = max(1, reservations // cars)
+    origin = date(2020, 1, 1)
+
+    def rows():
+        for car_id in range(1, cars + 1):
+            day = origin + timedelta(days=rng.randint(0, 5))
+            for _ in range(per_car):
+                span = rng.randint(1, 6)
+                yield {
+                    'car_id': car_id, 'user_id': 1, 'start_date': day,
+                    'end_date': day + timedelta(days=span), 'total_price': 100.0,
+                    'status': 'cancelled' if rng.random() < 0.05 else 'confirmed',
+                    'rental_type': 'daily', 'damage_charge': 0.0
+                }
+                day += timedelta(days=span + rng.randint(1, 3))
+
+    insert_chunked(Reservation.__table__, rows())
+    # Query somewhere inside the booked history so the lookups do real work
+    return origin + timedelta(days=per_car * 3), origin + timedelta(days=per_car * 3 + 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cars', type=int, default=10000)
+    parser.add_argument('--reservations', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    _, db_path = create_bench_app(AVAILABILITY_INDEX=False)
+    start, end = seed(args.cars, args.reservations, args.seed)
+    print(f"Seeded {args.cars} cars / {args.reservations} reservations, window {start}..{end}")
+
+    def per_car_loop():
+        cars = Car.query.filter_by(status='available').all()
+        return [car.id for car in cars if car.is_available(start, end)]
+
+    def single_query():
+        return [car.id for car in Car.query.filter(
+            Car.status == 'available', Car.available_between(start, end)
+        )]
+
+    loop_time, loop_ids = timed(per_car_loop, args.repeat)
+    query_time, query_ids = timed(single_query, args.repeat)
+    assert sorted(loop_ids) == sorted(query_ids), "both strategies must agree"
+
+    print(f"per-car loop   : {loop_time * 1000:9.1f} ms ({args.cars + 1} queries)")
+    print(f"NOT EXISTS     : {query_time * 1000:9.1f} ms (1 query)")
+    print(f"available cars : {len(query_ids)}  speedup x{loop_time / query_time:.1f}")
+    os.remove(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Booking throughput with the per-car lock, on one hot car and across cars.
+
+    python -m benchmarks.booking --threads 16 --bookings 800 --cars 50
+"""
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from app.models import Car, Reservation, db
+from app.models.user import Client
+from benchmarks.common import create_bench_app
+from benchmarks.loadgen import database_double_bookings
+
+EMAIL, PASSWORD = 'bench@example.com', 'bench123'
+
+
+def run(app, headers, car_ids, bookings, threads, rng):
+    """Fire bookings at random cars and windows; return (seconds, statuses)"""
+    windows = []
+    for _ in range(bookings):
+        start = date.today() + timedelta(days=rng.randint(1, 365))
+        windows.append((rng.choice(car_ids), start, start + timedelta(days=rng.randint(1, 5))))
+
+    def book(window):
+        car_id, start, end = window
+        response = app.test_client().post('/api/cars/reserve', headers=headers, json={
+            'car_id': car_id, 'start_date': start.isoformat(), 'end_date': end.isoformat()
+        })
+        return response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(book, windows))
+    return time.perf_counter() - started, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--bookings', type=int, default=800)
+    parser.add_argument('--cars', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    app, db_path = create_bench_app(PASSWORD_HASH_METHOD='pbkdf2:sha256:1000')
+    user = Client(email=EMAIL, type='client', driving_license='BENCH')
+    user.set_password(PASSWORD)
+    cars = [Car(make='Toyota', model=f'Camry {i}', year=2022, price_per_day=50,
+                vehicle_type='sedan', location='city') for i in range(args.cars)]
+    db.session.add_all([user, *cars])
+    db.session.commit()
+    car_ids = [car.id for car in cars]
+    token = app.test_client().post('/api/auth/login', json={'email': EMAIL, 'password': PASSWORD}).get_json()
+    headers = {'Authorization': f"Bearer {token['access_token']}"}
+    rng = random.Random(args.seed)
+
+    print(f"{args.bookings} bookings from {args.threads} threads")
+    print(f"{'cars':>6}{'seconds':>10}{'req/s':>9}{'booked':>8}{'conflict':>10}{'other':>7}{'overlaps':>10}")
+    for label, ids in (('1', car_ids[:1]), (str(args.cars), car_ids)):
+        Reservation.query.delete()
+        db.session.commit()
+        db.session.remove()
+        elapsed, statuses = run(app, headers, ids, args.bookings, args.threads, rng)
+        overlaps = len(database_double_bookings())
+        db.session.remove()
+        other = len(statuses) - statuses.count(201) - statuses.count(400)
+        print(f"{label:>6}{elapsed:>10.2f}{len(statuses) / elapsed:>9.1f}{statuses.count(201):>8}"
+              f"{statuses.count(400):>10}{other:>7}{overlaps:>10}")
+
+    os.remove(db_path)
+
+
+if __name__ == '__main__':
+    main()
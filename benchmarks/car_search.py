@@ -0,0 +1,68 @@
+"""Compare ILIKE '%x%' scans with the trigram index for make/model search.
+
+    python -m benchmarks.car_search --cars 100000
+"""
+import argparse
+import os
+import random
+import string
+
+from app.models import Car
+from app.utils.search_index import search_index
+from benchmarks.common import create_bench_app, insert_chunked, timed
+
+MAKES = ['Toyota', 'Ford', 'Honda', 'Chevrolet', 'Nissan', 'Jeep', 'Hyundai', 'Kia',
+         'Subaru', 'Mazda', 'Volkswagen', 'BMW', 'Mercedes-Benz', 'Audi', 'Lexus',
+         'Tesla', 'Volvo', 'Porsche', 'Land Rover', 'Mitsubishi']
+
+
+def seed(cars, rng):
+    def model_name():
+        return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 9))).title()
+
+    insert_chunked(Car.__table__, ({
+        'make': rng.choice(MAKES), 'model': model_name(), 'year': 2020,
+        'price_per_day': 50.0, 'status': 'available', 'vehicle_type': 'sedan',
+        'location': 'city', 'category': 'medium'
+    } for _ in range(cars)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cars', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    _, db_path = create_bench_app()
+    rng = random.Random(args.seed)
+    seed(args.cars, rng)
+    sample = Car.query.get(args.cars // 2)
+    search_index.reload()
+
+    cases = [
+        ('make', 'porsch'),            # about 5% of the fleet
+        ('model', sample.model[1:5]),  # a handful of cars
+        ('model', '0000'),             # no match
+    ]
+    print(f"{args.cars} cars")
+    print(f"{'field':<7}{'text':<10}{'matches':>8}{'ILIKE':>12}{'index':>12}")
+    for field, text in cases:
+        column = getattr(Car, field)
+
+        def scan():
+            return Car.query.filter(Car.status == 'available', column.ilike(f'%{text}%')).all()
+
+        def indexed():
+            return search_index.filter(Car.query.filter(Car.status == 'available'), field, text).all()
+
+        scan_time, scanned = timed(scan, args.repeat)
+        index_time, found = timed(indexed, args.repeat)
+        assert {c.id for c in scanned} == {c.id for c in found}
+        print(f"{field:<7}{text:<10}{len(found):>8}{scan_time * 1000:>9.2f} ms{index_time * 1000:>9.2f} ms")
+
+    os.remove(db_path)
+
+
+if __name__ == '__main__':
+    main()
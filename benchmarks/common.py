@@ -0,0 +1,63 @@
+"""Helpers shared by the benchmark scripts"""
+import os
+import statistics
+import tempfile
+import time
+
+from app import create_app, db
+from config import Config
+
+
+def create_bench_app(db_path=None, **overrides):
+    """Build the app on a scratch SQLite database and push an app context"""
+    if db_path is None:
+        fd, db_path = tempfile.mkstemp(suffix='.db', prefix='bench-')
+        os.close(fd)
+
+    class BenchConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + db_path
+        SQLALCHEMY_RECORD_QUERIES = False
+        WTF_CSRF_ENABLED = False
+        JWT_COOKIE_CSRF_PROTECT = False
+
+    for key, value in overrides.items():
+        setattr(BenchConfig, key, value)
+
+    app = create_app(BenchConfig)
+    app.app_context().push()
+    db.create_all()
+    return app, db_path
+
+
+def insert_chunked(table, rows, chunk_size=50000):
+    """executemany() the rows of an iterable into a table, chunk by chunk"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            db.session.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(table.insert(), chunk)
+    db.session.commit()
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    """Nearest-rank percentiles of a list of samples, keyed p50/p95/p99"""
+    ordered = sorted(samples)
+    return {
+        f'p{point}': ordered[max(0, -(-point * len(ordered) // 100) - 1)] if ordered else 0.0
+        for point in points
+    }
+
+
+def timed(fn, repeat=5):
+    """Run fn repeat times and return (median seconds, last result)"""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), result
@@ -0,0 +1,224 @@
+"""Time the hot API endpoints in-process and compare them with a baseline.
+
+Builds the app on a seeded scratch database, drives it through the Flask test
+client and reports p50/p95/p99 latency and SQL queries per request:
+
+    python -m benchmarks.endpoints --cars 2000 --users 500 --reservations 20000
+    python -m benchmarks.endpoints --save-baseline   # record benchmarks/baseline.json
+    python -m benchmarks.endpoints --baseline benchmarks/baseline.json
+    python -m benchmarks.endpoints --check-latency   # also gate on p50
+
+Against a baseline recorded with the same data sizes, the run exits with
+status 1 when an endpoint issues more queries per request than recorded.
+Query counts do not depend on the machine. Timings do, so p50 growth beyond
+--tolerance only fails the run with --check-latency. Use it against a
+baseline saved on the same machine.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import event
+
+from app.models import Car, Reservation, db
+from app.models.user import Admin, Client
+from app.utils.payment_queue import payment_queue
+from app.utils.seed import seed_database
+from benchmarks.common import create_bench_app, percentiles
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+EMAIL, PASSWORD = 'bench@example.com', 'bench123'
+ADMIN_EMAIL, ADMIN_PASSWORD = 'admin@example.com', 'admin123'
+
+
+def seed(cars, users, reservations, seed_value):
+    """Seed synthetic data plus the client and admin the benchmark logs in as"""
+    seed_database(users=users, cars=cars, reservations=reservations, seed=seed_value,
+                  today=date(2025, 1, 1))
+    bench = Client(email=EMAIL, type='client', driving_license='BENCH')
+    bench.set_password(PASSWORD)
+    admin = Admin(email=ADMIN_EMAIL, type='admin', perms='full')
+    admin.set_password(ADMIN_PASSWORD)
+    db.session.add_all([bench, admin])
+    db.session.commit()
+    return bench.id
+
+
+class QueryCounter:
+    """Queries issued by the benchmarking thread"""
+    def __init__(self):
+        self.count = 0
+        self.thread = threading.get_ident()
+        event.listen(db.engine, 'before_cursor_execute', self._record)
+
+    def _record(self, *args):
+        if threading.get_ident() == self.thread:
+            self.count += 1
+
+
+def make_cases(client, user_id, repeat):
+    """(name, repeat, callable) per endpoint; each callable sends one request"""
+    def login(email, password):
+        response = client.post('/api/auth/login', json={'email': email, 'password': password})
+        return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+    user, admin = login(EMAIL, PASSWORD), login(ADMIN_EMAIL, ADMIN_PASSWORD)
+    car_id = Car.query.order_by(Car.id.desc()).first().id
+    fleet = [car.id for car in Car.query.filter_by(status='available').order_by(Car.id).limit(20)]
+
+    # Unpaid reservations far in the future, one per payment request and
+    # warm-up of the two payment cases
+    payable = []
+    for i in range(2 * (repeat + 1)):
+        start = date(2035, 1, 1) + timedelta(days=3 * i)
+        reservation = Reservation(user_id=user_id, car_id=car_id, start_date=start,
+                                  end_date=start + timedelta(days=2), total_price=100, status='pending')
+        db.session.add(reservation)
+        db.session.flush()
+        payable.append(reservation.id)
+    db.session.commit()
+    db.session.remove()
+
+    windows = iter(range(10 ** 6))
+
+    def reserve():
+        start = date(2040, 1, 1) + timedelta(days=3 * next(windows))
+        return client.post('/api/cars/reserve', headers=user, json={
+            'car_id': car_id, 'start_date': start.isoformat(),
+            'end_date': (start + timedelta(days=2)).isoformat()
+        })
+
+    def reserve_bulk():
+        start = date(2045, 1, 1) + timedelta(days=3 * next(windows))
+        return client.post('/api/cars/reserve/bulk', headers=user, json={'reservations': [{
+            'car_id': fleet_car, 'start_date': start.isoformat(),
+            'end_date': (start + timedelta(days=2)).isoformat()
+        } for fleet_car in fleet]})
+
+    payments = iter(payable)
+
+    def pay():
+        return client.post('/api/payments/process', headers=user,
+                           json={'reservation_id': next(payments), 'method': 'credit_card'})
+
+    def pay_and_settle():
+        # No worker threads: settle the job here so every request of the
+        # case runs the same queries
+        payment_id = pay().get_json()['payment_id']
+        payment_queue.run_pending()
+        db.session.remove()
+        return client.get(f'/api/payments/{payment_id}', headers=user)
+
+    return [
+        ('login', max(3, repeat // 10), lambda: login(EMAIL, PASSWORD)),
+        ('cars', repeat, lambda: client.get('/api/cars/')),
+        ('search', repeat, lambda: client.get('/api/cars/search?make=toy&type=sedan')),
+        ('search_dates', repeat, lambda: client.get(
+            '/api/cars/search?type=suv&start_date=2024-02-01&end_date=2024-02-05')),
+        ('quotes', repeat, lambda: client.get('/api/cars/quotes', query_string=[
+            ('range', f'2025-0{month}-01,2025-0{month}-{days:02d}') for month in range(1, 4) for days in (4, 15)
+        ])),
+        ('reserve', repeat, reserve),
+        ('process_payment', repeat, pay),
+        ('payment_settled', repeat, pay_and_settle),
+        ('user_reservations', repeat, lambda: client.get('/api/payments/reservations', headers=user)),
+        ('admin_reservations', repeat, lambda: client.get('/api/admin/reservations?limit=100', headers=admin)),
+        ('admin_stats', repeat, lambda: client.get('/api/admin/stats', headers=admin)),
+        ('admin_export', max(3, repeat // 10), lambda: client.get(
+            '/api/admin/reservations/export', headers=admin).get_data()),
+        # Last: it adds 20 reservations per request to the user's history
+        ('reserve_bulk_20', repeat, reserve_bulk),
+    ]
+
+
+def run_case(fn, repeat, counter):
+    samples, queries = [], []
+    for _ in range(repeat):
+        before = counter.count
+        start = time.perf_counter()
+        response = fn()
+        samples.append(time.perf_counter() - start)
+        queries.append(counter.count - before)
+        status = getattr(response, 'status_code', 200)
+        if status >= 400:
+            raise RuntimeError(f'request failed with {status}: {response.get_data(as_text=True)[:200]}')
+        db.session.remove()
+    result = {name: round(value * 1000, 3) for name, value in percentiles(samples).items()}
+    result['queries'] = max(queries)
+    return result
+
+
+def compare(results, baseline, tolerance=None):
+    """Regression messages for results against a baseline; p50 times are
+    only compared when a tolerance is given"""
+    failures = []
+    for name, result in results.items():
+        expected = baseline['results'].get(name)
+        if expected is None:
+            continue
+        if result['queries'] > expected['queries']:
+            failures.append(f"{name}: {result['queries']} queries per request, baseline {expected['queries']}")
+        if tolerance is not None and result['p50'] > expected['p50'] * (1 + tolerance):
+            failures.append(f"{name}: p50 {result['p50']:.2f} ms, baseline {expected['p50']:.2f} ms")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cars', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--reservations', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help="allowed relative p50 growth with --check-latency (default 0.5)")
+    parser.add_argument('--check-latency', action='store_true',
+                        help="also fail when a p50 grew beyond --tolerance")
+    args = parser.parse_args()
+
+    app, db_path = create_bench_app(PAYMENT_WORKER_THREADS=0)
+    sizes = {'cars': args.cars, 'users': args.users, 'reservations': args.reservations}
+    user_id = seed(args.cars, args.users, args.reservations, args.seed)
+    client = app.test_client()
+    counter = QueryCounter()
+
+    results = {}
+    print(f"{args.cars} cars, {args.users} users, {args.reservations} reservations")
+    print(f"{'endpoint':<20}{'p50':>10}{'p95':>10}{'p99':>10}{'queries':>9}")
+    for name, repeat, fn in make_cases(client, user_id, args.repeat):
+        fn()  # warm caches and indexes
+        db.session.remove()
+        results[name] = result = run_case(fn, repeat, counter)
+        print(f"{name:<20}{result['p50']:>7.2f} ms{result['p95']:>7.2f} ms{result['p99']:>7.2f} ms{result['queries']:>9}")
+    os.remove(db_path)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'sizes': sizes, 'results': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['sizes'] != sizes:
+        print(f"Baseline was recorded with {baseline['sizes']}; not comparing")
+        return
+    failures = compare(results, baseline, args.tolerance if args.check_latency else None)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    if failures:
+        sys.exit(1)
+    print("No regressions against the baseline")
+
+
+if __name__ == '__main__':
+    main()
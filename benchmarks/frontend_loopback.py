@@ -0,0 +1,93 @@
+"""Compare the old loopback HTTP calls made by the frontend with direct
+service calls.
+
+    python -m benchmarks.frontend_loopback --reservations 50 --repeat 200
+"""
+import argparse
+import logging
+import os
+import threading
+from datetime import date, timedelta
+
+import requests
+from werkzeug.serving import make_server
+
+from app.models import Car, Reservation, db
+from app.models.user import Client
+from app.services.auth import authenticate
+from app.services.reservations import list_user_reservations
+from benchmarks.common import create_bench_app, timed
+
+EMAIL, PASSWORD = 'bench@example.com', 'bench123'
+
+
+def seed(reservations):
+    user = Client(email=EMAIL, type='client', driving_license='BENCH')
+    user.set_password(PASSWORD)
+    car = Car(make='Toyota', model='Camry', year=2022, price_per_day=50,
+              vehicle_type='sedan', location='city')
+    db.session.add_all([user, car])
+    db.session.flush()
+    for i in range(reservations):
+        start = date(2030, 1, 1) + timedelta(days=3 * i)
+        db.session.add(Reservation(
+            user_id=user.id, car_id=car.id, start_date=start,
+            end_date=start + timedelta(days=2), total_price=100, status='pending'
+        ))
+    db.session.commit()
+    return user.id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--reservations', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    app, db_path = create_bench_app()
+    user_id = seed(args.reservations)
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}/api'
+    http = requests.Session()
+
+    def loopback_login():
+        return http.post(f'{base}/auth/login', json={'email': EMAIL, 'password': PASSWORD}).json()
+
+    token = loopback_login()['access_token']
+
+    def loopback_reservations():
+        return http.get(f'{base}/payments/reservations',
+                        headers={'Authorization': f'Bearer {token}'}).json()
+
+    def service_login():
+        return authenticate(EMAIL, PASSWORD)
+
+    def service_reservations():
+        result = list_user_reservations(user_id)
+        db.session.remove()
+        return result
+
+    rows = []
+    for name, before, after in [
+        ('login', loopback_login, service_login),
+        ('list reservations', loopback_reservations, service_reservations),
+    ]:
+        # Password hashing dominates login, so it gets fewer rounds
+        repeat = max(5, args.repeat // 20) if name == 'login' else args.repeat
+        before_time, _ = timed(before, repeat)
+        after_time, _ = timed(after, repeat)
+        rows.append((name, before_time, after_time))
+
+    print(f"{'call':<20}{'loopback HTTP':>16}{'in-process':>14}")
+    for name, before_time, after_time in rows:
+        print(f"{name:<20}{before_time * 1000:>13.2f} ms{after_time * 1000:>11.2f} ms")
+
+    server.shutdown()
+    os.remove(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+"""Replay a concurrent mix of browse/search/reserve/pay/admin traffic.
+
+By default the app is built on a freshly seeded scratch database and served by
+a local threaded server; --in-process drives it through the Flask test client
+instead, and --url targets a server that is already running:
+
+    python -m benchmarks.loadgen --workers 16 --duration 30
+    python -m benchmarks.loadgen --in-process --workers 8 --requests 2000
+    python -m benchmarks.loadgen --processes 4 --workers 8 --duration 30
+    python -m benchmarks.loadgen --url http://localhost:5000 --email client@example.com --password client123
+
+The mix is given as weights, e.g. --mix browse=40,search=30,reserve=15,pay=10,admin=5.
+Reservations target a small set of hot cars so bookings contend. Every booking
+the server accepted is checked for overlaps with the others on the same car,
+and with a local database the reservations table is checked as well; the run
+exits with status 1 when a double booking is found.
+"""
+import argparse
+import itertools
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, timedelta
+
+import requests
+
+from benchmarks.common import percentiles
+
+DEFAULT_MIX = 'browse=40,search=30,reserve=15,pay=10,admin=5'
+TYPES = ['sedan', 'suv', '4x4', 'luxury']
+LOCATIONS = ['city', 'mountains', 'desert', 'snow']
+
+
+class HttpTarget:
+    """Sends requests to a running server, one connection pool per thread"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self._local = threading.local()
+
+    def request(self, method, path, headers=None, json=None):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        response = session.request(method, self.base_url + path, headers=headers, json=json, timeout=60)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, body
+
+
+class AppTarget:
+    """Calls the WSGI app in-process through the Flask test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, headers=None, json=None):
+        response = self.client.open(path, method=method, headers=headers, json=json)
+        return response.status_code, response.get_json(silent=True)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('browse', 'search', 'reserve', 'pay', 'admin'):
+            raise SystemExit(f"Unknown operation in mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def login(target, email, password):
+    status, body = target.request('POST', '/api/auth/login', json={'email': email, 'password': password})
+    if status != 200:
+        raise SystemExit(f"Login as {email} failed with {status}: {body}")
+    return {'Authorization': f"Bearer {body['access_token']}"}
+
+
+def run_workers(target, accounts, admin_account, car_ids, hot_cars, mix, workers,
+                duration=None, total_requests=None, seed=0):
+    """Run the mix from a thread pool and return (samples, bookings).
+
+    samples maps an operation to a list of (seconds, outcome) where outcome is
+    'ok', 'rejected' (4xx) or 'error' (5xx or no response); bookings lists the
+    (car_id, start, end) of every accepted reservation."""
+    if isinstance(target, str):
+        target = HttpTarget(target)
+    operations, weights = zip(*mix.items())
+    admin_headers = login(target, *admin_account) if 'admin' in mix else None
+    samples = defaultdict(list)
+    bookings = []
+    lock = threading.Lock()
+    issued = itertools.count()
+    deadline = time.monotonic() + duration if duration else None
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        headers = login(target, *accounts[index % len(accounts)])
+        unpaid = []
+        local_samples = defaultdict(list)
+        local_bookings = []
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            if total_requests is not None and next(issued) >= total_requests:
+                break
+            operation = rng.choices(operations, weights)[0]
+            if operation == 'pay' and not unpaid:
+                operation = 'browse'
+            start = time.perf_counter()
+            try:
+                status, body = perform(operation, target, rng, headers, admin_headers,
+                                       car_ids, hot_cars, unpaid, local_bookings)
+            except requests.RequestException:
+                status = None
+            elapsed = time.perf_counter() - start
+            outcome = 'error' if status is None or status >= 500 else 'rejected' if status >= 400 else 'ok'
+            local_samples[operation].append((elapsed, outcome))
+        with lock:
+            for operation, values in local_samples.items():
+                samples[operation].extend(values)
+            bookings.extend(local_bookings)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(worker, i) for i in range(workers)]:
+            future.result()
+    return dict(samples), bookings
+
+
+def perform(operation, target, rng, headers, admin_headers, car_ids, hot_cars, unpaid, bookings):
+    if operation == 'browse':
+        if rng.random() < 0.3:
+            return target.request('GET', '/api/cars/')
+        return target.request('GET', f'/api/cars/{rng.choice(car_ids)}')
+
+    if operation == 'search':
+        query = f'type={rng.choice(TYPES)}&location={rng.choice(LOCATIONS)}'
+        if rng.random() < 0.3:
+            start = date.today() + timedelta(days=rng.randint(1, 60))
+            query += f'&start_date={start}&end_date={start + timedelta(days=rng.randint(1, 7))}'
+        return target.request('GET', f'/api/cars/search?{query}')
+
+    if operation == 'reserve':
+        car_id = rng.choice(hot_cars)
+        start = date.today() + timedelta(days=rng.randint(1, 90))
+        end = start + timedelta(days=rng.randint(1, 7))
+        status, body = target.request('POST', '/api/cars/reserve', headers=headers, json={
+            'car_id': car_id, 'start_date': start.isoformat(), 'end_date': end.isoformat()
+        })
+        if status == 201:
+            unpaid.append(body['reservation_id'])
+            bookings.append((car_id, start, end))
+        return status, body
+
+    if operation == 'pay':
+        return target.request('POST', '/api/payments/process', headers=headers,
+                              json={'reservation_id': unpaid.pop(), 'method': 'credit_card'})
+
+    if rng.random() < 0.5:
+        return target.request('GET', '/api/admin/stats', headers=admin_headers)
+    return target.request('GET', '/api/admin/reservations?limit=50', headers=admin_headers)
+
+
+def overlapping_bookings(bookings):
+    """Pairs of accepted bookings that overlap on the same car (inclusive
+    dates, like Reservation.overlapping)"""
+    by_car = defaultdict(list)
+    for car_id, start, end in bookings:
+        by_car[car_id].append((start, end))
+    violations = []
+    for car_id, stays in by_car.items():
+        stays.sort()
+        latest_end = None
+        for start, end in stays:
+            if latest_end is not None and start <= latest_end:
+                violations.append((car_id, start, end))
+            latest_end = end if latest_end is None else max(latest_end, end)
+    return violations
+
+
+def database_double_bookings():
+    """Non-cancelled reservation pairs overlapping on a car, from the database"""
+    from sqlalchemy import and_
+    from sqlalchemy.orm import aliased
+    from app.models import Reservation, db
+    other = aliased(Reservation)
+    return db.session.query(Reservation.id, other.id).join(other, and_(
+        other.car_id == Reservation.car_id,
+        other.id > Reservation.id,
+        other.start_date <= Reservation.end_date,
+        other.end_date >= Reservation.start_date
+    )).filter(Reservation.status != 'cancelled', other.status != 'cancelled').all()
+
+
+def report(samples, elapsed):
+    print(f"{'operation':<10}{'requests':>10}{'ok':>8}{'4xx':>8}{'errors':>8}{'req/s':>9}"
+          f"{'p50':>11}{'p95':>11}{'p99':>11}")
+    everything = []
+    for operation in sorted(samples):
+        values = samples[operation]
+        everything.extend(values)
+        print_row(operation, values, elapsed)
+    print_row('total', everything, elapsed)
+
+
+def print_row(name, values, elapsed):
+    outcomes = defaultdict(int)
+    for _, outcome in values:
+        outcomes[outcome] += 1
+    points = percentiles([seconds for seconds, _ in values])
+    print(f"{name:<10}{len(values):>10}{outcomes['ok']:>8}{outcomes['rejected']:>8}{outcomes['error']:>8}"
+          f"{len(values) / elapsed:>9.1f}"
+          + ''.join(f"{points[p] * 1000:>8.1f} ms" for p in ('p50', 'p95', 'p99')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="target an already running server instead of a seeded local one")
+    parser.add_argument('--in-process', action='store_true', help="use the Flask test client, no HTTP")
+    parser.add_argument('--workers', type=int, default=8, help="threads per process")
+    parser.add_argument('--processes', type=int, default=1, help="processes (HTTP targets only)")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds to run")
+    parser.add_argument('--requests', type=int, help="stop after this many requests per process instead")
+    parser.add_argument('--mix', default=DEFAULT_MIX)
+    parser.add_argument('--hot-cars', type=int, default=10, help="cars that reservations compete for")
+    parser.add_argument('--cars', type=int, default=200)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--reservations', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--email', default='client@example.com')
+    parser.add_argument('--password', default='client123')
+    parser.add_argument('--admin-email', default='admin@rental.com')
+    parser.add_argument('--admin-password', default='admin123')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    duration = None if args.requests else args.duration
+    if args.in_process and args.processes > 1:
+        raise SystemExit("--processes needs an HTTP target; drop --in-process")
+
+    server = db_path = None
+    if args.url:
+        target = HttpTarget(args.url)
+        accounts = [(args.email, args.password)]
+        admin_account = (args.admin_email, args.admin_password)
+    else:
+        import logging
+        from werkzeug.serving import make_server
+        from app.models import User, db
+        from app.models.user import Admin
+        from app.utils.seed import DEFAULT_PASSWORD, seed_database
+        from benchmarks.common import create_bench_app
+
+        app, db_path = create_bench_app(SQLALCHEMY_ENGINE_OPTIONS={'connect_args': {'timeout': 30}})
+        seed_database(users=args.users, cars=args.cars, reservations=args.reservations, seed=args.seed)
+        admin = Admin(email=args.admin_email, type='admin', perms='full')
+        admin.set_password(args.admin_password)
+        db.session.add(admin)
+        db.session.commit()
+        accounts = [(email, DEFAULT_PASSWORD) for (email,) in
+                    db.session.query(User.email).filter(User.type == 'client').limit(args.workers)]
+        admin_account = (args.admin_email, args.admin_password)
+        if args.in_process:
+            target = AppTarget(app)
+        else:
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)
+            server = make_server('127.0.0.1', 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            target = HttpTarget(f'http://127.0.0.1:{server.server_port}')
+
+    status, cars = target.request('GET', '/api/cars/')
+    car_ids = [car['id'] for car in cars] if status == 200 and cars else [1]
+    hot_cars = car_ids[:args.hot_cars]
+
+    started = time.perf_counter()
+    if args.processes > 1:
+        samples, bookings = defaultdict(list), []
+        with ProcessPoolExecutor(max_workers=args.processes) as pool:
+            futures = [pool.submit(run_workers, target.base_url, accounts, admin_account, car_ids, hot_cars,
+                                   mix, args.workers, duration, args.requests, args.seed + i)
+                       for i in range(args.processes)]
+            for future in futures:
+                part_samples, part_bookings = future.result()
+                for operation, values in part_samples.items():
+                    samples[operation].extend(values)
+                bookings.extend(part_bookings)
+    else:
+        samples, bookings = run_workers(target, accounts, admin_account, car_ids, hot_cars, mix,
+                                        args.workers, duration, args.requests, args.seed)
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.processes} process(es) x {args.workers} workers, {elapsed:.1f}s, mix {args.mix}")
+    report(samples, elapsed)
+
+    violations = overlapping_bookings(bookings)
+    print(f"Accepted bookings: {len(bookings)}, overlapping on the same car: {len(violations)}")
+    if db_path:
+        double_booked = database_double_bookings()
+        print(f"Overlapping reservation pairs in the database: {len(double_booked)}")
+        violations += double_booked
+        if server is not None:
+            server.shutdown()
+        os.remove(db_path)
+    if violations:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
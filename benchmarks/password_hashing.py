@@ -0,0 +1,64 @@
+"""Login latency and throughput for several password hashing schemes.
+
+    python -m benchmarks.password_hashing --logins 40 --threads 8
+    python -m benchmarks.password_hashing --workers 4  # bounded hashing pool
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.models import db
+from app.models.user import Client
+from benchmarks.common import create_bench_app, timed
+
+SCHEMES = [
+    'pbkdf2:sha256:600000',
+    'pbkdf2:sha256:260000',
+    'pbkdf2:sha256:100000',
+    'scrypt:32768:8:1',
+    'scrypt:16384:8:1',
+]
+PASSWORD = 'bench123'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--logins', type=int, default=40)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=0, help="PASSWORD_HASH_WORKERS")
+    parser.add_argument('--schemes', nargs='*', default=SCHEMES)
+    args = parser.parse_args()
+
+    app, db_path = create_bench_app(PASSWORD_HASH_WORKERS=args.workers)
+    client = app.test_client()
+
+    print(f"{'scheme':<24}{'login p50':>12}{'logins/s':>12}  ({args.threads} threads)")
+    for i, scheme in enumerate(args.schemes):
+        app.config['PASSWORD_HASH_METHOD'] = scheme
+        email = f'bench{i}@example.com'
+        user = Client(email=email, type='client', driving_license='BENCH')
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+
+        def login():
+            response = client.post('/api/auth/login', json={'email': email, 'password': PASSWORD})
+            assert response.status_code == 200, response.data
+
+        latency, _ = timed(login, max(3, args.logins // 10))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            for future in [pool.submit(login) for _ in range(args.logins)]:
+                future.result()
+        throughput = args.logins / (time.perf_counter() - start)
+        print(f"{scheme:<24}{latency * 1000:>9.1f} ms{throughput:>12.1f}")
+
+    executor = app.extensions.get('password_hasher')
+    if executor is not None:
+        executor.shutdown()
+    os.remove(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,32 @@ class Config:
     # Database configuration
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(os.path.abspath(os.path.dirname(__file__)), 'rental.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Bookings serialize on their car's lock; SQLite waits this many seconds
+    # for its write lock before a booking is retried (BOOKING_RETRIES times)
+    SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 15}} if SQLALCHEMY_DATABASE_URI.startswith('sqlite') else {}
+    BOOKING_RETRIES = int(os.environ.get('BOOKING_RETRIES', 3))
+    # Items per page of the admin listings when the client gives no ?limit=
+    ADMIN_PAGE_SIZE = int(os.environ.get('ADMIN_PAGE_SIZE', 100))
+    # Rows the admin stats totals are spread over, so that concurrent writes
+    # rarely update the same one (takes effect at the next rebuild-stats)
+    STATS_SHARDS = int(os.environ.get('STATS_SHARDS', 16))
+    # Payment worker threads started per process once a payment is queued
+    # (0 leaves the queue to `flask payments-worker`) and the latency of the
+    # fake processor used when no PAYMENT_PROCESSOR is configured
+    PAYMENT_WORKER_THREADS = int(os.environ.get('PAYMENT_WORKER_THREADS', 2))
+    PAYMENT_FAKE_LATENCY = float(os.environ.get('PAYMENT_FAKE_LATENCY', 0))
+    # Seconds an Idempotency-Key and its stored response are kept
+    IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600))
+
+    # Flask-Caching backend. SimpleCache is per process; give several worker
+    # processes a shared one (e.g. CACHE_TYPE=RedisCache, CACHE_REDIS_URL)
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'SimpleCache')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+
+    # In-memory reservation interval index (disable when several processes write)
+    AVAILABILITY_INDEX = os.environ.get('AVAILABILITY_INDEX', 'true').lower() == 'true'
+    # In-memory trigram index for make/model search (same caveat)
+    CAR_SEARCH_INDEX = os.environ.get('CAR_SEARCH_INDEX', 'true').lower() == 'true'
 
     # JWT Configuration - Dual Mode (Headers for API, Cookies for Frontend)
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'super-secret-key'
@@ -37,6 +63,16 @@ class Config:
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
     JWT_IDENTITY_CLAIM = 'identity'
+    # Seconds an admin's role claim is trusted before it is checked again
+    ADMIN_ROLE_CACHE_TTL = int(os.environ.get('ADMIN_ROLE_CACHE_TTL', 60))
+    # Seconds a logged-in user loaded by Flask-Login stays cached
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))
+
+    # Password hashing: werkzeug method string (stored hashes using other
+    # parameters are replaced at the next login) and the size of the thread
+    # pool that runs hashing, 0 to hash on the request thread
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0))
     
     # CSRF Protection (for forms)
     CSRF_ENABLED = True
@@ -58,6 +94,12 @@ class Config:
     STATIC_FOLDER = str(PROJECT_ROOT / 'static')
     API_BASE_URL = 'http://localhost:5000/api'
     SQLALCHEMY_RECORD_QUERIES = True
+    # X-Query-Count / X-DB-Time response headers and the slow query log
+    # threshold in seconds (both need SQLALCHEMY_RECORD_QUERIES)
+    QUERY_STATS_HEADERS = os.environ.get('QUERY_STATS_HEADERS', 'false').lower() == 'true'
+    SLOW_QUERY_THRESHOLD = float(os.environ.get('SLOW_QUERY_THRESHOLD', 0.5))
+    # Directory shared by the worker processes whose /metrics are aggregated
+    METRICS_DIR = os.environ.get('METRICS_DIR')
     FLASK_DEBUG_TB_INTERCEPT_REDIRECTS = False
     SEND_FILE_MAX_AGE_DEFAULT = 0  # Disable caching for development
 
@@ -1,9 +1,14 @@
 from pathlib import Path
+import click
+import time
 from app import create_app
 from app.models import User, Car, Insurance, db
 from datetime import date, timedelta
 from werkzeug.security import generate_password_hash
 from app.models.user import Admin, Client
+from app.utils.payment_queue import payment_queue
+from app.utils.seed import DEFAULT_PASSWORD, seed_database
+from app.utils.stats import rollups
 
 app = create_app()
 
@@ -95,5 +100,55 @@ def init_db():
         else:
             print("Database already initialized")
 
+@app.cli.command("rebuild-stats")
+@click.option('--verify', is_flag=True, help="Only compare the rollups with a full recompute")
+def rebuild_stats(verify):
+    """Rebuild the admin statistics rollups from the source tables"""
+    with app.app_context():
+        if verify:
+            diffs = rollups.verify()
+            for name, actual, expected in diffs:
+                print(f"{name}: rollup={actual} recomputed={expected}")
+            if diffs:
+                raise SystemExit(1)
+            print("Rollups match a full recompute.")
+        else:
+            totals = rollups.rebuild()
+            print(f"Rollups rebuilt ({totals['reservations_count']} reservations).")
+
+@app.cli.command("seed")
+@click.option('--users', default=1000, show_default=True)
+@click.option('--cars', default=500, show_default=True)
+@click.option('--reservations', default=20000, show_default=True)
+@click.option('--favorites-per-user', default=3, show_default=True)
+@click.option('--seed', 'seed_value', default=42, show_default=True, help="Random seed")
+@click.option('--chunk-size', default=10000, show_default=True, help="Rows per executemany()")
+def seed(users, cars, reservations, favorites_per_user, seed_value, chunk_size):
+    """Bulk insert synthetic users, cars and reservations for load testing"""
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        counts = seed_database(
+            users=users, cars=cars, reservations=reservations,
+            favorites_per_user=favorites_per_user, seed=seed_value, chunk_size=chunk_size
+        )
+        for table, count in counts.items():
+            print(f"{table}: {count}")
+        print(f"Seeded in {time.perf_counter() - started:.1f}s (password: {DEFAULT_PASSWORD})")
+
+@app.cli.command("payments-worker")
+@click.option('--once', is_flag=True, help="Settle the payments that are due and exit")
+def payments_worker(once):
+    """Settle queued payments until interrupted"""
+    with app.app_context():
+        if once:
+            print(f"Settled {payment_queue.run_pending()} payment jobs.")
+            return
+    print("Settling queued payments, Ctrl+C to stop.")
+    try:
+        payment_queue.work(app)
+    except KeyboardInterrupt:
+        pass
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
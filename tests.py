@@ -1,8 +1,10 @@
+import contextlib
 import unittest
 import requests
 from datetime import datetime, timedelta
 import json
 import os
+import tempfile
 
 BASE_URL = "http://localhost:5000/api"
 ADMIN_EMAIL = "admin@rental.com"
@@ -275,13 +277,13 @@ class TestCarRentalAPI(unittest.TestCase):
         headers = {"Authorization": f"Bearer {self.admin_token}"}
         response = requests.get(f"{BASE_URL}/admin/users", headers=headers)
         self.assertEqual(response.status_code, 200)
-        self.assertGreater(len(response.json()), 0)
+        self.assertGreater(len(response.json()["items"]), 0)
     
     def test_11_get_all_reservations(self):
         headers = {"Authorization": f"Bearer {self.admin_token}"}
         response = requests.get(f"{BASE_URL}/admin/reservations", headers=headers)
         self.assertEqual(response.status_code, 200)
-        self.assertGreater(len(response.json()), 0)
+        self.assertGreater(len(response.json()["items"]), 0)
     
     def test_12_add_insurance(self):
         headers = {"Authorization": f"Bearer {self.admin_token}"}
@@ -312,13 +314,13 @@ class TestCarRentalAPI(unittest.TestCase):
         headers = {"Authorization": f"Bearer {self.admin_token}"}
         response = requests.get(f"{BASE_URL}/admin/damage-reports", headers=headers)
         self.assertEqual(response.status_code, 200)
-        self.assertGreater(len(response.json()), 0)
+        self.assertGreater(len(response.json()["items"]), 0)
     
     def test_14_update_damage_report(self):
         # First get a damage report ID
         headers = {"Authorization": f"Bearer {self.admin_token}"}
         response = requests.get(f"{BASE_URL}/admin/damage-reports", headers=headers)
-        report_id = response.json()[0]["id"]
+        report_id = response.json()["items"][0]["id"]
         
         # Update the report
         data = {
@@ -400,7 +402,18 @@ class TestCarRentalAPI(unittest.TestCase):
             json=payment_data,
             headers=headers
         )
-        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json().get("status"), "pending")
+
+        # The worker settles it in the background
+        response = requests.get(
+            f"{BASE_URL}/payments/{response.json()['payment_id']}",
+            params={"wait": 10},
+            headers=headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json().get("status"), "completed")
+        self.assertEqual(response.json().get("reservation_status"), "confirmed")
         
         # Clean up
         requests.delete(
@@ -648,6 +661,1371 @@ class TestCarRentalAPI(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn('text/csv', response.headers['Content-Type'])
         self.assertIn('ID,User Email,Car Make', response.text)
-        
+
+    def test_25_availability_search(self):
+        headers = {"Authorization": f"Bearer {self.admin_token}"}
+        response = requests.post(f"{BASE_URL}/admin/cars", json={
+            "make": "AvailabilityTest",
+            "model": "DateRange",
+            "year": 2023,
+            "price_per_day": 45.00,
+            "vehicle_type": "sedan",
+            "location": "city"
+        }, headers=headers)
+        car_id = response.json().get("car_id")
+
+        start = datetime.now() + timedelta(days=200)
+        response = requests.post(f"{BASE_URL}/cars/reserve", json={
+            "car_id": car_id,
+            "start_date": start.strftime('%Y-%m-%d'),
+            "end_date": (start + timedelta(days=3)).strftime('%Y-%m-%d')
+        }, headers={"Authorization": f"Bearer {self.client_token}"})
+        self.assertEqual(response.status_code, 201)
+
+        overlapping = {
+            "start_date": (start + timedelta(days=1)).strftime('%Y-%m-%d'),
+            "end_date": (start + timedelta(days=5)).strftime('%Y-%m-%d')
+        }
+        free = {
+            "start_date": (start + timedelta(days=10)).strftime('%Y-%m-%d'),
+            "end_date": (start + timedelta(days=12)).strftime('%Y-%m-%d')
+        }
+        for endpoint in ("cars/", "cars/search"):
+            response = requests.get(f"{BASE_URL}/{endpoint}", params=overlapping)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any(car['id'] == car_id for car in response.json()))
+
+            response = requests.get(f"{BASE_URL}/{endpoint}", params=free)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(any(car['id'] == car_id for car in response.json()))
+
+        response = requests.get(f"{BASE_URL}/cars/search", params={"start_date": free["start_date"]})
+        self.assertEqual(response.status_code, 400)
+
+
+class InProcessTestCase(unittest.TestCase):
+    """Runs the app in-process with the Flask test client on a temporary database"""
+
+    def setUp(self):
+        from app import create_app, db
+        from config import Config
+
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+
+        class TestConfig(Config):
+            TESTING = True
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + self.db_path
+            WTF_CSRF_ENABLED = False
+            JWT_COOKIE_CSRF_PROTECT = False
+            PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+            # Tests settle payments with payment_queue.run_pending()
+            PAYMENT_WORKER_THREADS = 0
+            PAYMENT_RETRY_DELAY = 0
+
+        self.config_class = TestConfig
+        self.app = create_app(TestConfig)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self.db = db
+        db.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        from app.utils.payment_queue import payment_queue
+        payment_queue.stop(self.app)
+        self.db.session.remove()
+        self.db.get_engine(self.app).dispose()
+        self.ctx.pop()
+        os.remove(self.db_path)
+
+    def create_user(self, email='client@example.com', password='client123', admin=False):
+        from app.models.user import Admin, Client
+        if admin:
+            user = Admin(email=email, type='admin', perms='full')
+        else:
+            user = Client(email=email, type='client', driving_license='TEST1234')
+        user.set_password(password)
+        self.db.session.add(user)
+        self.db.session.commit()
+        return user
+
+    @contextlib.contextmanager
+    def count_queries(self):
+        """Collect the SQL statements executed inside the block"""
+        from sqlalchemy import event
+        statements = []
+        engine = self.db.get_engine(self.app)
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+
+    def auth_headers(self, email='client@example.com', password='client123'):
+        response = self.client.post('/api/auth/login', json={'email': email, 'password': password})
+        return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+    def create_reservation(self, user, car, start_offset=1, days=2, status='pending'):
+        from app.models import Reservation
+        start = datetime.now().date() + timedelta(days=start_offset)
+        reservation = Reservation(
+            user_id=user.id, car_id=car.id, start_date=start,
+            end_date=start + timedelta(days=days),
+            total_price=days * car.price_per_day, status=status
+        )
+        self.db.session.add(reservation)
+        self.db.session.commit()
+        return reservation
+
+    def create_car(self, **kwargs):
+        from app.models import Car
+        data = dict(make='Toyota', model='Camry', year=2022, price_per_day=50,
+                    vehicle_type='sedan', location='city')
+        data.update(kwargs)
+        car = Car(**data)
+        self.db.session.add(car)
+        self.db.session.commit()
+        return car
+
+
+class TestAvailabilityIndex(InProcessTestCase):
+    def assert_matches_sql(self, car_ids, windows):
+        from app.models import Reservation
+        from app.utils.availability import availability
+        self.assertEqual(availability.verify(), [])
+        for car_id in car_ids:
+            for start, end in windows:
+                expected = sorted(
+                    r.id for r in Reservation.overlapping(car_id, start, end)
+                )
+                actual = sorted(r[0] for r in availability.conflicts(car_id, start, end))
+                self.assertEqual(actual, expected, (car_id, start, end))
+
+    def test_index_follows_session_events(self):
+        from app.models import Reservation
+        user = self.create_user()
+        cars = [self.create_car(), self.create_car(make='Ford', model='Focus')]
+        today = datetime.now().date()
+        windows = [
+            (today + timedelta(days=d), today + timedelta(days=d + span))
+            for d in range(0, 40, 3) for span in (0, 1, 5)
+        ]
+
+        reservations = []
+        for i, offset in enumerate([0, 4, 10, 25]):
+            r = Reservation(
+                user_id=user.id, car_id=cars[i % 2].id,
+                start_date=today + timedelta(days=offset),
+                end_date=today + timedelta(days=offset + 2 + i),
+                total_price=100, status='pending'
+            )
+            self.db.session.add(r)
+            reservations.append(r)
+        self.db.session.commit()
+        self.assert_matches_sql([c.id for c in cars], windows)
+
+        # Cancelling frees the slot, restoring it books it again
+        reservations[0].status = 'cancelled'
+        self.db.session.commit()
+        self.assertTrue(cars[0].is_available(today, today + timedelta(days=1)))
+        self.assert_matches_sql([c.id for c in cars], windows)
+        reservations[0].status = 'confirmed'
+        self.db.session.commit()
+        self.assertFalse(cars[0].is_available(today, today + timedelta(days=1)))
+
+        # Moving and deleting reservations
+        reservations[1].start_date = today + timedelta(days=30)
+        reservations[1].end_date = today + timedelta(days=38)
+        self.db.session.delete(reservations[2])
+        self.db.session.commit()
+        self.assert_matches_sql([c.id for c in cars], windows)
+
+        # Rolled back changes never reach the index
+        reservations[3].status = 'cancelled'
+        self.db.session.flush()
+        self.db.session.rollback()
+        self.assert_matches_sql([c.id for c in cars], windows)
+
+    def test_conflicts_are_confirmed_with_the_database(self):
+        from app.models import Reservation
+        from app.services.reservations import reserve
+        from app.utils.availability import availability
+        user, car = self.create_user(), self.create_car()
+        existing = self.create_reservation(user, car)
+        start, end, user_id, car_id = existing.start_date, existing.end_date, user.id, car.id
+        self.assertEqual(len(availability.conflicts(car_id, start, end)), 1)
+
+        # Cancelled by another process, unseen by this one's session events
+        table = Reservation.__table__
+        with self.db.engine.begin() as conn:
+            conn.execute(table.update().where(table.c.id == existing.id).values(status='cancelled'))
+        self.assertEqual(availability.conflicts(car_id, start, end), [])
+        self.assertEqual(availability.verify(), [])
+        booked = reserve(user_id, car_id, start, end)
+        self.assertEqual(booked.status, 'pending')
+
+
+class TestAvailableBetween(InProcessTestCase):
+    def available(self, start_offset, end_offset):
+        from app.models import Car
+        today = datetime.now().date()
+        return sorted(car.make for car in Car.query.filter(Car.available_between(
+            today + timedelta(days=start_offset), today + timedelta(days=end_offset)
+        )))
+
+    def test_not_exists_filter(self):
+        user = self.create_user()
+        booked = self.create_car(make='Booked')
+        cancelled = self.create_car(make='Cancelled')
+        self.create_car(make='Free')
+        # Days 10 to 12, both included
+        self.create_reservation(user, booked, start_offset=10, days=2)
+        self.create_reservation(user, cancelled, start_offset=10, days=2, status='cancelled')
+
+        everything = ['Booked', 'Cancelled', 'Free']
+        self.assertEqual(self.available(11, 15), ['Cancelled', 'Free'])  # overlapping
+        self.assertEqual(self.available(5, 20), ['Cancelled', 'Free'])   # containing
+        self.assertEqual(self.available(12, 14), ['Cancelled', 'Free'])  # sharing the end date
+        self.assertEqual(self.available(8, 10), ['Cancelled', 'Free'])   # sharing the start date
+        self.assertEqual(self.available(13, 15), everything)             # adjacent after
+        self.assertEqual(self.available(7, 9), everything)               # adjacent before
+
+        today = datetime.now().date()
+        response = self.client.get('/api/cars/', query_string={
+            'start_date': (today + timedelta(days=11)).isoformat(),
+            'end_date': (today + timedelta(days=15)).isoformat()
+        })
+        self.assertEqual(sorted(c['make'] for c in response.get_json()), ['Cancelled', 'Free'])
+
+class TestReservationExport(InProcessTestCase):
+    def test_export_streams_quoted_csv_with_filters(self):
+        import csv
+        import io
+        self.create_user('admin@rental.com', 'admin123', admin=True)
+        client = self.create_user('o\'brien,"jr"@example.com')
+        car = self.create_car(make='Mercedes, "AMG"', model='C63')
+        self.create_reservation(client, car, start_offset=1, status='confirmed')
+        self.create_reservation(client, car, start_offset=10, status='cancelled')
+        headers = self.auth_headers('admin@rental.com', 'admin123')
+
+        response = self.client.get('/api/admin/reservations/export', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertIn('text/csv', response.headers['Content-Type'])
+        rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual(rows[0][:3], ['ID', 'User Email', 'Car Make'])
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][1], 'o\'brien,"jr"@example.com')
+        self.assertEqual(rows[1][2], 'Mercedes, "AMG"')
+
+        response = self.client.get('/api/admin/reservations/export?status=cancelled', headers=headers)
+        rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual([row[7] for row in rows[1:]], ['cancelled'])
+
+        end = (datetime.now().date() + timedelta(days=5)).isoformat()
+        response = self.client.get(f'/api/admin/reservations/export?end_date={end}', headers=headers)
+        rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual([row[7] for row in rows[1:]], ['confirmed'])
+
+        response = self.client.get('/api/admin/reservations/export?status=bogus', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+class TestAdminPagination(InProcessTestCase):
+    def walk(self, url, headers, limit):
+        items, cursor = [], None
+        while True:
+            query = f'{url}?limit={limit}' + (f'&cursor={cursor}' if cursor else '')
+            response = self.client.get(query, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            page = response.get_json()
+            self.assertLessEqual(len(page['items']), limit)
+            items.extend(page['items'])
+            cursor = page['next_cursor']
+            if not cursor:
+                return items
+
+    def test_keyset_pages_cover_listing_in_order(self):
+        from app.models import DamageReport
+        self.create_user('admin@rental.com', 'admin123', admin=True)
+        client = self.create_user()
+        car = self.create_car()
+        # Several reservations share a start date so the id tiebreaker matters
+        for i in range(11):
+            reservation = self.create_reservation(client, car, start_offset=i // 3)
+            self.db.session.add(DamageReport(
+                description='Scratch', repair_cost=10 + i,
+                reservation_id=reservation.id
+            ))
+        self.db.session.commit()
+        headers = self.auth_headers('admin@rental.com', 'admin123')
+
+        for url in ('/api/admin/reservations', '/api/admin/damage-reports', '/api/admin/users'):
+            first = self.client.get(url, headers=headers).get_json()
+            self.assertIsNone(first['next_cursor'])
+            self.assertEqual(self.walk(url, headers, 4), first['items'])
+
+        # Without a limit the default page size applies
+        self.app.config['ADMIN_PAGE_SIZE'] = 5
+        page = self.client.get('/api/admin/reservations', headers=headers).get_json()
+        self.assertEqual(len(page['items']), 5)
+        self.assertIsNotNone(page['next_cursor'])
+
+        self.assertEqual(
+            self.client.get('/api/admin/users?cursor=garbage', headers=headers).status_code, 400
+        )
+        self.assertEqual(
+            self.client.get('/api/admin/users?limit=0', headers=headers).status_code, 400
+        )
+
+class TestUserListing(InProcessTestCase):
+    def test_users_listed_in_one_query(self):
+        self.create_user('admin@rental.com', 'admin123', admin=True)
+        for i in range(3):
+            self.create_user(f'client{i}@example.com')
+        headers = self.auth_headers('admin@rental.com', 'admin123')
+        self.client.get('/api/admin/cache-stats', headers=headers)
+        self.db.session.expunge_all()
+
+        with self.count_queries() as queries:
+            response = self.client.get('/api/admin/users', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        users = response.get_json()['items']
+        self.assertEqual(len(users), 4)
+        self.assertEqual(users[0]['perms'], 'full')
+        self.assertIsNone(users[0]['driving_license'])
+        self.assertEqual({u['driving_license'] for u in users[1:]}, {'TEST1234'})
+
+class TestStatsRollups(InProcessTestCase):
+    def test_rollups_follow_writes(self):
+        from app.models import DamageReport, Payment
+        from app.utils.stats import rollups
+        self.create_user('admin@rental.com', 'admin123', admin=True)
+        client = self.create_user()
+        headers = self.auth_headers('admin@rental.com', 'admin123')
+        cars = [self.create_car(model=f'Model{i}') for i in range(4)]
+
+        # Data written before the first read is picked up by the initial build
+        self.create_reservation(client, cars[0])
+        stats = self.client.get('/api/admin/stats', headers=headers).get_json()
+        self.assertEqual(stats['reservations_count'], 1)
+
+        reservations = [
+            self.create_reservation(client, cars[i % 3], start_offset=5 * i)
+            for i in range(7)
+        ]
+        payment = Payment(amount=120.5, status='completed', method='credit_card',
+                          reservation_id=reservations[0].id)
+        damage = DamageReport(description='Dent', repair_cost=80,
+                              reservation_id=reservations[1].id)
+        self.db.session.add_all([payment, damage])
+        self.db.session.commit()
+
+        payment.amount = 99.25
+        reservations[2].car_id = cars[3].id
+        self.db.session.delete(reservations[3])
+        self.db.session.commit()
+        self.db.session.delete(damage)
+        self.db.session.commit()
+        self.assertEqual(rollups.verify(), [])
+
+        stats = self.client.get('/api/admin/stats?verify=true', headers=headers).get_json()
+        self.assertEqual(stats['verification'], [])
+        self.assertEqual(stats['reservations_count'], 7)
+        self.assertAlmostEqual(stats['revenue'], 99.25)
+        self.assertEqual(stats['damage_costs'], 0)
+        self.assertEqual(stats['popular_cars'][0]['car_id'], cars[0].id)
+        self.assertEqual(stats['popular_cars'][0]['reservation_count'], 3)
+
+        # Writes bypassing the ORM show up as drift until the next rebuild
+        self.db.session.execute(Payment.__table__.update().values(amount=1))
+        self.db.session.commit()
+        self.assertEqual([name for name, _, _ in rollups.verify()], ['revenue'])
+        rollups.rebuild()
+        self.assertEqual(rollups.verify(), [])
+
+    def test_totals_are_spread_over_slots(self):
+        import itertools
+        from unittest import mock
+        from app.models import StatsRollup
+        from app.utils.stats import _slot, rollups
+        self.app.config['STATS_SHARDS'] = 4
+        client = self.create_user()
+        car = self.create_car()
+        rollups.rebuild()
+        self.assertEqual(StatsRollup.query.count(), 4)
+        self.assertEqual(_slot(4), _slot(4))
+        self.assertIn(_slot(4), range(1, 5))
+
+        slots = itertools.cycle([1, 2, 3, 4])
+        with mock.patch('app.utils.stats._slot', side_effect=lambda shards: next(slots)):
+            for i in range(8):
+                self.create_reservation(client, car, start_offset=5 * i)
+            # Slots added by raising STATS_SHARDS before a rebuild fall back to the first
+            self.app.config['STATS_SHARDS'] = 8
+            slots = iter([6])
+            self.create_reservation(client, car, start_offset=100)
+        self.assertEqual(
+            [r.reservations_count for r in StatsRollup.query.order_by(StatsRollup.id)], [3, 2, 2, 2]
+        )
+        self.assertEqual(rollups.read()['reservations_count'], 9)
+        self.assertEqual(rollups.verify(), [])
+
+class TestFavoriteAnnotations(InProcessTestCase):
+    def test_recommendations_load_favorites_once(self):
+        from app.models import Car
+        user = self.create_user()
+        cars = [self.create_car(model=f'Model{i}') for i in range(10)]
+        headers = self.auth_headers()
+        response = self.client.post(f'/api/favorites/cars/{cars[3].id}/favorite', headers=headers)
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get('/api/cars/recommended?terrain=city', headers=headers)
+        favorited = {car['id'] for car in response.get_json() if car['is_favorited']}
+        self.assertEqual(favorited, {cars[3].id})
+        response = self.client.get('/api/cars/recommended?terrain=city')
+        self.assertTrue(all('is_favorited' not in car for car in response.get_json()))
+
+        # Adding a favorite invalidates the cached set
+        self.client.post(f'/api/favorites/cars/{cars[5].id}/favorite', headers=headers)
+        serialized, loaded, user_id = [car.to_dict() for car in Car.query.all()], Car.query.first(), user.id
+        with self.count_queries() as statements:
+            data = Car.annotate_favorites(serialized, user_id)
+            Car.annotate_favorites(serialized, user_id)
+            loaded.to_dict(user_id)
+        self.assertEqual({car['id'] for car in data if car['is_favorited']}, {cars[3].id, cars[5].id})
+        # One reload under the new version, then every listing is served from the cache
+        self.assertEqual(len([s for s in statements if 'data_versions' not in s]), 1)
+
+    def test_favorites_added_by_another_process_are_seen(self):
+        from app import create_app
+        self.create_user()
+        car_ids = [self.create_car(model=f'Model{i}').id for i in range(3)]
+        headers = self.auth_headers()
+        # Same database, its own SimpleCache
+        other = create_app(self.config_class)
+        client = other.test_client()
+
+        def favorited():
+            response = client.get('/api/cars/recommended?terrain=city', headers=headers)
+            return {car['id'] for car in response.get_json() if car['is_favorited']}
+
+        self.assertEqual(favorited(), set())
+        self.client.post(f'/api/favorites/cars/{car_ids[1]}/favorite', headers=headers)
+        self.assertEqual(favorited(), {car_ids[1]})
+        self.db.get_engine(other).dispose()
+
+class TestFrontendServices(InProcessTestCase):
+    def test_frontend_flows_run_without_loopback_http(self):
+        from app.models import Reservation
+        car = self.create_car()
+        start = datetime.now().date() + timedelta(days=3)
+
+        response = self.client.post('/register', data={
+            'email': 'frontend@example.com', 'password': 'secret123', 'driving_license': 'DL-1'
+        })
+        self.assertEqual(response.status_code, 302)
+        response = self.client.post('/login', data={'email': 'frontend@example.com', 'password': 'wrong'})
+        self.assertIn(b'Invalid credentials', response.data)
+        response = self.client.post('/login', data={'email': 'frontend@example.com', 'password': 'secret123'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.headers['Location'].endswith('/dashboard/'))
+
+        response = self.client.post(f'/cars/{car.id}/reserve', data={
+            'start_date': start.isoformat(), 'end_date': (start + timedelta(days=2)).isoformat()
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Reservation.query.filter_by(car_id=car.id).count(), 1)
+        response = self.client.post(f'/cars/{car.id}/reserve', data={
+            'start_date': start.isoformat(), 'end_date': (start + timedelta(days=2)).isoformat()
+        })
+        self.assertIn(b'Car not available', response.data)
+
+        self.assertEqual(self.client.get('/dashboard/').status_code, 200)
+
+class TestUserLoader(InProcessTestCase):
+    def test_user_loader_caches_polymorphic_user(self):
+        from flask import g
+        from app.utils.user_cache import user_cache
+        user_id = self.create_user().id
+        self.db.session.expunge_all()
+
+        with self.count_queries() as queries:
+            user = user_cache.load(user_id)
+            self.assertEqual(user.driving_license, 'TEST1234')
+            self.assertIs(user_cache.load(user_id), user)
+        self.assertEqual(len(queries), 1)
+
+        # A later request is served from the process cache
+        g.pop('_loaded_users')
+        self.db.session.expunge_all()
+        with self.count_queries() as queries:
+            user = user_cache.load(user_id)
+            self.assertEqual(user.email, 'client@example.com')
+            self.assertEqual(user.driving_license, 'TEST1234')
+        self.assertEqual(queries, [])
+
+        user.set_password('changed123')
+        self.db.session.commit()
+        with self.count_queries() as queries:
+            self.assertTrue(user_cache.load(user_id).check_password('changed123'))
+        self.assertEqual(len(queries), 1)
+
+class TestPasswordRehash(InProcessTestCase):
+    def test_login_rehashes_outdated_password_hash(self):
+        from werkzeug.security import generate_password_hash
+        user = self.create_user()
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1000$'))
+        user.password_hash = generate_password_hash('client123', 'scrypt:16384:8:1')
+        self.db.session.commit()
+
+        response = self.client.post('/api/auth/login', json={'email': 'client@example.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(user.password_hash.startswith('scrypt:16384:8:1$'))
+
+        response = self.client.post('/api/auth/login', json={'email': 'client@example.com', 'password': 'client123'})
+        self.assertEqual(response.status_code, 200)
+        self.db.session.refresh(user)
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(user.check_password('client123'))
+
+    def test_hashing_in_bounded_pool(self):
+        from app.utils.passwords import normalize_method, passwords
+        self.app.config['PASSWORD_HASH_WORKERS'] = 2
+        passwords.init_app(self.app)
+        self.addCleanup(self.app.extensions['password_hasher'].shutdown)
+        pwhash = passwords.hash('secret')
+        self.assertTrue(passwords.verify(pwhash, 'secret'))
+        self.assertFalse(passwords.verify(pwhash, 'other'))
+        self.assertFalse(passwords.needs_rehash(pwhash))
+        self.assertEqual(normalize_method('scrypt'), 'scrypt:32768:8:1')
+        self.assertEqual(normalize_method('pbkdf2:sha1'), 'pbkdf2:sha1:600000')
+
+class TestCatalogCache(InProcessTestCase):
+    def test_catalog_served_from_cache_until_admin_writes(self):
+        self.create_user('admin@rental.com', 'admin123', admin=True)
+        client = self.create_user()
+        car = self.create_car()
+        admin_headers = self.auth_headers('admin@rental.com', 'admin123')
+        before = self.client.get('/api/admin/cache-stats', headers=admin_headers).get_json()
+
+        self.assertEqual(len(self.client.get('/api/cars/').get_json()), 1)
+        with self.count_queries() as statements:
+            self.assertEqual(len(self.client.get('/api/cars/').get_json()), 1)
+            self.client.get('/api/cars/search?type=sedan&location=city')
+            self.client.get('/api/cars/search?location=city&type=sedan')
+        # One catalog version lookup per request, one query for the miss
+        self.assertEqual(len([s for s in statements if 'data_versions' in s]), 3)
+        self.assertEqual(len([s for s in statements if 'data_versions' not in s]), 1)
+        stats = self.client.get('/api/admin/cache-stats', headers=admin_headers).get_json()
+        self.assertEqual(stats['hits'] - before['hits'], 2)
+        self.assertEqual(stats['misses'] - before['misses'], 2)
+
+        response = self.client.post('/api/admin/cars', headers=admin_headers, json={
+            'make': 'Ford', 'model': 'Focus', 'year': 2022, 'price_per_day': 40,
+            'vehicle_type': 'sedan', 'location': 'city'
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.client.get('/api/cars/').get_json()), 2)
+
+        response = self.client.post(f'/api/admin/cars/{car.id}/insurance', headers=admin_headers, json={
+            'provider': 'AXA', 'type': 'basic', 'coverage_amount': 1000,
+            'expiry_date': (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
+        })
+        self.assertEqual(response.status_code, 201)
+        details = self.client.get(f'/api/cars/{car.id}').get_json()
+        self.assertEqual(details['insurance'][0]['provider'], 'AXA')
+
+        # A damage report moves the car to maintenance and out of the listing
+        reservation = self.create_reservation(client, car)
+        response = self.client.post(f'/api/cars/reservations/{reservation.id}/damage',
+                                    headers=self.auth_headers(), json={'description': 'Dent', 'repair_cost': 50})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([c['make'] for c in self.client.get('/api/cars/').get_json()], ['Ford'])
+        self.assertEqual(self.client.get(f'/api/cars/{car.id}').get_json()['status'], 'maintenance')
+        self.assertEqual(self.client.get('/api/cars/999').status_code, 404)
+
+    def test_writes_of_another_process_invalidate_the_catalog(self):
+        from app import create_app
+        from app.models import Car
+        car_id = self.create_car().id
+        # Same database, its own SimpleCache
+        other = create_app(self.config_class)
+        client = other.test_client()
+        response = client.get(f'/api/cars/{car_id}')
+        etag = response.headers['ETag']
+        self.assertEqual(response.get_json()['price_per_day'], 50)
+
+        self.db.session.get(Car, car_id).price_per_day = 99
+        self.db.session.commit()
+        response = client.get(f'/api/cars/{car_id}', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['price_per_day'], 99)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.db.get_engine(other).dispose()
+
+class TestConditionalGet(InProcessTestCase):
+    def test_etags_answer_304_until_data_changes(self):
+        from app.models import Payment
+        user = self.create_user()
+        car = self.create_car()
+        headers = self.auth_headers()
+
+        for url, auth in (('/api/cars/', {}), (f'/api/cars/{car.id}', {}),
+                          ('/api/payments/reservations', headers)):
+            response = self.client.get(url, headers=auth)
+            etag = response.headers['ETag']
+            with self.count_queries() as statements:
+                response = self.client.get(url, headers={**auth, 'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.data, b'')
+            # Only the version lookup runs
+            self.assertEqual(len(statements), 1, url)
+            self.assertIn('data_versions', statements[0], url)
+
+        # A new reservation and then its payment change the user's listing
+        etag = self.client.get('/api/payments/reservations', headers=headers).headers['ETag']
+        reservation = self.create_reservation(user, car)
+        response = self.client.get('/api/payments/reservations',
+                                   headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.db.session.add(Payment(amount=100, status='completed', method='credit_card',
+                                    reservation_id=reservation.id))
+        self.db.session.commit()
+        response = self.client.get('/api/payments/reservations',
+                                   headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()[0]['payment']['amount'], 100)
+
+        # Catalog writes change the car ETags
+        etag = self.client.get(f'/api/cars/{car.id}').headers['ETag']
+        car.price_per_day = 60
+        self.db.session.commit()
+        response = self.client.get(f'/api/cars/{car.id}', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['price_per_day'], 60)
+
+    def test_user_etags_follow_writes_of_another_process(self):
+        from app import create_app
+        from app.models import Car, User
+        user_id, car_id = self.create_user().id, self.create_car().id
+        headers = self.auth_headers()
+        # Same database, its own SimpleCache
+        other = create_app(self.config_class)
+        client = other.test_client()
+        etag = client.get('/api/payments/reservations', headers=headers).headers['ETag']
+
+        self.create_reservation(self.db.session.get(User, user_id), self.db.session.get(Car, car_id))
+        response = client.get('/api/payments/reservations', headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()), 1)
+        etag = response.headers['ETag']
+        response = client.get('/api/payments/reservations', headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.db.get_engine(other).dispose()
+
+class TestCarSearchIndex(InProcessTestCase):
+    def search(self, **params):
+        response = self.client.get('/api/cars/search', query_string=params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(car['id'] for car in response.get_json())
+
+    def test_index_matches_ilike_and_follows_writes(self):
+        from app.models import Car
+        from app.utils.search_index import search_index
+        cars = [
+            self.create_car(make='Toyota', model='Land Cruiser'),
+            self.create_car(make='Mercedes-Benz', model='GLE Coupe'),
+            self.create_car(make='Ford', model='Bronco'),
+            self.create_car(make='Toyota', model='Corolla Cross'),
+        ]
+        for field in ('make', 'model'):
+            column = getattr(Car, field)
+            for text in ('toy', 'OYOT', 'cross', 'benz', 'ro', 'cruiserX', 'o'):
+                expected = sorted(c.id for c in Car.query.filter(column.ilike(f'%{text}%')))
+                self.assertEqual(self.search(**{field: text}), expected, (field, text))
+        self.assertEqual(search_index.match_ids('model', 'ro'), None)
+
+        cars[2].model = 'Maverick'
+        self.db.session.delete(cars[1])
+        new_car = self.create_car(make='Land Rover', model='Defender')
+        self.assertEqual(search_index.match_ids('model', 'bronco'), set())
+        self.assertEqual(search_index.match_ids('make', 'benz'), set())
+        self.assertEqual(search_index.match_ids('make', 'land'), {new_car.id})
+        self.assertEqual(self.search(make='toyota', model='cross'), [cars[3].id])
+
+    def test_index_follows_writes_of_other_processes(self):
+        from app import create_app
+        from app.models import Car
+        self.create_car(make='Toyota', model='Corolla')
+        # Same database, its own index
+        other = create_app(self.config_class)
+        client = other.test_client()
+        response = client.get('/api/cars/search', query_string={'make': 'land'})
+        self.assertEqual(response.get_json(), [])
+
+        car_id = self.create_car(make='Land Rover', model='Defender').id
+        response = client.get('/api/cars/search', query_string={'make': 'land'})
+        self.assertEqual([car['id'] for car in response.get_json()], [car_id])
+        self.db.session.delete(self.db.session.get(Car, car_id))
+        self.db.session.commit()
+        response = client.get('/api/cars/search', query_string={'make': 'land'})
+        self.assertEqual(response.get_json(), [])
+        self.db.get_engine(other).dispose()
+
+class TestSearchFacets(InProcessTestCase):
+    def test_facets_count_matching_cars_in_one_query(self):
+        self.create_car(price_per_day=40)
+        self.create_car(make='Toyota', model='RAV4', price_per_day=80, vehicle_type='suv')
+        self.create_car(make='Jeep', model='Wrangler', price_per_day=120,
+                        vehicle_type='4x4', location='mountains')
+        self.create_car(make='Toyota', model='Supra', price_per_day=250, vehicle_type='luxury')
+        self.client.get('/api/cars/search?make=jeep')  # load the search index
+
+        with self.count_queries() as queries:
+            response = self.client.get('/api/cars/search?make=toyota&facets=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([q for q in queries if 'data_versions' not in q]), 1)
+        data = response.get_json()
+        self.assertEqual(len(data['cars']), 3)
+        self.assertEqual(data['facets'], {
+            'vehicle_type': {'sedan': 1, 'suv': 1, 'luxury': 1},
+            'location': {'city': 3},
+            'category': {'medium': 2, 'small': 1},
+            'price': {'0-50': 1, '50-100': 1, '200+': 1}
+        })
+
+        # Plain searches keep returning a list and are cached separately
+        plain = self.client.get('/api/cars/search?make=toyota').get_json()
+        self.assertEqual(plain, data['cars'])
+
+class TestAdminClaims(InProcessTestCase):
+    def test_admin_checks_use_token_claims(self):
+        from flask_jwt_extended import create_access_token
+        from app.utils.admin_access import admin_roles
+        admin = self.create_user('admin@rental.com', 'admin123', admin=True)
+        admin_id = admin.id
+        self.create_user()
+        admin_headers = self.auth_headers('admin@rental.com', 'admin123')
+        client_headers = self.auth_headers('client@example.com', 'client123')
+
+        def user_queries(statements):
+            return [s for s in statements if 'FROM users' in s]
+
+        self.assertEqual(self.client.get('/api/admin/cache-stats', headers=admin_headers).status_code, 200)
+        with self.count_queries() as queries:
+            self.assertEqual(self.client.get('/api/admin/cache-stats', headers=admin_headers).status_code, 200)
+            self.assertEqual(self.client.get('/api/admin/cache-stats', headers=client_headers).status_code, 403)
+        self.assertEqual(user_queries(queries), [])
+
+        admin_roles.revoke(admin_id)
+        self.assertEqual(self.client.get('/api/admin/cache-stats', headers=admin_headers).status_code, 403)
+        admin_roles.forget(admin_id)
+        self.assertEqual(self.client.get('/api/admin/cache-stats', headers=admin_headers).status_code, 200)
+
+        # Demoting the admin takes effect on the next request despite the claims
+        admin = self.db.session.get(type(admin), admin_id)
+        admin.role = 'client'
+        self.db.session.commit()
+        self.assertEqual(self.client.get('/api/admin/cache-stats', headers=admin_headers).status_code, 403)
+
+        # Tokens issued without claims are checked against the database
+        admin.role = 'admin'
+        self.db.session.commit()
+        legacy = {'Authorization': f'Bearer {create_access_token(identity=admin_id)}'}
+        self.assertEqual(self.client.get('/api/admin/cache-stats', headers=legacy).status_code, 200)
+
+class TestQueryStats(InProcessTestCase):
+    def test_query_headers_slow_log_and_endpoint_stats(self):
+        from app.utils.query_stats import query_stats
+        query_stats.reset()
+        self.app.config['QUERY_STATS_HEADERS'] = True
+        car = self.create_car()
+
+        # The catalog version lookup, then the car on a cache miss only
+        response = self.client.get(f'/api/cars/{car.id}')
+        self.assertEqual(response.headers['X-Query-Count'], '2')
+        self.assertGreater(float(response.headers['X-DB-Time']), 0)
+        response = self.client.get(f'/api/cars/{car.id}')
+        self.assertEqual(response.headers['X-Query-Count'], '1')
+
+        self.app.config['SLOW_QUERY_THRESHOLD'] = 0
+        with self.assertLogs(self.app.logger, 'WARNING') as logs:
+            self.client.get('/api/cars/search?type=sedan')
+        self.assertIn('GET cars.search_cars', logs.output[0])
+        self.assertIn("'type': 'sedan'", logs.output[0])
+        self.app.config['SLOW_QUERY_THRESHOLD'] = 0.5
+
+        self.create_user('admin@rental.com', 'admin123', admin=True)
+        headers = self.auth_headers('admin@rental.com', 'admin123')
+        stats = self.client.get('/api/admin/query-stats', headers=headers).get_json()
+        self.assertEqual(stats['cars.get_car_details']['requests'], 2)
+        self.assertEqual(stats['cars.get_car_details']['queries'], 3)
+        self.assertEqual(stats['cars.get_car_details']['max_queries'], 2)
+
+class TestMetrics(InProcessTestCase):
+    def parse(self, text):
+        samples = {}
+        for line in text.splitlines():
+            if line and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_metrics_exposition(self):
+        car = self.create_car()
+        before = self.parse(self.client.get('/metrics').get_data(as_text=True))
+        self.client.get(f'/api/cars/{car.id}')
+        self.client.get(f'/api/cars/{car.id}')
+        self.client.get('/api/cars/999999')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.mimetype.startswith('text/plain'))
+        samples = self.parse(response.get_data(as_text=True))
+        labels = 'blueprint="cars",endpoint="cars.get_car_details",method="GET"'
+
+        def delta(name):
+            return samples.get(name, 0) - before.get(name, 0)
+
+        self.assertEqual(delta(f'http_requests_total{{{labels},status="200"}}'), 2)
+        self.assertEqual(delta(f'http_requests_total{{{labels},status="404"}}'), 1)
+        self.assertEqual(delta(f'http_request_duration_seconds_count{{{labels}}}'), 3)
+        self.assertEqual(delta(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}}'), 3)
+        self.assertEqual(samples['http_requests_in_flight'], 1)  # the scrape itself
+        self.assertGreater(samples['db_pool_checkouts_total'], 0)
+        self.assertGreaterEqual(delta('catalog_cache_hits_total'), 1)
+        self.assertIn('catalog_cache_hit_ratio', samples)
+
+    def test_snapshots_aggregated_across_processes(self):
+        import shutil
+        import subprocess
+        import sys
+        from app.utils.metrics import metrics
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        self.addCleanup(setattr, metrics, '_metrics_dir', metrics._metrics_dir)
+        metrics._metrics_dir = metrics_dir
+
+        # A worker that has exited: its counters stay, its gauges do not
+        worker = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                capture_output=True, text=True)
+        dead_pid = int(worker.stdout)
+        with open(os.path.join(metrics_dir, f'metrics-{dead_pid}.json'), 'w') as f:
+            json.dump({
+                'requests': {'cars.get_cars|GET|200': 5},
+                'latency': {'cars.get_cars|GET': [5] + [0] * 11 + [0.01]},
+                'in_flight': 3,
+                'pool': {'checkout': 7, 'checkin': 4},
+                'cache': {'hits': 10, 'misses': 0}
+            }, f)
+
+        local = metrics.snapshot()
+        samples = self.parse(self.client.get('/metrics').get_data(as_text=True))
+        labels = 'blueprint="cars",endpoint="cars.get_cars",method="GET"'
+        self.assertEqual(
+            samples[f'http_requests_total{{{labels},status="200"}}'],
+            local['requests'].get('cars.get_cars|GET|200', 0) + 5
+        )
+        self.assertEqual(samples['http_requests_in_flight'], 1)
+        self.assertEqual(samples['catalog_cache_hits_total'], local['cache']['hits'] + 10)
+        self.assertTrue(os.path.exists(os.path.join(metrics_dir, f'metrics-{os.getpid()}.json')))
+
+class TestSeed(InProcessTestCase):
+    def test_seed_inserts_consistent_non_overlapping_data(self):
+        from app.models import Car, Favorite, Payment, Refund, Reservation, User
+        from app.utils.availability import availability
+        from app.utils.seed import DEFAULT_PASSWORD, seed_database
+        from app.utils.stats import rollups
+        counts = seed_database(users=20, cars=10, reservations=205, seed=7, chunk_size=50)
+        self.assertEqual(counts['users'], 20)
+        self.assertEqual(counts['reservations'], 205)
+        self.assertEqual(Reservation.query.count(), 205)
+        self.assertEqual(Favorite.query.count(), counts['favorites'])
+        self.assertEqual(Payment.query.count(), counts['payments'])
+        self.assertEqual(Refund.query.count(), counts['refunds'])
+        self.assertEqual(rollups.verify(), [])
+        self.assertEqual(availability.verify(), [])
+
+        # No two stays of a car overlap
+        for car in Car.query:
+            stays = sorted((r.start_date, r.end_date) for r in car.reservations)
+            for (_, end), (start, _) in zip(stays, stays[1:]):
+                self.assertLess(end, start)
+
+        user = User.query.first()
+        self.assertEqual(user.driving_license[:2], 'DL')
+        response = self.client.post('/api/auth/login', json={'email': user.email, 'password': DEFAULT_PASSWORD})
+        self.assertEqual(response.status_code, 200)
+
+        # A second run adds to the same database
+        seed_database(users=5, cars=2, reservations=10, seed=7)
+        self.assertEqual(User.query.count(), 25)
+        self.assertEqual(Reservation.query.count(), 215)
+
+class TestConcurrentBooking(InProcessTestCase):
+    def test_parallel_bookings_never_overlap(self):
+        import random
+        from concurrent.futures import ThreadPoolExecutor
+        from app.models import Reservation
+        from app.utils.availability import availability
+        car_id = self.create_car().id
+        self.create_user()
+        headers = self.auth_headers('client@example.com', 'client123')
+        today = datetime.now().date()
+        rng = random.Random(1)
+        windows = []
+        for _ in range(300):
+            start = today + timedelta(days=rng.randint(1, 120))
+            windows.append((start, start + timedelta(days=rng.randint(1, 5))))
+
+        def book(window):
+            start, end = window
+            response = self.app.test_client().post('/api/cars/reserve', headers=headers, json={
+                'car_id': car_id, 'start_date': start.isoformat(), 'end_date': end.isoformat()
+            })
+            return response.status_code
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            statuses = list(pool.map(book, windows))
+        self.assertEqual(set(statuses) - {201, 400}, set())
+        self.assertGreater(statuses.count(201), 0)
+
+        stays = sorted((r.start_date, r.end_date) for r in Reservation.query.filter_by(car_id=car_id))
+        self.assertEqual(len(stays), statuses.count(201))
+        for (_, end), (start, _) in zip(stays, stays[1:]):
+            self.assertLess(end, start)
+        self.assertEqual(availability.verify(), [])
+
+class TestQuotes(InProcessTestCase):
+    def test_quotes_match_reservation_prices(self):
+        from app.models import Reservation
+        cheap = self.create_car(price_per_day=40.5)
+        pricey = self.create_car(price_per_day=199.99)
+        self.create_car(price_per_day=10, status='maintenance')
+        self.create_user()
+        headers = self.auth_headers('client@example.com', 'client123')
+        today = datetime.now().date()
+        ranges = [(today + timedelta(days=1), today + timedelta(days=4)),
+                  (today + timedelta(days=10), today + timedelta(days=45))]
+
+        response = self.client.get('/api/cars/quotes', query_string=[
+            ('range', f'{start},{end}') for start, end in ranges
+        ])
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['rental_types'], ['daily', 'monthly', 'yearly'])
+        self.assertEqual([q['car_id'] for q in data['quotes']], [cheap.id, pricey.id])
+        self.assertEqual(data['quotes'][0]['prices'][0], [121.5, 1093.5, 11826.0])
+
+        # Every quote is exactly what booking that car would charge
+        for quote in data['quotes']:
+            for (start, end), prices in zip(ranges, quote['prices']):
+                for rental_type, price in zip(data['rental_types'], prices):
+                    response = self.client.post('/api/cars/reserve', headers=headers, json={
+                        'car_id': quote['car_id'], 'start_date': start.isoformat(),
+                        'end_date': end.isoformat(), 'rental_type': rental_type
+                    })
+                    self.assertEqual(response.status_code, 201)
+                    self.assertAlmostEqual(response.get_json()['total_price'], price, places=2)
+                    self.db.session.delete(Reservation.query.get(response.get_json()['reservation_id']))
+                    self.db.session.commit()
+
+        response = self.client.get('/api/cars/quotes', query_string={
+            'range': f'{ranges[1][0]},{ranges[1][1]}', 'rental_type': 'daily', 'car_id': pricey.id
+        })
+        self.assertEqual(response.get_json()['quotes'], [
+            {'car_id': pricey.id, 'price_per_day': 199.99, 'prices': [[6999.65]]}
+        ])
+
+    def test_quotes_validation(self):
+        self.assertEqual(self.client.get('/api/cars/quotes').status_code, 400)
+        self.assertEqual(self.client.get('/api/cars/quotes?range=2030-01-05,2030-01-01').status_code, 400)
+        self.assertEqual(self.client.get('/api/cars/quotes?range=tomorrow').status_code, 400)
+        response = self.client.get('/api/cars/quotes?range=2030-01-01,2030-01-05&rental_type=weekly')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['invalid'], ['weekly'])
+
+class TestBulkReservations(InProcessTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user()
+        self.headers = self.auth_headers()
+        self.cars = [self.create_car(price_per_day=40 + i) for i in range(4)]
+        self.start = datetime.now().date() + timedelta(days=5)
+
+    def item(self, car, offset=0, days=3, **extra):
+        start = self.start + timedelta(days=offset)
+        return dict(car_id=car.id, start_date=start.isoformat(),
+                    end_date=(start + timedelta(days=days)).isoformat(), **extra)
+
+    def bulk(self, items, mode=None):
+        body = {'reservations': items}
+        if mode:
+            body['mode'] = mode
+        return self.client.post('/api/cars/reserve/bulk', headers=self.headers, json=body)
+
+    def test_books_all_items_in_one_transaction(self):
+        from app.models import Reservation
+        items = [self.item(car) for car in self.cars] + [self.item(self.cars[0], offset=10, rental_type='monthly')]
+        response = self.bulk(items)
+        self.assertEqual(response.status_code, 201)
+        data = response.get_json()
+        self.assertEqual(data['created'], 5)
+        self.assertEqual([r['status'] for r in data['results']], ['created'] * 5)
+        self.assertEqual(data['results'][1]['total_price'], 123.0)
+        self.assertEqual(data['results'][4]['total_price'], 1080.0)
+        ids = [r['reservation_id'] for r in data['results']]
+        self.assertEqual(Reservation.query.filter(Reservation.id.in_(ids)).count(), 5)
+
+    def test_all_or_nothing_books_nothing_when_one_item_fails(self):
+        from app.models import Reservation
+        self.create_reservation(self.user, self.cars[2], start_offset=6)
+        response = self.bulk([self.item(car) for car in self.cars] + [{'car_id': 999999, 'start_date': 'soon'}])
+        self.assertEqual(response.status_code, 400)
+        results = response.get_json()['results']
+        self.assertEqual([r['status'] for r in results], ['aborted', 'aborted', 'failed', 'aborted', 'failed'])
+        self.assertEqual(results[2]['error'], 'Car not available')
+        self.assertEqual(len(results[2]['conflicting_reservations']), 1)
+        self.assertEqual(results[4]['missing'], ['end_date'])
+        self.assertEqual(Reservation.query.count(), 1)
+
+    def test_best_effort_books_the_rest(self):
+        from app.models import Reservation
+        from app.utils.stats import rollups
+        self.create_reservation(self.user, self.cars[2], start_offset=6)
+        # Only cars[2] has a per-car count row; the others get theirs inserted
+        rollups.rebuild()
+        items = [self.item(car) for car in self.cars] + [
+            self.item(self.cars[0], offset=2),           # overlaps item 0
+            {**self.item(self.cars[1], offset=20), 'car_id': 999999},
+            self.item(self.cars[1], offset=20, rental_type='weekly'),
+        ]
+        response = self.bulk(items, mode='best_effort')
+        self.assertEqual(response.status_code, 207)
+        data = response.get_json()
+        self.assertEqual([r['status'] for r in data['results']],
+                         ['created', 'created', 'failed', 'created', 'failed', 'failed', 'failed'])
+        self.assertEqual(data['results'][4]['conflicting_items'], [0])
+        self.assertEqual(data['results'][5]['status_code'], 404)
+        self.assertEqual(data['results'][6]['error'], 'Invalid rental type')
+        self.assertEqual((data['created'], data['failed']), (3, 4))
+        self.assertEqual(Reservation.query.count(), 4)
+        self.assertEqual(rollups.verify(), [])
+
+    def test_checks_availability_with_constant_queries(self):
+        self.bulk([self.item(self.cars[0], offset=100)])
+        statements = {}
+        for size in (4, 24):
+            cars = [self.create_car() for _ in range(size - len(self.cars))] + self.cars
+            items = [self.item(car, offset=size) for car in cars]
+            with self.count_queries() as queries:
+                response = self.bulk(items)
+            self.assertEqual(response.status_code, 201)
+            statements[size] = [q for q in queries if not q.startswith('INSERT')]
+        self.assertEqual(len(statements[4]), len(statements[24]))
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.bulk([]).status_code, 400)
+        self.assertEqual(self.bulk([self.item(self.cars[0])], mode='some').status_code, 400)
+        self.assertEqual(self.client.post('/api/cars/reserve/bulk', headers=self.headers,
+                                          json=[self.item(self.cars[0])]).status_code, 400)
+        self.assertEqual(self.client.post('/api/cars/reserve/bulk', json={'reservations': []}).status_code, 401)
+
+class TestPaymentQueue(InProcessTestCase):
+    def setUp(self):
+        super().setUp()
+        from app.utils.payment_queue import FakeProcessor
+        self.processor = self.app.extensions['payment_queue'].processor = FakeProcessor()
+        self.user = self.create_user()
+        self.headers = self.auth_headers()
+        self.car = self.create_car()
+
+    def pay(self, reservation, method='credit_card'):
+        return self.client.post('/api/payments/process', headers=self.headers,
+                                json={'reservation_id': reservation.id, 'method': method})
+
+    def status(self, payment_id, **params):
+        return self.client.get(f'/api/payments/{payment_id}', headers=self.headers, query_string=params)
+
+    def test_payment_is_queued_then_settled(self):
+        from app.models import Reservation
+        from app.utils.payment_queue import payment_queue
+        from app.utils.stats import rollups
+        rollups.rebuild()
+        reservation = self.create_reservation(self.user, self.car)
+        response = self.pay(reservation)
+        self.assertEqual(response.status_code, 202)
+        payment_id = response.get_json()['payment_id']
+        self.assertEqual(response.get_json()['status'], 'pending')
+        self.assertTrue(response.headers['Location'].endswith(f'/api/payments/{payment_id}'))
+
+        # Retrying while pending returns the same payment
+        response = self.pay(reservation)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.get_json()['payment_id'], payment_id)
+        self.assertEqual(self.status(payment_id).get_json()['status'], 'pending')
+        self.assertEqual(rollups.read()['revenue'], 0)
+
+        self.assertEqual(payment_queue.run_pending(), 1)
+        data = self.status(payment_id).get_json()
+        self.assertEqual(data['status'], 'completed')
+        self.assertEqual(data['reservation_status'], 'confirmed')
+        self.assertIn(data['transaction_id'], self.processor.charges().values())
+        self.assertEqual(self.db.session.get(Reservation, reservation.id).status, 'confirmed')
+        self.assertEqual(rollups.read()['revenue'], 100)
+        self.assertEqual(rollups.verify(), [])
+        self.assertEqual(self.pay(reservation).status_code, 400)
+        self.assertEqual(payment_queue.run_pending(), 0)
+
+    def test_transient_errors_retry_with_the_same_key(self):
+        from app.models import PaymentJob
+        from app.utils.payment_queue import payment_queue
+        self.processor.fail_times = 2
+        payment_id = self.pay(self.create_reservation(self.user, self.car)).get_json()['payment_id']
+        payment_queue.run_pending()
+        job = PaymentJob.query.filter_by(payment_id=payment_id).one()
+        self.assertEqual((job.status, job.attempts), ('succeeded', 3))
+        self.assertEqual(list(self.processor.charges()), [job.idempotency_key])
+
+        # Out of attempts the payment fails
+        self.app.config['PAYMENT_MAX_ATTEMPTS'] = 2
+        payment_id = self.pay(self.create_reservation(self.user, self.car, start_offset=10)).get_json()['payment_id']
+        payment_queue.run_pending()
+        data = self.status(payment_id).get_json()
+        self.assertEqual((data['status'], data['attempts']), ('failed', 2))
+        self.assertEqual(data['error'], 'Payment processor unreachable')
+
+    def test_declined_payment_can_be_paid_again(self):
+        from app.models import PaymentJob
+        from app.utils.payment_queue import payment_queue
+        self.processor.decline_methods = {'bank_transfer'}
+        reservation = self.create_reservation(self.user, self.car)
+        payment_id = self.pay(reservation, 'bank_transfer').get_json()['payment_id']
+        payment_queue.run_pending()
+        data = self.status(payment_id).get_json()
+        self.assertEqual((data['status'], data['attempts']), ('failed', 1))
+        self.assertEqual(data['reservation_status'], 'pending')
+        declined_key = PaymentJob.query.filter_by(payment_id=payment_id).one().idempotency_key
+
+        response = self.pay(reservation)
+        self.assertEqual((response.status_code, response.get_json()['payment_id']), (202, payment_id))
+        payment_queue.run_pending()
+        self.assertEqual(self.status(payment_id).get_json()['status'], 'completed')
+        self.assertNotIn(declined_key, self.processor.charges())
+
+    def test_expired_lease_is_claimed_again(self):
+        from app.models import PaymentJob
+        from app.utils.payment_queue import payment_queue
+        payment_id = self.pay(self.create_reservation(self.user, self.car)).get_json()['payment_id']
+        job = PaymentJob.query.filter_by(payment_id=payment_id).one()
+        job.status, job.attempts = 'processing', 1
+        job.locked_until = datetime.utcnow() + timedelta(seconds=30)
+        self.db.session.commit()
+        self.assertEqual(payment_queue.run_pending(), 0)
+
+        job.locked_until = datetime.utcnow() - timedelta(seconds=1)
+        self.db.session.commit()
+        self.assertEqual(payment_queue.run_pending(), 1)
+        self.assertEqual(self.status(payment_id).get_json()['status'], 'completed')
+
+    def test_worker_threads_and_long_poll(self):
+        import time
+        self.app.config['PAYMENT_WORKER_THREADS'] = 2
+        self.processor.latency = 0.2
+        payment_ids = [
+            self.pay(self.create_reservation(self.user, self.car, start_offset=offset)).get_json()['payment_id']
+            for offset in (1, 10, 20)
+        ]
+        started = time.monotonic()
+        for payment_id in payment_ids:
+            self.assertEqual(self.status(payment_id, wait=10).get_json()['status'], 'completed')
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(len(self.app.extensions['payment_queue'].threads), 2)
+        self.assertEqual(len(self.processor.charges()), 3)
+
+    def test_payment_validation(self):
+        reservation = self.create_reservation(self.user, self.car)
+        self.assertEqual(self.pay(reservation, 'cash').status_code, 400)
+        other = self.create_user('other@example.com', 'other123')
+        foreign = self.create_reservation(other, self.car, start_offset=10)
+        self.assertEqual(self.pay(foreign).status_code, 404)
+        payment_id = self.pay(reservation).get_json()['payment_id']
+        other_headers = self.auth_headers('other@example.com', 'other123')
+        self.assertEqual(self.client.get(f'/api/payments/{payment_id}', headers=other_headers).status_code, 404)
+
+    def test_worker_releases_recorded_queries_between_passes(self):
+        from unittest import mock
+        from flask_sqlalchemy import get_debug_queries
+        from app.utils.payment_queue import payment_queue
+        self.pay(self.create_reservation(self.user, self.car))
+        self.app.config['PAYMENT_POLL_INTERVAL'] = 0
+        run_pending = payment_queue.run_pending
+        recorded = []
+
+        def counting_run_pending(limit=None):
+            before = len(get_debug_queries())
+            settled = run_pending(limit)
+            recorded.append((before, len(get_debug_queries())))
+            if len(recorded) == 5:
+                self.app.extensions['payment_queue'].stopping.set()
+            return settled
+
+        with mock.patch.object(payment_queue, 'run_pending', side_effect=counting_run_pending):
+            payment_queue.work(self.app)
+        self.assertEqual([before for before, _ in recorded], [0] * 5)
+        self.assertTrue(all(after > 0 for _, after in recorded))
+
+class TestIdempotencyKeys(InProcessTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user()
+        self.headers = self.auth_headers()
+        self.car = self.create_car()
+        self.car_id = self.car.id
+
+    def reserve(self, key=None, start_offset=1, client=None):
+        start = datetime.now().date() + timedelta(days=start_offset)
+        headers = dict(self.headers, **({'Idempotency-Key': key} if key is not None else {}))
+        return (client or self.client).post('/api/cars/reserve', headers=headers, json={
+            'car_id': self.car_id, 'start_date': start.isoformat(),
+            'end_date': (start + timedelta(days=2)).isoformat()
+        })
+
+    def test_duplicate_key_replays_the_response(self):
+        from app.models import Reservation
+        first = self.reserve('key-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first.headers)
+        with self.count_queries() as statements:
+            second = self.reserve('key-1')
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.get_json(), first.get_json())
+        self.assertFalse([s for s in statements if 'reservations' in s])
+        self.assertEqual(Reservation.query.count(), 1)
+
+        # Same key, different request
+        self.assertEqual(self.reserve('key-1', start_offset=10).status_code, 422)
+        # Keys are scoped to the user
+        self.create_user('other@example.com', 'other123')
+        self.headers = self.auth_headers('other@example.com', 'other123')
+        self.assertEqual(self.reserve('key-1', start_offset=10).status_code, 201)
+        self.assertEqual(self.reserve('', start_offset=20).status_code, 400)
+        self.assertEqual(self.reserve('x' * 256, start_offset=20).status_code, 400)
+
+    def test_requests_without_key_are_unchanged(self):
+        from app.models import IdempotencyKey
+        self.assertEqual(self.reserve().status_code, 201)
+        self.assertEqual(self.reserve().status_code, 400)
+        self.assertEqual(IdempotencyKey.query.count(), 0)
+
+    def test_failed_requests_are_replayed_but_errors_free_the_key(self):
+        from unittest import mock
+        from app.models import IdempotencyKey, Reservation
+        self.create_reservation(self.user, self.car)
+        self.assertEqual(self.reserve('key-1').status_code, 400)
+        self.assertEqual(self.reserve('key-1').headers['Idempotent-Replayed'], 'true')
+
+        with mock.patch('app.routes.api.cars.reserve', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.reserve('key-2', start_offset=10)
+        self.assertEqual(IdempotencyKey.query.count(), 1)
+        self.assertEqual(self.reserve('key-2', start_offset=10).status_code, 201)
+        self.assertEqual(Reservation.query.count(), 2)
+
+    def test_concurrent_duplicates_run_once(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from app.models import Reservation
+
+        def reserve(_):
+            response = self.reserve('key-1', client=self.app.test_client())
+            return response.status_code, response.get_json()['reservation_id']
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(reserve, range(8)))
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(results[0][0], 201)
+        self.assertEqual(Reservation.query.count(), 1)
+
+    def test_abandoned_and_expired_keys_run_again(self):
+        from app.models import IdempotencyKey, Reservation
+        from app.utils.idempotency import idempotency_keys
+        self.assertEqual(self.reserve('key-1').status_code, 201)
+        record = IdempotencyKey.query.one()
+        record.expires_at = datetime.utcnow() - timedelta(seconds=1)
+        self.db.session.commit()
+        # Expired: the request runs again and hits the first booking
+        response = self.reserve('key-1')
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('Idempotent-Replayed', response.headers)
+
+        # A request that died holds its key until the lock times out
+        record = IdempotencyKey.query.one()
+        record.status_code, record.locked_until = None, datetime.utcnow() + timedelta(seconds=30)
+        self.db.session.commit()
+        self.app.config['IDEMPOTENCY_WAIT'] = 0
+        response = self.reserve('key-1')
+        self.assertEqual((response.status_code, response.headers['Retry-After']), (409, '1'))
+        record.locked_until = datetime.utcnow() - timedelta(seconds=1)
+        self.db.session.commit()
+        self.assertEqual(self.reserve('key-1').status_code, 400)
+        self.assertEqual(Reservation.query.count(), 1)
+
+        IdempotencyKey.query.update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+        self.db.session.commit()
+        self.assertEqual(idempotency_keys.purge(), 1)
+        self.assertEqual(IdempotencyKey.query.count(), 0)
+
+    def test_payment_and_refund_replays(self):
+        from app.models import Payment, Refund
+        reservation = self.create_reservation(self.user, self.car)
+        headers = dict(self.headers, **{'Idempotency-Key': 'pay-1'})
+        first = self.client.post('/api/payments/process', headers=headers,
+                                 json={'reservation_id': reservation.id})
+        second = self.client.post('/api/payments/process', headers=headers,
+                                  json={'reservation_id': reservation.id})
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual(second.headers['Location'], first.headers['Location'])
+        self.assertEqual(second.get_json(), first.get_json())
+        self.assertEqual(Payment.query.count(), 1)
+
+        cancelled = self.create_reservation(self.user, self.car, start_offset=10, status='cancelled')
+        headers = dict(self.headers, **{'Idempotency-Key': 'refund-1'})
+        for _ in range(2):
+            response = self.client.post('/api/refunds/', headers=headers,
+                                        json={'reservation_id': cancelled.id})
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(Refund.query.count(), 1)
+
+class TestSessionEvents(InProcessTestCase):
+    def test_changes_apply_on_commit_only(self):
+        from app.models import Car
+        from app.utils.session_events import on_commit, remove
+        applied = []
+        on_commit('test_cars_changed', lambda session, pending: pending.update(
+            obj.make for obj in session.new if isinstance(obj, Car)
+        ), lambda session, pending: applied.append(sorted(pending)))
+        self.addCleanup(remove, 'test_cars_changed')
+
+        self.db.session.add(Car(make='Lada', model='Niva', year=2020, price_per_day=20,
+                                vehicle_type='suv', location='city'))
+        self.db.session.flush()
+        self.db.session.rollback()
+        self.create_car()
+        self.create_car(make='Fiat')
+        self.assertEqual(applied, [['Toyota'], ['Fiat']])
+
+        remove('test_cars_changed')
+        self.create_car(make='Kia')
+        self.assertEqual(len(applied), 2)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file